@@ -0,0 +1,30 @@
+import pytest
+
+from napari_ome_zarr_roi_loader.store_cache import store_cache
+from napari_ome_zarr_roi_loader.synthetic import make_ome_zarr_image
+
+
+@pytest.fixture(scope="session")
+def synthetic_image(tmp_path_factory):
+    """
+    Synthetic image of 2 x 2160 x 2560 pixels (2 channels, 4 levels) with a
+    nuclei label image (~9600 objects), 16 FOVs & a feature table with 50
+    feature columns
+    """
+    return make_ome_zarr_image(
+        tmp_path_factory.mktemp("benchmark") / "synthetic.zarr",
+        shape_zyx=(2, 2160, 2560),
+        channels=("DAPI", "GFP"),
+        nb_levels=4,
+        chunks_zyx=(1, 540, 640),
+        nb_rois=16,
+        nb_feature_columns=50,
+    )
+
+
+@pytest.fixture
+def cold_cache():
+    # Empties the metadata & table cache before & after the benchmark
+    store_cache.clear()
+    yield store_cache.clear
+    store_cache.clear()
@@ -0,0 +1,22 @@
+import numpy as np
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+from napari_ome_zarr_roi_loader.utils import load_label_roi
+
+
+def test_add_feature_table_to_layer(benchmark, qapp, synthetic_image):
+    zarr_url = synthetic_image["zarr_url"]
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = zarr_url
+    lbl_roi, scale = load_label_roi(zarr_url, "FOV_6", "nuclei")
+    label_layer = viewer.add_labels(lbl_roi, scale=scale, name="nuclei")
+
+    benchmark(
+        widget.add_feature_table_to_layer,
+        "nuclei_features",
+        label_layer,
+        "FOV_6",
+    )
+    assert len(label_layer.features) == len(np.unique(lbl_roi)) - 1
@@ -0,0 +1,56 @@
+from napari_ome_zarr_roi_loader.synthetic import make_roi_table
+from napari_ome_zarr_roi_loader.utils import (
+    convert_ROI_table_to_indices,
+    get_closest_scale,
+    load_intensity_roi,
+    load_label_roi,
+)
+
+
+def test_convert_ROI_table_to_indices(benchmark):
+    roi_table = make_roi_table(10000, (100, 100000, 100000), (1.0, 0.5, 0.5))
+    indices = benchmark(
+        convert_ROI_table_to_indices, roi_table, (1.0, 0.5, 0.5)
+    )
+    assert len(indices) == 10000
+
+
+def test_get_closest_scale(benchmark):
+    scales = {
+        str(level): [1.0, 1.0, 0.1625 * 2**level, 0.1625 * 2**level]
+        for level in range(10)
+    }
+    target_scale = [1.0, 1.0, 1.3, 1.3]
+    assert benchmark(get_closest_scale, target_scale, scales) == "3"
+
+
+def test_load_intensity_roi(benchmark, synthetic_image):
+    img_roi, _ = benchmark(
+        load_intensity_roi, synthetic_image["zarr_url"], "FOV_6", 1
+    )
+    assert img_roi.shape == (2, 540, 640)
+
+
+def test_load_intensity_roi_cold(benchmark, synthetic_image, cold_cache):
+    # Includes reading the metadata & ROI table on every round
+    img_roi, _ = benchmark.pedantic(
+        load_intensity_roi,
+        args=(synthetic_image["zarr_url"], "FOV_6", 1),
+        setup=cold_cache,
+        rounds=10,
+    )
+    assert img_roi.shape == (2, 540, 640)
+
+
+def test_load_intensity_roi_low_res(benchmark, synthetic_image):
+    img_roi, _ = benchmark(
+        load_intensity_roi, synthetic_image["zarr_url"], "FOV_6", 0, level=3
+    )
+    assert img_roi.shape == (2, 67, 80)
+
+
+def test_load_label_roi(benchmark, synthetic_image):
+    lbl_roi, _ = benchmark(
+        load_label_roi, synthetic_image["zarr_url"], "FOV_6", "nuclei"
+    )
+    assert lbl_roi.shape == (2, 540, 640)
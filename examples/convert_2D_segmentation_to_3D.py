@@ -1,19 +1,21 @@
 """Fractal task to convert 2D segmentations into 3D segmentations"""
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import anndata as ad
-import dask.array as da
 import numpy as np
 import zarr
 from pydantic.decorator import validate_arguments
 from fractal_tasks_core.ngff.zarr_utils import load_NgffImageMeta 
 from fractal_tasks_core.labels import prepare_label_group
-from fractal_tasks_core.pyramids import build_pyramid
 from fractal_tasks_core.tables import write_table
 
 logger = logging.getLogger(__name__)
 
+# Number of Z chunks that are written at the same time
+MAX_WRITE_WORKERS = 8
+
 
 def read_table_and_attrs(zarr_url: Path, roi_table):
     table_url = zarr_url / f"tables/{roi_table}"
@@ -69,6 +71,46 @@ def make_zattrs_3D(attrs, z_pixel_size, new_label_name):
     return attrs
 
 
+def replicate_along_z(label_2D, label_3D, executor):
+    """
+    Writes a 2D label array into every Z plane of a 3D label array
+
+    The 3D array is processed chunk column by chunk column: each YX chunk of
+    the 2D array is read once & written into all Z chunks below it in
+    parallel. Only one 2D chunk is held in memory at a time (the Z chunks are
+    broadcast views of it), so the memory use doesn't depend on the number
+    of Z planes.
+
+    params: label_2D: zarr array of shape (y, x) or (1, y, x)
+            label_3D: zarr array of shape (z, y, x) with the same YX shape
+            executor: Executor the Z chunks are written with
+    """
+    nb_z, size_y, size_x = label_3D.shape
+    chunk_z, chunk_y, chunk_x = label_3D.chunks
+    if tuple(label_2D.shape[-2:]) != (size_y, size_x):
+        raise ValueError(
+            f"The 2D label image has the shape {label_2D.shape}, which does "
+            f"not match the YX shape of the 3D label image {label_3D.shape}"
+        )
+    z_slices = [
+        slice(z, min(z + chunk_z, nb_z)) for z in range(0, nb_z, chunk_z)
+    ]
+    leading = (0,) * (label_2D.ndim - 2)
+    for y in range(0, size_y, chunk_y):
+        for x in range(0, size_x, chunk_x):
+            region = (slice(y, y + chunk_y), slice(x, x + chunk_x))
+            chunk = label_2D[leading + region].astype(label_3D.dtype)
+
+            def write(z_slice, region=region, chunk=chunk):
+                nb_planes = z_slice.stop - z_slice.start
+                label_3D[(z_slice,) + region] = np.broadcast_to(
+                    chunk, (nb_planes,) + chunk.shape
+                )
+
+            # Consume the results to raise errors of the writes
+            list(executor.map(write, z_slices))
+
+
 def check_table_validity(new_table_names, old_table_names):
     if len(new_table_names) != len(old_table_names):
         raise ValueError(
@@ -143,14 +185,10 @@ def convert_2D_segmentation_to_3D(
         f"{new_label_name}."
     )
 
-    # 1a) Load a 2D label image
-    label_img = da.from_zarr(f"{zarr_url}/labels/{label_name}/{level}")
-    chunks = label_img.chunksize
-
-    # 1b) Get number z planes & Z spacing from 3D OME-Zarr file
-    with zarr.open(zarr_3D_url, mode="rw+") as zarr_img:
-        zarr_3D = da.from_zarr(zarr_img[0])
-        new_z_planes = zarr_3D.shape[-3]
+    # 1) Get number z planes, Z chunking & Z spacing from 3D OME-Zarr file
+    image_3D = zarr.open_group(str(zarr_3D_url), mode="r")["0"]
+    new_z_planes = image_3D.shape[-3]
+    chunk_z = image_3D.chunks[-3]
 
     image_meta = load_NgffImageMeta(zarr_3D_url)
     z_pixel_size = image_meta.get_pixel_sizes_zyx(level=0)[0]
@@ -171,38 +209,33 @@ def convert_2D_segmentation_to_3D(
         f"Helper function `prepare_label_group` returned {output_label_group=}"
     )
 
-    # 2) Create the 3D stack of the label image
-    label_img_3D = da.stack([label_img.squeeze()] * new_z_planes)
-
-    # 3) Save changed label image to OME-Zarr
+    # 2) Replicate every level of the 2D label pyramid along Z. The pyramid
+    # is only coarsened in XY, so the 3D levels are the replicated 2D levels
+    # & don't need to be recomputed from the 3D data
     label_dtype = np.uint32
-    store = zarr.storage.FSStore(f"{zarr_3D_url}/labels/{label_name}/0")
-    new_label_array = zarr.create(
-        shape=label_img_3D.shape,
-        chunks=chunks,
-        dtype=label_dtype,
-        store=store,
-        overwrite=False,
-        dimension_separator="/",
-    )
-
-    da.array(label_img_3D).to_zarr(
-        url=new_label_array,
-    )
-    logger.info(f"Saved {new_label_name} to 3D Zarr at full resolution")
-    # 4) Build pyramids for label image
-    label_meta = load_NgffImageMeta(zarr_url / "labels" / label_name)
-    build_pyramid(
-        zarrurl=f"{zarr_3D_url}/labels/{label_name}",
-        overwrite=overwrite,
-        num_levels=label_meta.num_levels,
-        coarsening_xy=label_meta.coarsening_xy,
-        chunksize=chunks,
-        aggregation_function=np.max,
-    )
-    logger.info(f"Built a pyramid for the {new_label_name} label image")
+    with ThreadPoolExecutor(max_workers=MAX_WRITE_WORKERS) as executor:
+        for dataset in label_attrs["multiscales"][0]["datasets"]:
+            path = dataset["path"]
+            label_2D = zarr.open_array(
+                str(zarr_url / "labels" / label_name / path), mode="r"
+            )
+            store = zarr.storage.FSStore(
+                f"{zarr_3D_url}/labels/{new_label_name}/{path}"
+            )
+            label_3D = zarr.create(
+                shape=(new_z_planes,) + label_2D.shape[-2:],
+                chunks=(chunk_z,) + label_2D.chunks[-2:],
+                dtype=label_dtype,
+                store=store,
+                overwrite=overwrite,
+                dimension_separator="/",
+            )
+            replicate_along_z(label_2D, label_3D, executor)
+            logger.info(
+                f"Saved level {path} of {new_label_name} to 3D Zarr"
+            )
 
-    # 5) Copy ROI tables
+    # 3) Copy ROI tables
     image_group = zarr.group(zarr_3D_url)
     if ROI_tables_to_copy:
         for i, ROI_table in enumerate(ROI_tables_to_copy):
@@ -0,0 +1,159 @@
+import shutil
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+import zarr
+
+from napari_ome_zarr_roi_loader.synthetic import ROI_COLUMNS, _multiscales
+
+
+@pytest.fixture
+def ome_zarr_image(tmp_path):
+    """
+    Small 2x2 FOV OME-Zarr image with 2 channels, a label image,
+    a FOV ROI table & a feature table
+    """
+    zarr_url = tmp_path / "plate.zarr" / "B" / "03" / "0"
+    pxl_sizes_zyx = [1.0, 0.5, 0.5]
+    nb_levels = 2
+    shape_zyx = (4, 32, 32)
+    rng = np.random.default_rng(42)
+
+    image_group = zarr.open_group(str(zarr_url), mode="w")
+    image_group.attrs["multiscales"] = _multiscales(
+        nb_levels, pxl_sizes_zyx, channel_axis=True
+    )
+    image_group.attrs["omero"] = {
+        "channels": [
+            {
+                "label": "DAPI",
+                "color": "00FFFF",
+                "window": {"start": 0, "end": 1000},
+            },
+            {
+                "label": "GFP",
+                "color": "00FF00",
+                "window": {"start": 0, "end": 500},
+            },
+        ]
+    }
+    img = rng.integers(1, 1000, size=(2,) + shape_zyx, dtype=np.uint16)
+    for level in range(nb_levels):
+        image_group.create_dataset(
+            str(level),
+            data=img[:, :, :: 2**level, :: 2**level],
+            chunks=(1, 1, 8, 8),
+        )
+
+    # Label image: One object per 8x8 block
+    lbl = np.zeros(shape_zyx, dtype=np.uint32)
+    for i in range(4):
+        for j in range(4):
+            s_y, s_x = i * 8 + 1, j * 8 + 1
+            e_y, e_x = s_y + 5, s_x + 5
+            lbl[:, s_y:e_y, s_x:e_x] = i * 4 + j + 1
+    labels_group = image_group.create_group("labels")
+    labels_group.attrs["labels"] = ["nuclei"]
+    label_group = labels_group.create_group("nuclei")
+    label_group.attrs["multiscales"] = _multiscales(
+        nb_levels, pxl_sizes_zyx, channel_axis=False
+    )
+    for level in range(nb_levels):
+        label_group.create_dataset(
+            str(level),
+            data=lbl[:, :: 2**level, :: 2**level],
+            chunks=(1, 8, 8),
+        )
+
+    # Tables
+    tables_group = image_group.create_group("tables")
+    tables_group.attrs["tables"] = ["FOV_ROI_table", "nuclei_features"]
+    fov_size = 16 * pxl_sizes_zyx[1]
+    roi_x = np.array(
+        [
+            [x * fov_size, y * fov_size, 0.0, fov_size, fov_size, 4.0]
+            for y in range(2)
+            for x in range(2)
+        ],
+        dtype=np.float32,
+    )
+    roi_an = ad.AnnData(
+        X=roi_x,
+        obs=pd.DataFrame(index=[f"FOV_{i + 1}" for i in range(4)]),
+        var=pd.DataFrame(index=ROI_COLUMNS),
+    )
+    roi_an.write_zarr(str(zarr_url / "tables" / "FOV_ROI_table"))
+
+    label_ids = np.arange(1, 17)
+    feature_an = ad.AnnData(
+        X=np.stack([np.full(16, 25.0), label_ids * 10.0], axis=1).astype(
+            np.float32
+        ),
+        obs=pd.DataFrame(
+            {"label": label_ids.astype(str)},
+            index=[str(i) for i in range(16)],
+        ),
+        var=pd.DataFrame(index=["area", "intensity_mean_DAPI"]),
+    )
+    feature_an.write_zarr(str(zarr_url / "tables" / "nuclei_features"))
+
+    return {
+        "zarr_url": zarr_url,
+        "img": img,
+        "lbl": lbl,
+        "pxl_sizes_zyx": pxl_sizes_zyx,
+    }
+
+
+@pytest.fixture
+def ome_zarr_image_2d(ome_zarr_image):
+    """
+    2D (CYX) copy of the first plane of the ome_zarr_image fixture image,
+    with the same ROI tables
+    """
+    zarr_url = ome_zarr_image["zarr_url"].parent / "1"
+    img = ome_zarr_image["img"][:, 0]
+    multiscales = _multiscales(
+        2, ome_zarr_image["pxl_sizes_zyx"], channel_axis=True
+    )
+    del multiscales[0]["axes"][1]
+    for dataset in multiscales[0]["datasets"]:
+        # Drop the Z scale
+        transformation = dataset["coordinateTransformations"][0]
+        del transformation["scale"][1]
+    image_group = zarr.open_group(str(zarr_url), mode="w")
+    image_group.attrs["multiscales"] = multiscales
+    image_group.attrs["omero"] = zarr.open_group(
+        str(ome_zarr_image["zarr_url"]), mode="r"
+    ).attrs["omero"]
+    for level in range(2):
+        image_group.create_dataset(
+            str(level),
+            data=img[:, :: 2**level, :: 2**level],
+            chunks=(1, 8, 8),
+        )
+    shutil.copytree(ome_zarr_image["zarr_url"] / "tables", zarr_url / "tables")
+    return {"zarr_url": zarr_url, "img": img}
+
+
+@pytest.fixture
+def ome_zarr_plate(ome_zarr_image):
+    """
+    HCS plate with 2 wells (B/03 & B/04) that each contain a copy of the
+    ome_zarr_image fixture image
+    """
+    image_url = ome_zarr_image["zarr_url"]
+    plate_url = image_url.parents[2]
+    shutil.copytree(image_url.parent, plate_url / "B" / "04")
+    zarr.open_group(str(plate_url), mode="a").attrs["plate"] = {
+        "wells": [
+            {"path": "B/03", "rowIndex": 0, "columnIndex": 0},
+            {"path": "B/04", "rowIndex": 0, "columnIndex": 1},
+        ]
+    }
+    for well in ["03", "04"]:
+        well_group = zarr.open_group(str(plate_url / "B" / well), mode="a")
+        well_group.attrs["well"] = {"images": [{"path": "0"}]}
+    return {**ome_zarr_image, "plate_url": plate_url}
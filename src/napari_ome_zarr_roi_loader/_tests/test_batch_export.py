@@ -0,0 +1,144 @@
+import json
+
+import numpy as np
+import pytest
+import zarr
+
+from napari_ome_zarr_roi_loader.batch_export import (
+    MANIFEST_NAME,
+    export_roi,
+    export_rois,
+    main,
+    read_manifest,
+)
+from napari_ome_zarr_roi_loader.buffers import BufferPool
+from napari_ome_zarr_roi_loader.plate import find_images
+
+
+def test_export_npy(ome_zarr_image, tmp_path):
+    zarr_url = ome_zarr_image["zarr_url"]
+    output_dir = tmp_path / "export"
+    result = export_rois(
+        zarr_url, output_dir, channels=["GFP"], labels=["nuclei"]
+    )
+    assert result == {"exported": 4, "skipped": 0, "failed": 0}
+    np.testing.assert_array_equal(
+        np.load(output_dir / "0" / "FOV_2" / "GFP.npy"),
+        ome_zarr_image["img"][1, :, 0:16, 16:32],
+    )
+    np.testing.assert_array_equal(
+        np.load(output_dir / "0" / "FOV_3" / "nuclei.npy"),
+        ome_zarr_image["lbl"][:, 16:32, 0:16],
+    )
+    assert read_manifest(output_dir) == {f"0:FOV_{i}" for i in range(1, 5)}
+
+    # Exported ROIs are skipped when the export is run again
+    result = export_rois(
+        zarr_url, output_dir, channels=["GFP"], labels=["nuclei"]
+    )
+    assert result == {"exported": 0, "skipped": 4, "failed": 0}
+
+
+def test_export_reuses_buffers(ome_zarr_image, tmp_path):
+    zarr_url = ome_zarr_image["zarr_url"]
+    output_dir = tmp_path / "export"
+    with BufferPool() as pool:
+        for roi_name in ["FOV_1", "FOV_2"]:
+            export_roi(
+                zarr_url,
+                "0",
+                roi_name,
+                output_dir,
+                channels=["DAPI", "GFP"],
+                labels=["nuclei"],
+                # Read the uint16 images in slabs of 2 planes & the uint32
+                # labels in slabs of 1 plane
+                max_memory=16 * 16 * 2 * 2,
+                pool=pool,
+            )
+        # Only the first slab of each dtype needs a new buffer
+        assert pool.misses == 2 and pool.hits == 14
+    np.testing.assert_array_equal(
+        np.load(output_dir / "0" / "FOV_2" / "GFP.npy"),
+        ome_zarr_image["img"][1, :, 0:16, 16:32],
+    )
+    np.testing.assert_array_equal(
+        np.load(output_dir / "0" / "FOV_2" / "nuclei.npy"),
+        ome_zarr_image["lbl"][:, 0:16, 16:32],
+    )
+
+
+def test_export_plate_resume(ome_zarr_plate, tmp_path):
+    plate_url = ome_zarr_plate["plate_url"]
+    assert find_images(plate_url) == [
+        str(plate_url / "B" / "03" / "0"),
+        str(plate_url / "B" / "04" / "0"),
+    ]
+    output_dir = tmp_path / "export"
+    result = export_rois(
+        plate_url, output_dir, channels=["DAPI"], rois=["FOV_[12]"]
+    )
+    assert result["exported"] == 4
+    assert (output_dir / "B" / "04" / "0" / "FOV_1" / "DAPI.npy").exists()
+    assert not (output_dir / "B" / "03" / "0" / "FOV_3").exists()
+
+    # Simulate an interruption after the first ROI
+    manifest_path = output_dir / MANIFEST_NAME
+    first_line = manifest_path.read_text().splitlines()[0]
+    manifest_path.write_text(first_line + "\n" + '{"id": "B/03/0:FO')
+    result = export_rois(
+        plate_url, output_dir, channels=["DAPI"], rois=["FOV_[12]"]
+    )
+    assert result == {"exported": 3, "skipped": 1, "failed": 0}
+    # Unknown channels fail without stopping the export
+    result = export_rois(plate_url, tmp_path / "failed", channels=["RFP"])
+    assert result == {"exported": 0, "skipped": 0, "failed": 8}
+
+
+# ZYX stacks of 3 or 4 planes must not be written as RGB(A)
+@pytest.mark.filterwarnings("error:.*photometric:DeprecationWarning")
+def test_export_tiff(ome_zarr_image, tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    output_dir = tmp_path / "export"
+    export_rois(
+        ome_zarr_image["zarr_url"],
+        output_dir,
+        labels=["nuclei"],
+        rois=["FOV_4"],
+        fmt="tiff",
+        # Read the ROI one plane at a time
+        max_memory=1,
+    )
+    np.testing.assert_array_equal(
+        tifffile.imread(output_dir / "0" / "FOV_4" / "nuclei.tif"),
+        ome_zarr_image["lbl"][:, 16:32, 16:32],
+    )
+
+
+def test_export_zarr_process_pool(ome_zarr_image, tmp_path):
+    output_dir = tmp_path / "export.zarr"
+    result = export_rois(
+        ome_zarr_image["zarr_url"],
+        output_dir,
+        channels=["DAPI", "GFP"],
+        fmt="zarr",
+        workers=2,
+        max_memory=16 * 16 * 2 * 2,
+    )
+    assert result["exported"] == 4
+    group = zarr.open_group(str(output_dir), mode="r")
+    np.testing.assert_array_equal(
+        group["0/FOV_4/DAPI"][:], ome_zarr_image["img"][0, :, 16:32, 16:32]
+    )
+    assert group["0/FOV_4/DAPI"].attrs["scale"] == [1.0, 0.5, 0.5]
+    with open(output_dir / MANIFEST_NAME) as manifest:
+        assert len([json.loads(line) for line in manifest]) == 4
+
+
+def test_main(ome_zarr_image, tmp_path):
+    output_dir = tmp_path / "export"
+    args = [str(ome_zarr_image["zarr_url"]), str(output_dir)]
+    assert main(args + ["--labels", "nuclei", "--rois", "FOV_1"]) == 0
+    assert (output_dir / "0" / "FOV_1" / "nuclei.npy").exists()
+    with pytest.raises(SystemExit):
+        main(args)
@@ -0,0 +1,106 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+import zarr
+
+from napari_ome_zarr_roi_loader.buffers import BufferPool
+from napari_ome_zarr_roi_loader.instrumentation import LoadStats, recording
+from napari_ome_zarr_roi_loader.utils import (
+    LoadCancelled,
+    get_intensity_roi_selection,
+    join_url,
+    load_intensity_rois,
+    read_intensity_rois,
+    read_label_roi,
+    read_roi,
+)
+
+
+def test_read_into_buffers(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    img, lbl = ome_zarr_image["img"], ome_zarr_image["lbl"]
+    pool = BufferPool()
+    for roi_name, x in [("FOV_1", 0), ("FOV_2", 16)]:
+        out = pool.get((2, 4, 16, 16), np.uint16)
+        img_rois, scale = read_intensity_rois(
+            zarr_url, roi_name, [1, 0], out=out
+        )
+        # The chunks are decoded into the buffer, no copy is returned
+        assert img_rois is out and scale == [1.0, 0.5, 0.5]
+        end_x = x + 16
+        np.testing.assert_array_equal(out, img[::-1, :, :16, x:end_x])
+        pool.release(out)
+    assert (pool.hits, pool.misses) == (1, 1)
+
+    lbl_out = np.zeros((4, 16, 16), dtype=np.uint32)
+    lbl_roi, _ = read_label_roi(zarr_url, "FOV_4", "nuclei", out=lbl_out)
+    assert lbl_roi is lbl_out
+    np.testing.assert_array_equal(lbl_out, lbl[:, 16:, 16:])
+
+    # Selections are resolved from the ROI table & read slab by slab
+    selection, _ = get_intensity_roi_selection(zarr_url, "FOV_3", margin=1.0)
+    assert selection == (slice(0, 5), slice(14, 34), slice(0, 18))
+    roi = read_roi(join_url(zarr_url, 0), (0, 0) + selection[1:])
+    np.testing.assert_array_equal(roi, img[0, 0, 14:32, 0:18])
+    with pytest.raises(ValueError):
+        read_roi(join_url(zarr_url, 0), (0,) + selection, out=lbl_out)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(LoadCancelled):
+        read_intensity_rois(zarr_url, "FOV_1", [0], cancel_event=cancel_event)
+
+
+def test_read_channel_chunks_once(ome_zarr_image, tmp_path):
+    zarr_url = ome_zarr_image["zarr_url"]
+    img = ome_zarr_image["img"]
+    # Chunks that hold both channels
+    zarr.open_group(str(zarr_url), mode="r+").create_dataset(
+        "0", data=img, chunks=(2, 1, 8, 8), overwrite=True
+    )
+    for channel_indices in ([0, 1], [1, 0]):
+        stats = LoadStats("FOV_1")
+        with recording(stats):
+            img_rois, _ = load_intensity_rois(
+                zarr_url, "FOV_1", channel_indices
+            )
+        np.testing.assert_array_equal(
+            img_rois, img[channel_indices, :, :16, :16]
+        )
+        # 4 z planes x 2 x 2 chunks, each read once for both channels
+        assert stats.totals()["chunks"] == 16
+
+    # Indices of the same chunk that aren't next to each other in the output
+    data = np.arange(4 * 8 * 8).reshape(4, 8, 8)
+    array_url = tmp_path / "array.zarr"
+    zarr.save_array(str(array_url), data, chunks=(2, 4, 4))
+    roi = read_roi(array_url, ([0, 2, 1], slice(2, 8)))
+    np.testing.assert_array_equal(roi, data[[0, 2, 1], 2:8])
+
+
+def test_buffer_pool():
+    pool = BufferPool(max_bytes=1000)
+    small = pool.get((10, 10), np.uint8)
+    pool.release(small)
+    assert pool.get((10, 10), np.uint8) is small
+    # Buffers beyond the budget are not kept
+    large = pool.get((2000,), np.uint8)
+    pool.release(large)
+    assert pool.idle_nbytes == 0
+    assert pool.get((2000,), np.uint8) is not large
+
+
+def test_shared_buffer_pool():
+    with BufferPool(shared=True) as pool:
+        array = pool.get((4, 8), np.uint16)
+        array[:] = np.arange(32).reshape(4, 8)
+        # Other processes can attach to the buffer by its name
+        shm = shared_memory.SharedMemory(pool.shared_name(array))
+        try:
+            shared = np.ndarray((4, 8), dtype=np.uint16, buffer=shm.buf)
+            np.testing.assert_array_equal(shared, array)
+            del shared
+        finally:
+            shm.close()
+        del array
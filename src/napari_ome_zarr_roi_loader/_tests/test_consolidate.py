@@ -0,0 +1,138 @@
+import json
+import os
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+import zarr
+
+from napari_ome_zarr_roi_loader.consolidate import (
+    consolidate_metadata,
+    main,
+)
+from napari_ome_zarr_roi_loader.object_index import build_object_index
+from napari_ome_zarr_roi_loader.store_cache import store_cache
+from napari_ome_zarr_roi_loader.stores import (
+    get_consolidated_group,
+    get_consolidated_node,
+)
+from napari_ome_zarr_roi_loader.utils import (
+    get_channel_dict,
+    get_feature_dict,
+    get_label_dict,
+    load_intensity_roi,
+    load_label_roi,
+    load_roi_features,
+    read_table,
+)
+
+
+def test_consolidate_metadata(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    consolidate_metadata(zarr_url)
+    with open(zarr_url / ".zmetadata") as f:
+        metadata = json.load(f)["metadata"]
+    for key in [
+        ".zattrs",
+        "0/.zarray",
+        "labels/.zattrs",
+        "labels/nuclei/1/.zarray",
+        "tables/FOV_ROI_table/obs/.zattrs",
+    ]:
+        assert key in metadata
+    assert "0/0.0.0.0" not in metadata
+    group = zarr.open_consolidated(str(zarr_url), mode="r")
+    assert group["labels/nuclei"].attrs["multiscales"]
+
+    # Remote images can't be consolidated
+    with pytest.raises(ValueError):
+        consolidate_metadata("https://server/plate.zarr/B/03/0")
+
+
+def test_read_from_consolidated_metadata(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    consolidate_metadata(zarr_url)
+    # Without the separate metadata files, everything has to be read from
+    # .zmetadata
+    for root, _, files in os.walk(zarr_url):
+        for file in files:
+            if file in (".zattrs", ".zgroup", ".zarray"):
+                os.remove(os.path.join(root, file))
+    store_cache.clear()
+
+    assert get_channel_dict(zarr_url)[0]["label"] == "DAPI"
+    assert list(get_label_dict(zarr_url / "labels").values()) == ["nuclei"]
+    assert "nuclei_features" in get_feature_dict(zarr_url / "tables").values()
+    assert list(read_table(zarr_url, "FOV_ROI_table").obs_names)[0] == "FOV_1"
+    img_roi, _ = load_intensity_roi(zarr_url, "FOV_2", channel_index=1)
+    np.testing.assert_array_equal(
+        img_roi, ome_zarr_image["img"][1, :, 0:16, 16:32]
+    )
+    lbl_roi, _ = load_label_roi(zarr_url, "FOV_2", "nuclei")
+    features = load_roi_features(zarr_url, "nuclei_features", lbl_roi, "2")
+    assert list(features["label"]) == [3, 4, 7, 8]
+
+
+def test_outdated_consolidated_metadata(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    consolidate_metadata(zarr_url)
+    assert get_consolidated_group(zarr_url) is not None
+
+    # A table added after consolidating is still found
+    tables_group = zarr.open_group(str(zarr_url / "tables"), mode="a")
+    tables_group.attrs["tables"] = tables_group.attrs["tables"] + ["new"]
+    mtime = os.stat(zarr_url / ".zmetadata").st_mtime_ns
+    os.utime(zarr_url / "tables" / ".zattrs", ns=(mtime + 1, mtime + 1))
+    assert get_consolidated_group(zarr_url) is None
+    assert "new" in get_feature_dict(zarr_url / "tables").values()
+
+
+def test_table_rewritten_after_consolidating(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    consolidate_metadata(zarr_url)
+    assert read_table(zarr_url, "nuclei_features").n_obs == 16
+
+    # Rewrite the feature table in place with more rows, without touching
+    # the metadata of the image, its labels or its tables group
+    table_url = zarr_url / "tables" / "nuclei_features"
+    label_ids = np.arange(1, 33)
+    ad.AnnData(
+        X=np.stack([np.full(32, 25.0), label_ids * 10.0], axis=1).astype(
+            np.float32
+        ),
+        obs=pd.DataFrame(
+            {"label": label_ids.astype(str)},
+            index=[str(i) for i in range(32)],
+        ),
+        var=pd.DataFrame(index=["area", "intensity_mean_DAPI"]),
+    ).write_zarr(str(table_url))
+    mtime = os.stat(zarr_url / ".zmetadata").st_mtime_ns
+    for root, _, files in os.walk(table_url):
+        for file in files:
+            os.utime(os.path.join(root, file), ns=(mtime + 1, mtime + 1))
+
+    # Only the rewritten table is read without the consolidated metadata
+    assert get_consolidated_group(zarr_url) is not None
+    assert get_consolidated_node(table_url) is None
+    assert get_consolidated_node(zarr_url / "tables" / "FOV_ROI_table")
+    assert read_table(zarr_url, "nuclei_features").n_obs == 32
+    lbl_roi, _ = load_label_roi(zarr_url, "FOV_2", "nuclei")
+    features = load_roi_features(zarr_url, "nuclei_features", lbl_roi, "2")
+    assert list(features["label"]) == [3, 4, 7, 8]
+
+
+def test_object_index_updates_consolidated_metadata(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    consolidate_metadata(zarr_url)
+    build_object_index(zarr_url, "nuclei")
+    group = get_consolidated_group(zarr_url)
+    assert "nuclei_ROI_table" in group["tables"].attrs["tables"]
+    assert "nuclei_ROI_table" in get_feature_dict(zarr_url / "tables").values()
+
+
+def test_main(ome_zarr_plate):
+    plate_url = ome_zarr_plate["plate_url"]
+    assert main([str(plate_url)]) == 0
+    for well in ["03", "04"]:
+        assert (plate_url / "B" / well / "0" / ".zmetadata").exists()
@@ -0,0 +1,88 @@
+import anndata as ad
+import numpy as np
+import pandas as pd
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader import feature_cache
+from napari_ome_zarr_roi_loader.feature_cache import get_feature_columns
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+from napari_ome_zarr_roi_loader.utils import load_roi_features
+
+
+def test_feature_columns(ome_zarr_image, tmp_path, monkeypatch):
+    zarr_url = ome_zarr_image["zarr_url"]
+    cache_dir = tmp_path / "cache"
+    columns = get_feature_columns(
+        zarr_url, "nuclei_features", cache_dir=cache_dir
+    )
+    assert columns.columns == ["area", "intensity_mean_DAPI"]
+    assert isinstance(columns.column("area"), np.memmap)
+    np.testing.assert_array_equal(columns.labels, np.arange(1, 17))
+
+    # The cached columns give the same features as the AnnData table
+    label_roi = ome_zarr_image["lbl"][:, 16:32, 0:16]
+    expected = load_roi_features(zarr_url, "nuclei_features", label_roi, "3")
+    features_df = load_roi_features(
+        zarr_url,
+        "nuclei_features",
+        label_roi,
+        "3",
+        feature_columns=columns,
+    )
+    pd.testing.assert_frame_equal(features_df, expected)
+
+    # Unchanged tables are not converted again
+    builds = []
+    build = feature_cache.build_feature_cache
+    monkeypatch.setattr(
+        feature_cache,
+        "build_feature_cache",
+        lambda *args: builds.append(args) or build(*args),
+    )
+    get_feature_columns(zarr_url, "nuclei_features", cache_dir=cache_dir)
+    assert builds == []
+
+    # Rewriting the table rebuilds its cache entry
+    feature_an = ad.AnnData(
+        X=np.ones((2, 1), dtype=np.float32),
+        obs=pd.DataFrame({"label": ["1", "2"]}, index=["0", "1"]),
+        var=pd.DataFrame(index=["area"]),
+    )
+    feature_an.write_zarr(str(zarr_url / "tables" / "nuclei_features"))
+    columns = get_feature_columns(
+        zarr_url, "nuclei_features", cache_dir=cache_dir
+    )
+    assert len(builds) == 1
+    assert columns.columns == ["area"] and columns.n_rows == 2
+    get_feature_columns(
+        zarr_url, "nuclei_features", cache_dir=cache_dir, refresh=True
+    )
+    assert len(builds) == 2
+
+    # Tables without a label column have no cached labels
+    roi_columns = get_feature_columns(
+        zarr_url, "FOV_ROI_table", cache_dir=cache_dir
+    )
+    assert roi_columns.labels is None
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_widget_feature_cache(qtbot, ome_zarr_image, tmp_path, monkeypatch):
+    monkeypatch.setenv("OME_ZARR_ROI_LOADER_CACHE_DIR", str(tmp_path))
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_2"
+    widget._label_picker.value = ["nuclei"]
+    widget._feature_picker.value = ["nuclei_features"]
+    widget._feature_cache.value = True
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+
+    features = viewer.layers["nuclei"].features
+    assert list(features["label"]) == [3, 4, 7, 8]
+    assert list(features["intensity_mean_DAPI"]) == [30, 40, 70, 80]
+    assert any(
+        path.name.startswith("feature_table_") for path in tmp_path.iterdir()
+    )
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader.feature_cache import get_feature_columns
+from napari_ome_zarr_roi_loader.feature_query import (
+    evaluate_query,
+    query_features,
+)
+from napari_ome_zarr_roi_loader.object_index import build_object_index
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+
+
+def test_evaluate_query(ome_zarr_image, tmp_path):
+    # The labels 1 to 16 have an area of 25 & intensity_mean_DAPI of
+    # 10 * label
+    columns = get_feature_columns(
+        ome_zarr_image["zarr_url"], "nuclei_features", cache_dir=tmp_path
+    )
+    labels = np.asarray(columns.labels)
+
+    def matches(query):
+        return list(labels[evaluate_query(columns, query)])
+
+    assert matches("intensity_mean_DAPI > 140") == [15, 16]
+    assert matches("20 <= intensity_mean_DAPI < 40 or area != 25") == [2, 3]
+    assert matches("not (intensity_mean_DAPI / 10 > 2)") == [1, 2]
+    assert matches("(area == 25) & ~(`intensity_mean_DAPI` >= 20)") == [1]
+    for query in [
+        "volume > 1",
+        "area >",
+        "area > 'large'",
+        "__import__('os')",
+        "area",
+    ]:
+        with pytest.raises(ValueError):
+            evaluate_query(columns, query)
+
+
+def test_query_features(ome_zarr_image, tmp_path):
+    zarr_url = ome_zarr_image["zarr_url"]
+    hits = query_features(
+        zarr_url,
+        "nuclei_features",
+        "intensity_mean_DAPI > 60",
+        rank_by="intensity_mean_DAPI",
+        label_name="nuclei",
+        cache_dir=tmp_path,
+    )
+    assert list(hits.labels) == list(range(16, 6, -1))
+    # Without object index, the hits can't be mapped to ROIs
+    assert hits.rois is None and hits.object_roi_table is None
+
+    build_object_index(zarr_url, "nuclei")
+    hits = query_features(
+        zarr_url,
+        "nuclei_features",
+        "intensity_mean_DAPI > 60",
+        rank_by="intensity_mean_DAPI",
+        descending=False,
+        label_name="nuclei",
+        cache_dir=tmp_path,
+    )
+    assert hits.object_roi_table == "nuclei_ROI_table"
+    assert hits.n_pages(page_size=4) == 3
+    page = hits.page(1, page_size=4)
+    assert list(page["label"]) == [11, 12, 13, 14]
+    assert list(page["intensity_mean_DAPI"]) == [110, 120, 130, 140]
+    assert list(page["roi"]) == ["FOV_4", "FOV_4", "FOV_3", "FOV_3"]
+    assert hits.roi_names() == ["FOV_2", "FOV_3", "FOV_4"]
+
+    with pytest.raises(ValueError):
+        query_features(
+            zarr_url, "FOV_ROI_table", "x_micrometer > 0", cache_dir=tmp_path
+        )
+
+
+def test_widget_query(qtbot, ome_zarr_image, tmp_path, monkeypatch):
+    monkeypatch.setenv("OME_ZARR_ROI_LOADER_CACHE_DIR", str(tmp_path))
+    zarr_url = ome_zarr_image["zarr_url"]
+    build_object_index(zarr_url, "nuclei")
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = zarr_url
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._channel_picker.value = ["DAPI"]
+    widget._label_picker.value = ["nuclei"]
+    widget._feature_picker.value = ["nuclei_features"]
+    assert widget._rank_by.choices == (
+        "none",
+        "area",
+        "intensity_mean_DAPI",
+    )
+    widget._query.value = "intensity_mean_DAPI >= 130"
+    widget._rank_by.value = "intensity_mean_DAPI"
+    hits = widget.run_query()
+    assert len(hits) == 4
+    assert widget._hits.choices == ("16", "15", "14", "13")
+    assert widget._hits.value == "16"
+
+    # Only the object of the hit is loaded
+    widget.load_hit()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    assert widget._roi_table_picker.value == "nuclei_ROI_table"
+    np.testing.assert_array_equal(
+        viewer.layers["nuclei"].data, ome_zarr_image["lbl"][:, 25:30, 25:30]
+    )
+    assert list(viewer.layers["nuclei"].features["label"]) == [16]
+
+    viewer.layers.clear()
+    widget.load_hits_montage()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    montage = viewer.layers["montage nuclei"].metadata["montage"]
+    assert montage.roi_names == ["13", "14", "15", "16"]
@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+
+WIDGET_MODULE = "napari_ome_zarr_roi_loader.roi_loader_widget"
+# Imported on first use only, see imports.py
+HEAVY_MODULES = ["anndata", "dask.array", "pandas", "zarr"]
+# Import time of the widget module on top of napari (generous, the import
+# takes a few 10 ms, importing the heavy modules takes about a second)
+MAX_IMPORT_SECONDS = 0.5
+
+# Imports napari first (it is already imported when napari opens the
+# widget), then the widget & prints the modules the widget imported
+IMPORT_WIDGET = f"""
+import json, sys
+import magicgui.widgets, napari, napari.qt.threading
+before = set(sys.modules)
+import {WIDGET_MODULE}
+print(json.dumps(sorted(set(sys.modules) - before)))
+"""
+
+
+def test_widget_import_time():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_WIDGET],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = json.loads(result.stdout.splitlines()[-1])
+    assert [module for module in HEAVY_MODULES if module in imported] == []
+
+    # -X importtime lines: "import time: self [us] | cumulative | module"
+    cumulative_us = {}
+    for line in result.stderr.splitlines():
+        _, _, times = line.partition("import time:")
+        fields = times.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            cumulative_us[fields[2].strip()] = int(fields[1])
+    assert cumulative_us[WIDGET_MODULE] < MAX_IMPORT_SECONDS * 1e6
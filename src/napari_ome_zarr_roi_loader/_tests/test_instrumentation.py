@@ -0,0 +1,89 @@
+import json
+import logging
+
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader.instrumentation import (
+    LoadStats,
+    export_stats,
+    recording,
+)
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+from napari_ome_zarr_roi_loader.store_cache import store_cache
+from napari_ome_zarr_roi_loader.utils import load_intensity_roi
+
+
+def _stage_names(stats):
+    return [record["stage"] for record in stats.stages]
+
+
+def test_load_stages(ome_zarr_image, tmp_path, caplog):
+    store_cache.clear()
+    zarr_url = ome_zarr_image["zarr_url"]
+    cold = LoadStats("FOV_2", zarr_url=str(zarr_url))
+    with caplog.at_level(logging.DEBUG), recording(cold):
+        load_intensity_roi(zarr_url, "FOV_2", 1)
+    cold.finish()
+    assert "read_chunks" in caplog.text
+
+    # The ROI table is only read & converted on the first load
+    assert set(_stage_names(cold)) == {
+        "metadata",
+        "read_table",
+        "convert_indices",
+        "roi_indices",
+        "open_array",
+        "read_chunks",
+    }
+    read_chunks = cold.stages[-1]
+    assert read_chunks["stage"] == "read_chunks"
+    # 4 z planes x 2 x 2 chunks of 8 x 8 pixels of a single channel
+    assert read_chunks["chunks"] == 16
+    assert read_chunks["bytes_read"] > 0
+    roi_indices = next(s for s in cold.stages if s["stage"] == "roi_indices")
+    assert roi_indices["cache_misses"] > 0 and roi_indices["depth"] == 0
+    assert cold.totals()["chunks"] == 16
+    assert cold.format().splitlines()[0].startswith("Load FOV_2 in ")
+
+    warm = LoadStats("FOV_2")
+    with recording(warm):
+        load_intensity_roi(zarr_url, "FOV_2", 1)
+    assert "read_table" not in _stage_names(warm)
+    assert warm.totals()["cache_misses"] == 0
+
+    export_stats([cold, warm], tmp_path / "stats.json")
+    with open(tmp_path / "stats.json") as f:
+        exported = json.load(f)
+    assert [load["name"] for load in exported] == ["FOV_2", "FOV_2"]
+    assert exported[0]["info"] == {"zarr_url": str(zarr_url)}
+    assert exported[0]["totals"]["chunks"] == 16
+
+
+def test_widget_stats(qtbot, ome_zarr_image, tmp_path):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_3"
+    widget._channel_picker.value = ["DAPI"]
+    widget._label_picker.value = ["nuclei"]
+    widget._prefetch.value = False
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+
+    stats = widget._load_stats[-1]
+    assert stats.name == "FOV_3" and stats.wall_seconds > 0
+    assert [
+        s["detail"] for s in stats.stages if s["stage"] == "add_image"
+    ] == ["DAPI"]
+    assert "add_labels (nuclei)" in widget._stats_text.value
+    widget._show_stats.value = True
+    assert widget._stats_text.visible == widget._stats_export.visible
+
+    widget.add_feature_table_to_layer(
+        "nuclei_features", viewer.layers["nuclei"], "FOV_3"
+    )
+    assert "set_features" in _stage_names(widget._load_stats[-1])
+    widget.export_load_stats(tmp_path / "stats.json")
+    with open(tmp_path / "stats.json") as f:
+        assert len(json.load(f)) == 2
@@ -0,0 +1,88 @@
+import numpy as np
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader.montage import load_montage, select_rois
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+
+ROI_NAMES = ["FOV_1", "FOV_2", "FOV_3", "FOV_4"]
+
+
+def test_select_rois():
+    assert select_rois(ROI_NAMES) == ROI_NAMES
+    # Selected ROIs are kept in table order
+    assert select_rois(ROI_NAMES, rois=["FOV_3", "FOV_1"]) == [
+        "FOV_1",
+        "FOV_3",
+    ]
+    sample = select_rois(ROI_NAMES, sample=2, seed=1)
+    assert len(sample) == 2 and sample == sorted(sample)
+    assert sample == select_rois(ROI_NAMES, sample=2, seed=1)
+    assert select_rois(ROI_NAMES, sample=10) == ROI_NAMES
+
+
+def test_load_montage(ome_zarr_image):
+    img, lbl = ome_zarr_image["img"], ome_zarr_image["lbl"]
+    montage = load_montage(
+        ome_zarr_image["zarr_url"],
+        ["FOV_4", "FOV_1", "FOV_2"],
+        channels={"GFP": 1},
+        labels=["nuclei"],
+    )
+    assert (montage.rows, montage.columns) == (2, 2)
+    (_, _, gfp, scale), (_, _, nuclei, _) = montage.layers
+    assert [layer[:2] for layer in montage.layers] == [
+        ("image", "GFP"),
+        ("labels", "nuclei"),
+    ]
+    # 16 x 16 pixel tiles (8 x 8 micrometers) with a gap of 10%: the tile
+    # pitch is 8.8 micrometers, i.e. 18 pixels
+    assert gfp.shape == (4, 34, 34) and scale == [1.0, 0.5, 0.5]
+    np.testing.assert_array_equal(gfp[:, :16, :16], img[1, :, 16:, 16:])
+    np.testing.assert_array_equal(gfp[:, :16, 18:], img[1, :, :16, :16])
+    np.testing.assert_array_equal(gfp[:, 18:, :16], img[1, :, :16, 16:])
+    # Gaps & the empty last tile stay empty
+    assert not gfp[:, 16:18].any() and not gfp[:, 18:, 18:].any()
+    np.testing.assert_array_equal(nuclei[:, 18:, :16], lbl[:, :16, 16:])
+
+    assert montage.roi_at((0.0, 1.0, 1.0)) == "FOV_4"
+    assert montage.roi_at((9.0, 1.0)) == "FOV_2"
+    # In the gap, in the empty tile & outside of the montage
+    assert montage.roi_at((8.5, 1.0)) is None
+    assert montage.roi_at((9.0, 9.0)) is None
+    assert montage.roi_at((-1.0, 1.0)) is None
+
+
+def test_load_montage_2d(ome_zarr_image_2d):
+    img = ome_zarr_image_2d["img"]
+    montage = load_montage(
+        ome_zarr_image_2d["zarr_url"], ["FOV_2", "FOV_3"], channels={"GFP": 1}
+    )
+    ((_, _, gfp, scale),) = montage.layers
+    # 2D ROIs give a 2D montage
+    assert gfp.shape == (16, 34) and scale == [0.5, 0.5]
+    np.testing.assert_array_equal(gfp[:, :16], img[1, :16, 16:])
+    np.testing.assert_array_equal(gfp[:, 18:], img[1, 16:, :16])
+    assert montage.roi_at((1.0, 9.0)) == "FOV_3"
+
+
+def test_widget_montage(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    assert widget._montage_rois.choices == tuple(ROI_NAMES)
+    widget._channel_picker.value = ["DAPI", "GFP"]
+    widget._label_picker.value = ["nuclei"]
+    widget._montage_sample.value = 3
+    widget.load_montage()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+
+    # One layer per channel & label image, whatever the number of ROIs
+    assert [layer.name for layer in viewer.layers] == [
+        "montage DAPI",
+        "montage GFP",
+        "montage nuclei",
+    ]
+    montage = viewer.layers["montage nuclei"].metadata["montage"]
+    assert len(montage.roi_names) == 3
+    assert viewer.layers["montage DAPI"].data.shape == (4, 34, 34)
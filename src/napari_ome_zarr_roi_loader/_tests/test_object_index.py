@@ -0,0 +1,113 @@
+import shutil
+
+import numpy as np
+import pytest
+import zarr
+
+from napari_ome_zarr_roi_loader.object_index import (
+    build_object_index,
+    update_object_index,
+)
+from napari_ome_zarr_roi_loader.utils import (
+    get_attrs,
+    get_feature_dict,
+    load_intensity_roi,
+    load_label_roi,
+)
+
+
+def test_build_object_index(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    index = build_object_index(zarr_url, "nuclei")
+    assert list(index.obs_names) == [str(i) for i in range(1, 17)]
+    # Label 1 covers z 0-3, y 1-5 & x 1-5 with pixel sizes (1, 0.5, 0.5)
+    np.testing.assert_allclose(index["1"].X[0], [0.5, 0.5, 0, 2.5, 2.5, 4])
+    assert index.obs.loc["1", "roi"] == "FOV_1"
+    assert index.obs.loc["16", "roi"] == "FOV_4"
+    assert "nuclei_ROI_table" in get_feature_dict(zarr_url / "tables").values()
+
+    # Load a single object
+    lbl_roi, _ = load_label_roi(
+        zarr_url, "6", "nuclei", roi_table="nuclei_ROI_table"
+    )
+    np.testing.assert_array_equal(
+        lbl_roi, ome_zarr_image["lbl"][:, 9:14, 9:14]
+    )
+    img_roi, _ = load_intensity_roi(
+        zarr_url,
+        "6",
+        channel_index=0,
+        roi_table="nuclei_ROI_table",
+        margin=0.5,
+    )
+    np.testing.assert_array_equal(
+        img_roi, ome_zarr_image["img"][0, :, 8:15, 8:15]
+    )
+
+
+def test_update_object_index(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    build_object_index(zarr_url, "nuclei")
+
+    # Re-segment FOV_4: Object 16 is removed & object 17 is added
+    lbl = ome_zarr_image["lbl"].copy()
+    lbl[lbl == 16] = 0
+    lbl[:, 20:22, 20:30] = 17
+    zarr.open(str(zarr_url / "labels" / "nuclei" / "0"))[:] = lbl
+
+    index = update_object_index(zarr_url, "nuclei", "FOV_4")
+    assert list(index.obs_names) == [str(i) for i in range(1, 16)] + ["17"]
+    np.testing.assert_allclose(index["17"].X[0], [10, 10, 0, 5, 1, 4])
+    assert index.obs.loc["17", "roi"] == "FOV_4"
+
+
+def test_update_object_index_across_roi_border(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    build_object_index(zarr_url, "nuclei")
+
+    # Paint object 17 from FOV_4 into FOV_3 & part of object 6 (in FOV_1)
+    # into FOV_4
+    lbl = ome_zarr_image["lbl"].copy()
+    lbl[:, 23:24, 2:30] = 17
+    lbl[:, 26:28, 26:28] = 6
+    zarr.open(str(zarr_url / "labels" / "nuclei" / "0"))[:] = lbl
+
+    index = update_object_index(zarr_url, "nuclei", "FOV_4")
+    # The bounding boxes cover the whole objects, inside & outside of FOV_4
+    np.testing.assert_allclose(index["17"].X[0], [1, 11.5, 0, 14, 0.5, 4])
+    np.testing.assert_allclose(index["6"].X[0], [4.5, 4.5, 0, 9.5, 9.5, 4])
+    # Same as rebuilding the index from scratch
+    rebuilt = build_object_index(zarr_url, "nuclei")
+    assert list(index.obs_names) == list(rebuilt.obs_names)
+    np.testing.assert_allclose(index.X, rebuilt.X)
+
+
+def test_object_index_keeps_other_tables(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    # A masking ROI table with the name of the index that was written by
+    # another tool (e.g. Fractal)
+    tables_url = zarr_url / "tables"
+    shutil.copytree(
+        tables_url / "FOV_ROI_table", tables_url / "nuclei_ROI_table"
+    )
+    table = zarr.open_group(str(tables_url / "nuclei_ROI_table"), mode="r+")
+    table.attrs.update(
+        {
+            "type": "masking_roi_table",
+            "region": {"path": "../labels/nuclei"},
+            "instance_key": "label",
+        }
+    )
+    expected = table["X"][:]
+
+    with pytest.raises(ValueError):
+        build_object_index(zarr_url, "nuclei")
+    with pytest.raises(ValueError):
+        update_object_index(zarr_url, "nuclei", "FOV_4")
+    np.testing.assert_array_equal(table["X"][:], expected)
+
+    # The plugin's own index is rebuilt
+    shutil.rmtree(tables_url / "nuclei_ROI_table")
+    build_object_index(zarr_url, "nuclei")
+    build_object_index(zarr_url, "nuclei")
+    assert get_attrs(tables_url / "nuclei_ROI_table")["level"] == "0"
@@ -0,0 +1,89 @@
+import anndata as ad
+import numpy as np
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader import plate
+from napari_ome_zarr_roi_loader.plate import (
+    get_images_with_roi,
+    get_plate_index,
+)
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+
+
+def test_plate_index(ome_zarr_plate, tmp_path, monkeypatch):
+    plate_url = ome_zarr_plate["plate_url"]
+    cache_dir = tmp_path / "cache"
+    index = get_plate_index(plate_url, cache_dir=cache_dir)
+    assert list(index) == ["B/03/0", "B/04/0"]
+    assert index["B/04/0"]["roi_tables"] == {
+        "FOV_ROI_table": ["FOV_1", "FOV_2", "FOV_3", "FOV_4"]
+    }
+    assert index["B/04/0"]["channels"] == ["DAPI", "GFP"]
+    assert index["B/04/0"]["labels"] == ["nuclei"]
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # Reopening the plate reuses the cached index without scanning
+    scanned = []
+    scan_image = plate.scan_image
+
+    def tracking_scan(image_url):
+        scanned.append(image_url)
+        return scan_image(image_url)
+
+    monkeypatch.setattr(plate, "scan_image", tracking_scan)
+    assert get_plate_index(plate_url, cache_dir=cache_dir) == index
+    assert scanned == []
+
+    # Only images whose tables changed are scanned again
+    table_url = plate_url / "B" / "04" / "0" / "tables" / "FOV_ROI_table"
+    roi_table = ad.read_zarr(table_url)
+    roi_table[:2].copy().write_zarr(table_url)
+    index = get_plate_index(plate_url, cache_dir=cache_dir)
+    assert scanned == [str(plate_url / "B" / "04" / "0")]
+    assert get_images_with_roi(index, "FOV_ROI_table", "FOV_3") == ["B/03/0"]
+    assert get_images_with_roi(index, "FOV_ROI_table", "FOV_2") == [
+        "B/03/0",
+        "B/04/0",
+    ]
+
+    get_plate_index(plate_url, cache_dir=cache_dir, refresh=True)
+    assert len(scanned) == 3
+
+
+def test_widget_plate_mode(qtbot, ome_zarr_plate, tmp_path, monkeypatch):
+    monkeypatch.setenv("OME_ZARR_ROI_LOADER_CACHE_DIR", str(tmp_path))
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_plate["plate_url"]
+    assert widget._plate_index is not None
+    assert list(widget._well_picker.choices) == ["B/03/0", "B/04/0"]
+    widget._well_picker.value = ["B/03/0", "B/04/0"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_2"
+    widget._channel_picker.value = ["DAPI"]
+    widget._label_picker.value = ["nuclei"]
+    widget._feature_picker.value = ["nuclei_features"]
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+
+    assert [layer.name for layer in viewer.layers] == [
+        "B/03/0 DAPI",
+        "B/03/0 nuclei",
+        "B/04/0 DAPI",
+        "B/04/0 nuclei",
+    ]
+    np.testing.assert_array_equal(
+        viewer.layers["B/04/0 DAPI"].data,
+        ome_zarr_plate["img"][0, :, 0:16, 16:32],
+    )
+    # The ROIs of the wells are placed side by side
+    assert viewer.layers["B/03/0 nuclei"].translate[-1] == 0
+    np.testing.assert_allclose(
+        viewer.layers["B/04/0 nuclei"].translate, [0, 0, 8 * 1.1]
+    )
+    assert list(viewer.layers["B/04/0 nuclei"].features["label"]) == [
+        3,
+        4,
+        7,
+        8,
+    ]
@@ -0,0 +1,71 @@
+import numpy as np
+
+from napari_ome_zarr_roi_loader.roi_cache import (
+    RoiCache,
+    get_neighbor_rois,
+    load_intensity_rois_cached,
+    prefetch_rois,
+)
+
+
+def test_roi_cache_evicts_by_bytes():
+    cache = RoiCache(max_bytes=250)
+    cache.put("a", np.zeros(100, dtype=np.uint8), [1.0])
+    cache.put("b", np.zeros(100, dtype=np.uint8), [1.0])
+    # Accessing "a" makes "b" the least recently used item
+    assert cache.get("a") is not None
+    # Cached arrays can't be edited in place
+    assert not cache.get("a")[0].flags.writeable
+    cache.put("c", np.zeros(100, dtype=np.uint8), [1.0])
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.nbytes == 200
+
+    # Items larger than the budget are not cached
+    cache.put("d", np.zeros(300, dtype=np.uint8), [1.0])
+    assert "d" not in cache
+
+    cache.max_bytes = 100
+    assert len(cache) == 1
+    assert "c" in cache
+
+
+def test_prefetched_rois_are_cached(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    cache = RoiCache()
+    neighbors = get_neighbor_rois(["FOV_1", "FOV_2", "FOV_3"], "FOV_2")
+    assert neighbors == ["FOV_3", "FOV_1"]
+    prefetch_rois(
+        cache,
+        zarr_url=zarr_url,
+        roi_names=neighbors,
+        channel_indices=[0, 1],
+        labels=["nuclei"],
+    )
+    # 2 channels & 1 label image for 2 ROIs
+    assert len(cache) == 6
+
+    img_rois, scale = load_intensity_rois_cached(
+        cache, zarr_url, "FOV_3", channel_indices=[1]
+    )
+    assert (
+        img_rois[0]
+        is cache.get(
+            (
+                "intensity",
+                str(zarr_url),
+                "FOV_ROI_table",
+                "FOV_3",
+                0,
+                False,
+                0.0,
+                None,
+                None,
+                None,
+                1,
+            )
+        )[0]
+    )
+    np.testing.assert_array_equal(
+        img_rois[0], ome_zarr_image["img"][1, :, 16:32, 0:16]
+    )
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+from napari_ome_zarr_roi_loader.store_cache import StoreCache, store_cache
+from napari_ome_zarr_roi_loader.utils import get_attrs, read_table
+
+
+def test_normalized_keys(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    store_cache.clear()
+    hits = store_cache.hits
+    table = read_table(zarr_url, "FOV_ROI_table")
+    assert read_table(str(zarr_url) + "/", "FOV_ROI_table") is table
+    assert store_cache.hits == hits + 1
+
+
+def test_invalidation_on_change(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    labels_url = zarr_url / "labels"
+    assert get_attrs(labels_url)["labels"] == ["nuclei"]
+
+    # Simulate another process adding a label image
+    invalidations = store_cache.invalidations
+    attrs_file = labels_url / ".zattrs"
+    attrs_file.write_text('{"labels": ["nuclei", "cells"]}')
+    stat = os.stat(attrs_file)
+    os.utime(attrs_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert get_attrs(labels_url)["labels"] == ["nuclei", "cells"]
+    assert store_cache.invalidations > invalidations
+
+
+def test_eviction_by_size(tmp_path):
+    cache = StoreCache(max_bytes=2500)
+    for i in range(3):
+        cache.get(
+            key=("array", i),
+            zarr_url=str(tmp_path),
+            files=(),
+            loader=lambda: np.zeros(1000, dtype=np.uint8),
+        )
+    stats = cache.stats()
+    assert stats["misses"] == 3
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
@@ -0,0 +1,152 @@
+import re
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+from napari_ome_zarr_roi_loader.store_cache import normalize_url, store_cache
+from napari_ome_zarr_roi_loader.stores import (
+    get_max_concurrent_requests,
+    join_url,
+    set_max_concurrent_requests,
+)
+from napari_ome_zarr_roi_loader.utils import (
+    get_channel_dict,
+    get_label_dict,
+    load_intensity_rois,
+    load_label_roi,
+    load_roi_features,
+    read_table,
+)
+
+pytest.importorskip("aiohttp")
+
+
+class _TrackingHandler(SimpleHTTPRequestHandler):
+    # Serves files & records how many chunk requests are in flight
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            super().do_GET()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@pytest.fixture
+def http_server(ome_zarr_image):
+    # Serves the folder of the OME-Zarr fixture on a local HTTP server
+    zarr_url = ome_zarr_image["zarr_url"]
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        partial(_TrackingHandler, directory=str(zarr_url.parent)),
+    )
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.delay = 0.0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    server.url = f"http://{host}:{port}/{zarr_url.name}"
+    yield server
+    server.shutdown()
+    server.server_close()
+    store_cache.clear()
+
+
+def test_urls(tmp_path):
+    assert normalize_url("https://host/plate.zarr/B/03/0/") == (
+        "https://host/plate.zarr/B/03/0"
+    )
+    assert normalize_url(f"file://{tmp_path}") == str(tmp_path)
+    assert join_url("s3://bucket/img.zarr/", "labels", "nuclei", 0) == (
+        "s3://bucket/img.zarr/labels/nuclei/0"
+    )
+    assert join_url(tmp_path, "tables") == str(tmp_path / "tables")
+
+
+def test_remote_roi_loading(ome_zarr_image, http_server):
+    url = http_server.url
+    img_rois, scale = load_intensity_rois(url, "FOV_2", channel_indices=[1])
+    np.testing.assert_array_equal(
+        img_rois[0], ome_zarr_image["img"][1, :, 0:16, 16:32]
+    )
+    assert scale == ome_zarr_image["pxl_sizes_zyx"]
+    lbl_roi, _ = load_label_roi(url, "FOV_2", "nuclei", target_scale=scale)
+    np.testing.assert_array_equal(
+        lbl_roi, ome_zarr_image["lbl"][:, 0:16, 16:32]
+    )
+
+    assert get_channel_dict(url)[1]["label"] == "GFP"
+    assert list(get_label_dict(join_url(url, "labels")).values()) == ["nuclei"]
+    assert get_label_dict(join_url(url, "missing")) == {}
+    assert list(read_table(url, "FOV_ROI_table").obs_names) == [
+        "FOV_1",
+        "FOV_2",
+        "FOV_3",
+        "FOV_4",
+    ]
+    features = load_roi_features(url, "nuclei_features", lbl_roi, "FOV_2")
+    assert list(features["label"]) == [3, 4, 7, 8]
+
+
+def test_concurrent_chunk_fetching(ome_zarr_image, http_server):
+    http_server.delay = 0.02
+    default = get_max_concurrent_requests()
+    set_max_concurrent_requests(4)
+    try:
+        img_rois, _ = load_intensity_rois(
+            http_server.url, "FOV_1", channel_indices=[0, 1]
+        )
+    finally:
+        set_max_concurrent_requests(default)
+    np.testing.assert_array_equal(
+        img_rois, ome_zarr_image["img"][:, :, 0:16, 0:16]
+    )
+    # The ROI slice is fetched as a batch: Every chunk is only requested
+    # once & multiple chunks are in flight, up to the configured limit
+    chunk_requests = [
+        request
+        for request in http_server.requests
+        if re.search(r"/0/\d+\.\d+\.\d+\.\d+$", request)
+    ]
+    assert len(chunk_requests) == len(set(chunk_requests)) == 2 * 4 * 2 * 2
+    assert 1 < http_server.max_in_flight <= 4
+
+    with pytest.raises(ValueError):
+        set_max_concurrent_requests(0)
+
+
+def test_widget_remote_url(qtbot, ome_zarr_image, http_server):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.line_edit.value = http_server.url
+    assert widget.zarr_url == http_server.url
+    assert "FOV_ROI_table" in widget._roi_table_picker.choices
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_4"
+    widget._channel_picker.value = ["DAPI"]
+    widget._label_picker.value = ["nuclei"]
+    widget._prefetch.value = False
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    np.testing.assert_array_equal(
+        viewer.layers["nuclei"].data,
+        ome_zarr_image["lbl"][:, 16:32, 16:32],
+    )
@@ -0,0 +1,72 @@
+import threading
+
+import numpy as np
+from napari.components import ViewerModel
+
+from napari_ome_zarr_roi_loader.roi_cache import RoiCache
+from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
+from napari_ome_zarr_roi_loader.streaming import TiledArray, stream_pyramid
+from napari_ome_zarr_roi_loader.utils import load_intensity_roi_pyramid
+
+
+def test_stream_pyramid(ome_zarr_image):
+    img = ome_zarr_image["img"]
+    pyramid, _ = load_intensity_roi_pyramid(
+        ome_zarr_image["zarr_url"], "FOV_2", [0, 1]
+    )
+    cache = RoiCache()
+    loaded = threading.Event()
+    levels = stream_pyramid(
+        [level[1] for level in pyramid],
+        key=("FOV_2", 1),
+        cache=cache,
+        on_loaded=loaded.set,
+    )
+    # FOV_2 is the top right FOV: x 16 to 32 at level 0
+    coarse = img[1, :, 0:16:2, 16:32:2]
+    assert isinstance(levels[0], TiledArray)
+    np.testing.assert_array_equal(levels[-1], coarse)
+    assert levels[0].shape == (4, 16, 16)
+
+    # The tiles are not loaded yet: the region is filled from the coarsest
+    # level (nearest neighbor) & the tiles are read in the background
+    preview = levels[0][2, 0:8, 4:12]
+    np.testing.assert_array_equal(
+        preview, coarse[2][np.ix_(np.arange(8) // 2, np.arange(4, 12) // 2)]
+    )
+    levels[0].loader.wait()
+    assert loaded.is_set()
+    # The region overlaps 2 tiles of 8 x 8 pixels
+    assert len(cache) == 2
+    np.testing.assert_array_equal(
+        levels[0][2, 0:8, 4:12], img[1, 2, 0:8, 20:28]
+    )
+
+    np.testing.assert_array_equal(np.asarray(levels[0]), img[1, :, :16, 16:])
+    np.testing.assert_array_equal(levels[0][-1, 3], img[1, 3, 3, 16:])
+    np.testing.assert_array_equal(levels[0][..., 0], img[1, :, :16, 16])
+    # Steps are read directly from the dask array
+    np.testing.assert_array_equal(
+        levels[0][0, ::2, ::2], img[1, 0, 0:16:2, 16:32:2]
+    )
+
+
+def test_streaming_load_roi(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_1"
+    widget._channel_picker.value = ["DAPI"]
+    widget._label_picker.value = ["nuclei"]
+    widget._streaming.value = True
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+
+    for name in ("DAPI", "nuclei"):
+        layer = viewer.layers[name]
+        assert layer.multiscale
+        assert isinstance(layer.data[0], TiledArray)
+        assert layer.data[0].loader.on_loaded is not None
+    # Streamed loads are lazy, there is nothing to prefetch
+    assert widget._prefetch_kwargs is None
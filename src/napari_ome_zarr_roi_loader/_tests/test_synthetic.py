@@ -0,0 +1,63 @@
+import numpy as np
+
+from napari_ome_zarr_roi_loader.synthetic import make_ome_zarr_image
+from napari_ome_zarr_roi_loader.utils import (
+    get_available_scales,
+    get_channel_dict,
+    get_label_dict,
+    load_intensity_rois,
+    load_label_roi,
+    load_roi_features,
+    read_table,
+)
+
+
+def test_make_ome_zarr_image(tmp_path):
+    image = make_ome_zarr_image(
+        tmp_path / "synthetic.zarr",
+        shape_zyx=(2, 96, 120),
+        channels=("DAPI", "GFP", "RFP"),
+        nb_levels=2,
+        chunks_zyx=(1, 32, 32),
+        pxl_sizes_zyx=(1.0, 0.5, 0.5),
+        label_names=("nuclei", "cells"),
+        object_size=8,
+        object_spacing=12,
+        nb_rois=6,
+        nb_feature_columns=5,
+    )
+    zarr_url = image["zarr_url"]
+    assert image["nb_objects"] == 8 * 10
+    assert image["roi_names"] == [f"FOV_{i}" for i in range(1, 7)]
+    assert [c["label"] for c in get_channel_dict(zarr_url).values()] == [
+        "DAPI",
+        "GFP",
+        "RFP",
+    ]
+    assert list(get_label_dict(f"{zarr_url}/labels").values()) == [
+        "nuclei",
+        "cells",
+    ]
+    assert get_available_scales(zarr_url) == {
+        "0": [1.0, 1.0, 0.5, 0.5],
+        "1": [1.0, 1.0, 1.0, 1.0],
+    }
+
+    # 6 FOVs tile the image in 2 rows of 3 FOVs of 48 x 40 pixels
+    img_rois, scale = load_intensity_rois(zarr_url, "FOV_6", [0, 2])
+    assert img_rois.shape == (2, 2, 48, 40)
+    assert scale == [1.0, 0.5, 0.5]
+    lbl_roi, _ = load_label_roi(zarr_url, "FOV_1", "cells")
+    assert lbl_roi.shape == (2, 48, 40)
+    np.testing.assert_array_equal(lbl_roi[0], lbl_roi[1])
+    # Objects are 8 x 8 pixels, spaced by 12 pixels
+    assert lbl_roi[0, 0, 0] == 1 and lbl_roi[0, 0, 12] == 2
+    assert lbl_roi[0, 12, 0] == 11 and lbl_roi[0, 8, 8] == 0
+    assert np.count_nonzero(lbl_roi[0] == 1) == 64
+
+    features = read_table(zarr_url, "nuclei_features")
+    assert features.shape == (80, 5)
+    roi_features = load_roi_features(
+        zarr_url, "cells_features", lbl_roi, "FOV_1"
+    )
+    assert len(roi_features) == len(np.unique(lbl_roi)) - 1
@@ -0,0 +1,275 @@
+import threading
+
+import dask.array as da
+import numpy as np
+import pytest
+
+from napari_ome_zarr_roi_loader.utils import (
+    LoadCancelled,
+    convert_ROI_table_to_indices,
+    count_labels,
+    estimate_roi_nbytes,
+    get_auto_level,
+    get_channel_window,
+    get_roi_indices,
+    get_roi_label_counts,
+    load_intensity_roi,
+    load_intensity_roi_pyramid,
+    load_intensity_rois,
+    load_label_roi,
+    load_label_roi_pyramid,
+    load_roi_features,
+    project_roi,
+    read_table,
+    to_display_dtype,
+)
+
+
+def test_convert_ROI_table_to_indices(ome_zarr_image):
+    roi_an = read_table(ome_zarr_image["zarr_url"], "FOV_ROI_table")
+    indices = convert_ROI_table_to_indices(
+        roi_an, pxl_sizes_zyx=ome_zarr_image["pxl_sizes_zyx"]
+    )
+    assert list(indices.keys()) == ["FOV_1", "FOV_2", "FOV_3", "FOV_4"]
+    assert indices["FOV_1"] == [0, 4, 0, 16, 0, 16]
+    assert indices["FOV_2"] == [0, 4, 0, 16, 16, 32]
+    assert indices["FOV_4"] == [0, 4, 16, 32, 16, 32]
+
+
+def test_get_roi_indices_is_cached(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    indices = get_roi_indices(zarr_url, "FOV_ROI_table", (1.0, 1.0, 1.0))
+    assert indices["FOV_3"] == [0, 4, 8, 16, 0, 8]
+    assert (
+        get_roi_indices(zarr_url, "FOV_ROI_table", (1.0, 1.0, 1.0)) is indices
+    )
+
+
+def test_load_intensity_roi(ome_zarr_image):
+    img_roi, scale = load_intensity_roi(
+        ome_zarr_image["zarr_url"],
+        "FOV_2",
+        channel_index=1,
+        level=0,
+    )
+    np.testing.assert_array_equal(
+        img_roi, ome_zarr_image["img"][1, :, 0:16, 16:32]
+    )
+    assert scale == [1.0, 0.5, 0.5]
+
+
+def test_load_label_roi(ome_zarr_image):
+    lbl_roi, scale = load_label_roi(
+        ome_zarr_image["zarr_url"],
+        "FOV_3",
+        label_name="nuclei",
+        target_scale=[1.0, 1.0, 1.0],
+    )
+    np.testing.assert_array_equal(
+        lbl_roi, ome_zarr_image["lbl"][:, 16:32:2, 0:16:2]
+    )
+    assert scale == [1.0, 1.0, 1.0]
+
+
+def test_load_intensity_rois(ome_zarr_image):
+    img_rois, scale = load_intensity_rois(
+        ome_zarr_image["zarr_url"],
+        "FOV_4",
+        channel_indices=[1, 0],
+        level=1,
+    )
+    img = ome_zarr_image["img"][:, :, ::2, ::2]
+    assert img_rois.shape == (2, 4, 8, 8)
+    np.testing.assert_array_equal(img_rois[0], img[1, :, 8:16, 8:16])
+    np.testing.assert_array_equal(img_rois[1], img[0, :, 8:16, 8:16])
+    assert scale == [1.0, 1.0, 1.0]
+
+
+def test_cancelled_load(ome_zarr_image):
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(LoadCancelled):
+        load_intensity_roi(
+            ome_zarr_image["zarr_url"],
+            "FOV_1",
+            channel_index=0,
+            cancel_event=cancel_event,
+        )
+
+
+def test_load_roi_pyramids(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    pyramid, scale = load_intensity_roi_pyramid(
+        zarr_url, "FOV_2", channel_indices=[0]
+    )
+    assert [img_roi.shape for img_roi in pyramid] == [
+        (1, 4, 16, 16),
+        (1, 4, 8, 8),
+    ]
+    assert scale == [1.0, 0.5, 0.5]
+    np.testing.assert_array_equal(
+        pyramid[1].compute()[0], ome_zarr_image["img"][0, :, 0:16:2, 16:32:2]
+    )
+
+    lbl_pyramid, scale = load_label_roi_pyramid(
+        zarr_url, "FOV_2", "nuclei", target_scale=[1.0, 1.0, 1.0]
+    )
+    assert [lbl_roi.shape for lbl_roi in lbl_pyramid] == [(4, 8, 8)]
+    assert scale == [1.0, 1.0, 1.0]
+
+
+def test_load_roi_features(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    label_roi = ome_zarr_image["lbl"][:, 16:32, 0:16]
+    features_df = load_roi_features(
+        zarr_url, "nuclei_features", label_roi, roi_name="FOV_3"
+    )
+    assert list(features_df["label"]) == [9, 10, 13, 14]
+    assert list(features_df.index) == [9, 10, 13, 14]
+    assert list(features_df["intensity_mean_DAPI"]) == [90, 100, 130, 140]
+    assert (features_df["area"] == 25).all()
+
+    features_df = load_roi_features(
+        zarr_url,
+        "nuclei_features",
+        label_roi,
+        roi_name="FOV_3",
+        columns=["intensity_mean_DAPI"],
+    )
+    assert "area" not in features_df
+    assert features_df.loc[13, "intensity_mean_DAPI"] == 130
+
+    # Tables without a label column can't be attached as features
+    assert (
+        load_roi_features(zarr_url, "FOV_ROI_table", label_roi, "FOV_3")
+        is None
+    )
+
+
+def test_count_labels(ome_zarr_image):
+    lbl = ome_zarr_image["lbl"]
+    lbl_roi = lbl[:, 0:16, 8:24]
+    label_ids, counts = count_labels(lbl_roi)
+    expected_ids, expected_counts = np.unique(lbl_roi, return_counts=True)
+    np.testing.assert_array_equal(label_ids, expected_ids[1:])
+    np.testing.assert_array_equal(counts, expected_counts[1:])
+
+    # High label IDs are counted with np.unique instead of a bincount
+    label_ids, counts = count_labels(
+        da.from_array(lbl_roi.astype(np.uint64) * 10**9, chunks=(1, 8, 8))
+    )
+    np.testing.assert_array_equal(
+        label_ids, expected_ids[1:].astype(np.uint64) * 10**9
+    )
+    np.testing.assert_array_equal(counts, expected_counts[1:])
+
+
+def test_get_roi_label_counts_is_cached(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    label_ids, counts = get_roi_label_counts(zarr_url, "FOV_4", "nuclei")
+    np.testing.assert_array_equal(label_ids, [11, 12, 15, 16])
+    np.testing.assert_array_equal(counts, [100, 100, 100, 100])
+    assert get_roi_label_counts(zarr_url, "FOV_4", "nuclei")[0] is label_ids
+
+
+def test_auto_level(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    # FOV_1 at level 0: 4 x 16 x 16 uint16 voxels & uint32 labels
+    assert estimate_roi_nbytes(zarr_url, "FOV_1", [0]) == 2048
+    assert estimate_roi_nbytes(
+        zarr_url, "FOV_1", [0, 1], labels=["nuclei"]
+    ) == (2 * 2048 + 4096)
+    # Labels are estimated at the level closest to the image level
+    assert estimate_roi_nbytes(
+        zarr_url, "FOV_1", [0], labels=["nuclei"], level=1
+    ) == (512 + 1024)
+    assert estimate_roi_nbytes(zarr_url, "FOV_1", [0], margin=4.0) == (
+        4 * 24 * 24 * 2
+    )
+
+    assert get_auto_level(zarr_url, "FOV_1", [0], max_bytes=2048) == (
+        0,
+        2048,
+    )
+    assert get_auto_level(zarr_url, "FOV_1", [0], max_bytes=2047) == (1, 512)
+    # If nothing fits, the coarsest level is used
+    assert get_auto_level(zarr_url, "FOV_1", [0], max_bytes=1) == (1, 512)
+
+
+def test_projection(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    img = ome_zarr_image["img"][:, :, :16, :16]
+    max_roi, scale = load_intensity_roi(zarr_url, "FOV_1", 1, projection="max")
+    assert max_roi.shape == (1, 16, 16) and scale == [1.0, 0.5, 0.5]
+    np.testing.assert_array_equal(max_roi, img[1].max(axis=0, keepdims=True))
+
+    img_rois, _ = load_intensity_rois(
+        zarr_url, "FOV_1", [0, 1], projection="mean", z_range=(1, 3)
+    )
+    assert img_rois.shape == (2, 1, 16, 16) and img_rois.dtype == np.float32
+    np.testing.assert_allclose(
+        img_rois, img[:, 1:3].mean(axis=1, keepdims=True)
+    )
+    sum_roi, _ = load_intensity_roi(zarr_url, "FOV_1", 0, projection="sum")
+    np.testing.assert_array_equal(
+        sum_roi, img[0].sum(axis=0, keepdims=True, dtype=np.uint64)
+    )
+
+    lbl_roi, _ = load_label_roi(zarr_url, "FOV_1", "nuclei", projection="max")
+    np.testing.assert_array_equal(lbl_roi, ome_zarr_image["lbl"][:1, :16, :16])
+    # The estimate covers the projection only
+    assert estimate_roi_nbytes(
+        zarr_url, "FOV_1", [0], labels=["nuclei"], projection="max"
+    ) == (16 * 16 * 2 + 16 * 16 * 4)
+
+    with pytest.raises(ValueError):
+        project_roi(da.zeros((4, 8, 8)), "median")
+    with pytest.raises(ValueError):
+        project_roi(da.zeros((4, 8, 8)), "max", z_range=(4, 6))
+
+
+def test_display_dtype(ome_zarr_image):
+    zarr_url = ome_zarr_image["zarr_url"]
+    img = ome_zarr_image["img"][:, :, :16, :16].astype(np.float64)
+    # DAPI window: 0 to 1000, GFP window: 0 to 500
+    assert get_channel_window(zarr_url, 1) == (0.0, 500.0)
+    img_rois, _ = load_intensity_rois(
+        zarr_url, "FOV_1", [0, 1], display_dtype="uint8"
+    )
+    assert img_rois.dtype == np.uint8
+    np.testing.assert_array_equal(
+        img_rois[0], np.rint(img[0] / 1000 * 255).astype(np.uint8)
+    )
+    # Values above the window are clipped
+    np.testing.assert_array_equal(
+        img_rois[1], np.rint(np.minimum(img[1] / 500, 1) * 255)
+    )
+
+    img_roi, _ = load_intensity_roi(
+        zarr_url, "FOV_1", 0, display_dtype="float16"
+    )
+    assert img_roi.dtype == np.float16
+    np.testing.assert_allclose(img_roi, img[0] / 1000, atol=1e-3)
+    assert estimate_roi_nbytes(
+        zarr_url, "FOV_1", [0, 1], display_dtype="uint8"
+    ) == (2 * 4 * 16 * 16)
+
+    # The window of sum projections is scaled by the number of planes
+    img_roi, _ = load_intensity_roi(
+        zarr_url,
+        "FOV_1",
+        0,
+        projection="sum",
+        z_range=(1, 3),
+        display_dtype="uint8",
+    )
+    summed = img[0, 1:3].sum(axis=0, keepdims=True)
+    np.testing.assert_array_equal(
+        img_roi, np.rint(summed / 2000 * 255).astype(np.uint8)
+    )
+    assert img_roi.max() < 255
+
+    # Without window, the range of the dtype is used
+    assert get_channel_window(zarr_url, 5, np.uint8) == (0.0, 255.0)
+    with pytest.raises(ValueError):
+        to_display_dtype(da.zeros((4, 8, 8)), (0, 1), "int8")
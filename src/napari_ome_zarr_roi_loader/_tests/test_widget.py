@@ -1,3 +1,6 @@
+import numpy as np
+from napari.components import ViewerModel
+
 from napari_ome_zarr_roi_loader.roi_loader_widget import RoiLoader
 
 
@@ -17,3 +20,184 @@ def test_example_magic_widget(make_napari_viewer, capsys):
     # # read captured output and check that it's as we expected
     # captured = capsys.readouterr()
     # assert captured.out == f"you have selected {layer}\n"
+
+
+def test_load_roi(qtbot, ome_zarr_image):
+    # Use a viewer model, layer loading does not need an OpenGL canvas
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_2"
+    widget._channel_picker.value = ["DAPI", "GFP"]
+    widget._level_picker.value = 0
+    widget._label_picker.value = ["nuclei"]
+    widget._reset_origin.value = False
+    widget._feature_picker.value = ["nuclei_features"]
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+
+    assert [layer.name for layer in viewer.layers] == [
+        "DAPI",
+        "GFP",
+        "nuclei",
+    ]
+    np.testing.assert_array_equal(
+        viewer.layers["GFP"].data,
+        ome_zarr_image["img"][1, :, 0:16, 16:32],
+    )
+    np.testing.assert_array_equal(
+        viewer.layers["nuclei"].data,
+        ome_zarr_image["lbl"][:, 0:16, 16:32],
+    )
+    features = viewer.layers["nuclei"].features
+    assert list(features["label"]) == [3, 4, 7, 8]
+    assert not widget._progress.visible
+
+    # The neighboring ROIs are prefetched in the background
+    qtbot.waitUntil(lambda: widget._prefetch_worker is None, timeout=10000)
+    assert len(widget._roi_cache) == 9
+
+
+def test_painting_does_not_change_cached_roi(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_2"
+    widget._label_picker.value = ["nuclei"]
+    widget._prefetch.value = False
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    expected = ome_zarr_image["lbl"][:, 0:16, 16:32]
+    # Paint over the whole labels layer
+    viewer.layers["nuclei"].data[:] = 99
+
+    # Reloading the ROI from the cache gives the original labels in a new
+    # buffer
+    viewer.layers.clear()
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    assert len(widget._roi_cache) == 1
+    np.testing.assert_array_equal(viewer.layers["nuclei"].data, expected)
+    assert viewer.layers["nuclei"].data.flags.writeable
+
+
+def test_lazy_load_roi(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_1"
+    widget._channel_picker.value = ["DAPI"]
+    widget._label_picker.value = ["nuclei"]
+    widget._lazy.value = True
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+
+    assert viewer.layers["DAPI"].multiscale
+    assert len(viewer.layers["DAPI"].data) == 2
+    assert viewer.layers["nuclei"].multiscale
+
+
+def test_cancel_load(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._channel_picker.value = ["DAPI", "GFP"]
+    widget._label_picker.value = ["nuclei"]
+    widget.run()
+    cancel_event = widget._cancel_event
+    # Starting a second load cancels the first one
+    widget.run()
+    assert cancel_event.is_set()
+    widget.cancel()
+    assert widget._worker is None
+    assert not widget._cancel_button.enabled
+    qtbot.wait(200)
+    assert len(viewer.layers) == 0
+
+
+def test_auto_level(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_1"
+    assert widget._level_picker.choices == (0, 1, "auto")
+    # Full resolution is loaded by default
+    assert widget._level_picker.value == 0
+    widget._channel_picker.value = ["DAPI", "GFP"]
+    widget._label_picker.value = ["nuclei"]
+    assert widget._expected_size.value == "8.0 KB at level 0"
+    widget._level_picker.value = 1
+    assert widget._expected_size.value == "2.0 KB at level 1"
+    widget._level_picker.value = "auto"
+
+    widget._prefetch.value = False
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    assert viewer.layers["DAPI"].data.shape == (4, 16, 16)
+
+
+def test_projection(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_1"
+    widget._channel_picker.value = ["DAPI"]
+    widget._label_picker.value = ["nuclei"]
+    widget._projection.value = "max"
+    # All 4 Z planes of the ROI are offered & projected by default
+    assert widget._z_range.max == 3 and widget.z_range is None
+    assert widget._expected_size.value == "1.5 KB at level 0"
+    widget._z_range.value = (1, 2)
+    assert widget.z_range == (1, 3)
+
+    widget._prefetch.value = False
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    img = ome_zarr_image["img"]
+    np.testing.assert_array_equal(
+        viewer.layers["DAPI"].data,
+        img[0, 1:3, :16, :16].max(axis=0, keepdims=True),
+    )
+    assert viewer.layers["nuclei"].data.shape == (1, 16, 16)
+
+    # Lazy sum projections are rescaled with the window of the summed planes
+    viewer.layers.clear()
+    widget._lazy.value = True
+    widget._projection.value = "sum"
+    widget._display_dtype.value = "uint8"
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    summed = img[0, 1:3, :16, :16].sum(axis=0, keepdims=True)
+    np.testing.assert_array_equal(
+        np.asarray(viewer.layers["DAPI"].data[0]),
+        np.rint(summed / 2000 * 255).astype(np.uint8),
+    )
+
+
+def test_display_dtype(qtbot, ome_zarr_image):
+    viewer = ViewerModel()
+    widget = RoiLoader(viewer)
+    widget._zarr_url_picker.value = ome_zarr_image["zarr_url"]
+    widget._roi_table_picker.value = "FOV_ROI_table"
+    widget._roi_picker.value = "FOV_1"
+    widget._channel_picker.value = ["DAPI", "GFP"]
+    widget._display_dtype.value = "uint8"
+    assert widget._expected_size.value == "2.0 KB at level 0"
+    widget._prefetch.value = False
+    widget.run()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    assert viewer.layers["DAPI"].data.dtype == np.uint8
+    assert viewer.layers["GFP"].contrast_limits == [0, 255]
+
+    # The raw data can still be loaded on demand
+    viewer.layers.clear()
+    widget.load_raw()
+    qtbot.waitUntil(lambda: widget._worker is None, timeout=10000)
+    assert viewer.layers["DAPI"].data.dtype == np.uint16
+    assert viewer.layers["GFP"].contrast_limits == [0, 500]
@@ -0,0 +1,493 @@
+"""
+Headless export of ROIs from OME-Zarr images or HCS plates
+
+Exports every ROI of a ROI table (or a filtered subset) of all images in a
+plate to npy files, TIFF files or a new zarr store, e.g. to generate
+training data. ROIs are exported in parallel by a process pool. Each worker
+reads a ROI in z slabs of at most `max_memory` bytes & streams them to the
+output, so the memory per worker stays bounded for large ROIs. The slabs
+are decoded straight into buffers of a buffers.BufferPool (see
+utils.read_roi), which are reused for all channels & label images of the
+ROIs a worker exports.
+
+Finished ROIs are recorded in `export_manifest.jsonl` in the output folder.
+Running the same export again skips them, so an interrupted export can be
+resumed.
+
+Usage:
+    python -m napari_ome_zarr_roi_loader.batch_export /path/to/plate.zarr \
+        /path/to/output --roi-table FOV_ROI_table --channels DAPI \
+        --labels nuclei --format tiff --workers 4
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import zarr
+
+from napari_ome_zarr_roi_loader.buffers import BufferPool
+from napari_ome_zarr_roi_loader.plate import find_images, get_image_id
+from napari_ome_zarr_roi_loader.stores import get_array, join_url
+from napari_ome_zarr_roi_loader.utils import (
+    _selection_shape,
+    get_channel_dict,
+    get_intensity_roi_selection,
+    get_label_level,
+    get_label_roi_selection,
+    read_roi,
+    read_table,
+)
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("npy", "tiff", "zarr")
+MANIFEST_NAME = "export_manifest.jsonl"
+
+
+def filter_rois(roi_names, patterns=None):
+    # Returns the ROI names matching any of the (fnmatch) patterns, e.g.
+    # ["FOV_1", "FOV_1*"]. All ROIs are kept if patterns is None
+    if not patterns:
+        return list(roi_names)
+    return [
+        roi_name
+        for roi_name in roi_names
+        if any(fnmatch.fnmatchcase(roi_name, pattern) for pattern in patterns)
+    ]
+
+
+def list_export_jobs(zarr_url, roi_table, rois=None):
+    # Returns (image_url, image_id, roi_name) of all ROIs to export
+    jobs = []
+    for image_url in find_images(zarr_url):
+        image_id = get_image_id(zarr_url, image_url)
+        roi_names = read_table(image_url, roi_table).obs_names
+        for roi_name in filter_rois(roi_names, rois):
+            jobs.append((image_url, image_id, roi_name))
+    return jobs
+
+
+def get_job_id(image_id, roi_name):
+    return f"{image_id}:{roi_name}"
+
+
+def read_manifest(output_dir):
+    # Returns the ids of the ROIs that were already exported to output_dir
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return set()
+    done = set()
+    with open(manifest_path) as manifest:
+        for line in manifest:
+            try:
+                done.add(json.loads(line)["id"])
+            except (json.JSONDecodeError, KeyError):
+                # e.g. a line cut off by an interruption
+                continue
+    return done
+
+
+def _append_manifest(output_dir, job_id, outputs):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path, "a") as manifest:
+        manifest.write(json.dumps({"id": job_id, "outputs": outputs}) + "\n")
+        manifest.flush()
+        os.fsync(manifest.fileno())
+
+
+class _RoiSelection:
+    """
+    ROI of a zarr array that is read in slabs along its first sliced axis
+
+    params: array_url: Url of the zarr array
+            selection: Tuple of ints & slices of the ROI, e.g. from
+                       get_intensity_roi_selection
+    """
+
+    def __init__(self, array_url, selection):
+        array = get_array(array_url)
+        self.array_url = array_url
+        self.selection = tuple(selection) + (slice(None),) * (
+            array.ndim - len(selection)
+        )
+        self.shape = _selection_shape(self.selection, array.shape)
+        self.dtype = array.dtype
+        self.ndim = len(self.shape)
+        self.axis = next(
+            i for i, key in enumerate(self.selection) if isinstance(key, slice)
+        )
+        self.start = self.selection[self.axis].indices(array.shape[self.axis])[
+            0
+        ]
+
+    def slab(self, start, stop):
+        # Selection of the planes start to stop of the ROI
+        selection = list(self.selection)
+        selection[self.axis] = slice(self.start + start, self.start + stop)
+        return tuple(selection)
+
+
+def _iter_slabs(roi, max_memory, pool):
+    # Reads a ROI in slabs along its first axis that take at most max_memory
+    # bytes (at least one plane). Each slab is read into a buffer of the
+    # pool, which is released once the next slab is requested
+    plane_nbytes = int(np.prod(roi.shape[1:])) * roi.dtype.itemsize or 1
+    slab_size = max(1, int(max_memory // plane_nbytes))
+    for start in range(0, roi.shape[0], slab_size):
+        stop = min(start + slab_size, roi.shape[0])
+        slab = pool.get((stop - start,) + roi.shape[1:], roi.dtype)
+        try:
+            yield start, read_roi(
+                roi.array_url, roi.slab(start, stop), out=slab
+            )
+        finally:
+            pool.release(slab)
+
+
+def _write_npy(roi, path, max_memory, pool):
+    tmp_path = path + ".tmp"
+    out = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=roi.dtype, shape=roi.shape
+    )
+    for start, slab in _iter_slabs(roi, max_memory, pool):
+        stop = start + len(slab)
+        out[start:stop] = slab
+    out.flush()
+    del out
+    # Only complete files get the final name
+    os.replace(tmp_path, path)
+
+
+def _write_tiff(roi, path, max_memory, scale, pool):
+    try:
+        import tifffile
+    except ImportError as e:
+        raise ImportError(
+            "Exporting TIFF files requires tifffile: pip install tifffile"
+        ) from e
+
+    def planes():
+        for _, slab in _iter_slabs(roi, max_memory, pool):
+            yield from slab.reshape((-1,) + slab.shape[-2:])
+
+    first_axis = 3 - roi.ndim
+    tmp_path = path + ".tmp"
+    tifffile.imwrite(
+        tmp_path,
+        data=planes(),
+        shape=roi.shape,
+        dtype=roi.dtype,
+        # Grayscale planes: otherwise stacks of 3 or 4 planes are written as
+        # RGB(A) images
+        photometric="minisblack",
+        metadata={"axes": "ZYX"[first_axis:], "scale": list(scale)},
+    )
+    os.replace(tmp_path, path)
+
+
+def _write_zarr(roi, path, max_memory, scale, pool):
+    out = zarr.open_array(
+        path,
+        mode="w",
+        shape=roi.shape,
+        dtype=roi.dtype,
+        chunks=(1,) + roi.shape[1:],
+    )
+    for start, slab in _iter_slabs(roi, max_memory, pool):
+        stop = start + len(slab)
+        out[start:stop] = slab
+    out.attrs["scale"] = list(scale)
+
+
+def _write_roi(roi, output_path, fmt, max_memory, scale, pool):
+    if fmt == "npy":
+        _write_npy(roi, output_path + ".npy", max_memory, pool)
+        return output_path + ".npy"
+    if fmt == "tiff":
+        _write_tiff(roi, output_path + ".tif", max_memory, scale, pool)
+        return output_path + ".tif"
+    _write_zarr(roi, output_path, max_memory, scale, pool)
+    return output_path
+
+
+def export_roi(
+    image_url,
+    image_id,
+    roi_name,
+    output_dir,
+    roi_table="FOV_ROI_table",
+    channels=None,
+    labels=None,
+    level=0,
+    fmt="npy",
+    max_memory=512 * 1024**2,
+    reset_origin=False,
+    margin=0.0,
+    pool=None,
+):
+    """
+    Exports the channels & labels of a single ROI
+
+    Each channel & label image is written to
+    `<output_dir>/<image_id>/<roi_name>/<name>` (`.npy` or `.tif`). For the
+    zarr format, output_dir is the zarr store and the ROIs are arrays in it.
+
+    params: image_url: Path or url of the OME-Zarr image
+            image_id: Name of the image in the export (e.g. B/03/0)
+            roi_name: Name of the ROI in roi_table
+            channels: List of channel names to export
+            labels: List of label image names to export
+            level: Resolution level of the intensity images. Label images
+                   are exported at the closest resolution
+            max_memory: Maximum size (bytes) of the slabs read at once
+            pool: Optional BufferPool the slabs are read into. By default,
+                  the buffers are only reused within this ROI
+    returns the list of written files
+    """
+    if pool is None:
+        with BufferPool(max_bytes=max_memory) as pool:
+            return export_roi(
+                image_url,
+                image_id,
+                roi_name,
+                output_dir,
+                roi_table=roi_table,
+                channels=channels,
+                labels=labels,
+                level=level,
+                fmt=fmt,
+                max_memory=max_memory,
+                reset_origin=reset_origin,
+                margin=margin,
+                pool=pool,
+            )
+    channels = channels or []
+    labels = labels or []
+    roi_dir = os.path.join(output_dir, *image_id.split("/"), roi_name)
+    os.makedirs(roi_dir, exist_ok=True)
+
+    outputs = []
+    scale_img = None
+    if channels:
+        channel_indices = {
+            channel["label"]: index
+            for index, channel in get_channel_dict(image_url).items()
+        }
+        selection, scale_img = get_intensity_roi_selection(
+            zarr_url=image_url,
+            roi_of_interest=roi_name,
+            level=level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+        )
+        for channel in channels:
+            img_roi = _RoiSelection(
+                join_url(image_url, level),
+                (channel_indices[channel],) + selection,
+            )
+            outputs.append(
+                _write_roi(
+                    img_roi,
+                    os.path.join(roi_dir, channel),
+                    fmt,
+                    max_memory,
+                    scale_img,
+                    pool,
+                )
+            )
+    for label in labels:
+        label_level = get_label_level(image_url, label, scale_img)
+        selection, scale_lbl = get_label_roi_selection(
+            zarr_url=image_url,
+            roi_of_interest=roi_name,
+            label_name=label,
+            level=label_level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+        )
+        lbl_roi = _RoiSelection(
+            join_url(image_url, "labels", label, label_level), selection
+        )
+        outputs.append(
+            _write_roi(
+                lbl_roi,
+                os.path.join(roi_dir, label),
+                fmt,
+                max_memory,
+                scale_lbl,
+                pool,
+            )
+        )
+    return outputs
+
+
+def export_rois(
+    zarr_url,
+    output_dir,
+    roi_table="FOV_ROI_table",
+    channels=None,
+    labels=None,
+    level=0,
+    rois=None,
+    fmt="npy",
+    workers=1,
+    max_memory=512 * 1024**2,
+    reset_origin=False,
+    margin=0.0,
+):
+    """
+    Exports all (or a filtered subset of the) ROIs of an image or a plate
+
+    ROIs that are listed in the export manifest of output_dir are skipped,
+    so running an interrupted export again resumes it. Failed ROIs are
+    logged & not added to the manifest, so they are retried on the next run.
+
+    params: zarr_url: Path or url of an OME-Zarr image or HCS plate
+            output_dir: Output folder (or zarr store for fmt="zarr")
+            rois: Optional list of ROI names or fnmatch patterns to export
+            fmt: "npy", "tiff" or "zarr"
+            workers: Number of worker processes. 1 exports in this process
+            max_memory: Maximum bytes a worker reads at once per image
+            For the other parameters, see export_roi
+    returns a dict with the number of exported, skipped & failed ROIs
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt needs to be one of {FORMATS}, not {fmt}")
+    output_dir = os.fspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    done = read_manifest(output_dir)
+    all_jobs = list_export_jobs(zarr_url, roi_table, rois)
+    jobs = [job for job in all_jobs if get_job_id(job[1], job[2]) not in done]
+    nb_skipped = len(all_jobs) - len(jobs)
+    if fmt == "zarr":
+        # Creates the groups up front, so workers only write arrays
+        root = zarr.open_group(output_dir, mode="a")
+        for _, image_id, roi_name in jobs:
+            root.require_group(f"{image_id}/{roi_name}")
+
+    export_kwargs = dict(
+        output_dir=output_dir,
+        roi_table=roi_table,
+        channels=channels,
+        labels=labels,
+        level=level,
+        fmt=fmt,
+        max_memory=max_memory,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    logger.info(
+        f"Exporting {len(jobs)} ROIs to {output_dir}, "
+        f"skipping {nb_skipped} already exported ROIs"
+    )
+
+    nb_exported = 0
+    nb_failed = 0
+
+    def job_finished(job, outputs=None, error=None):
+        nonlocal nb_exported, nb_failed
+        job_id = get_job_id(job[1], job[2])
+        if error is not None:
+            nb_failed += 1
+            logger.error(f"Exporting ROI {job_id} failed: {error}")
+            return
+        nb_exported += 1
+        _append_manifest(output_dir, job_id, outputs)
+        logger.info(f"Exported ROI {job_id} ({nb_exported}/{len(jobs)})")
+
+    if workers <= 1:
+        # The slab buffers are reused for all ROIs
+        with BufferPool(max_bytes=max_memory) as pool:
+            for job in jobs:
+                try:
+                    job_finished(
+                        job, export_roi(*job, **export_kwargs, pool=pool)
+                    )
+                except Exception as e:
+                    job_finished(job, error=e)
+    else:
+        # spawn avoids forking the threads of dask & the file handles of
+        # the parent process
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = {
+                executor.submit(export_roi, *job, **export_kwargs): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    job_finished(futures[future], future.result())
+                except Exception as e:
+                    job_finished(futures[future], error=e)
+
+    return {
+        "exported": nb_exported,
+        "skipped": nb_skipped,
+        "failed": nb_failed,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Export ROIs of OME-Zarr images or HCS plates"
+    )
+    parser.add_argument("zarr_url", help="OME-Zarr image or HCS plate")
+    parser.add_argument("output_dir", help="Output folder or zarr store")
+    parser.add_argument("--roi-table", default="FOV_ROI_table")
+    parser.add_argument("--channels", nargs="*", default=[])
+    parser.add_argument("--labels", nargs="*", default=[])
+    parser.add_argument("--level", type=int, default=0)
+    parser.add_argument(
+        "--rois",
+        nargs="*",
+        default=None,
+        help="ROI names or patterns (e.g. 'FOV_1*') to export. Default: all",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="npy")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--max-memory",
+        type=float,
+        default=512,
+        help="Maximum MB a worker reads at once per image",
+    )
+    parser.add_argument("--reset-origin", action="store_true")
+    parser.add_argument("--margin", type=float, default=0.0)
+    args = parser.parse_args(args)
+    if not args.channels and not args.labels:
+        parser.error("Select at least one channel or label image")
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    result = export_rois(
+        args.zarr_url,
+        args.output_dir,
+        roi_table=args.roi_table,
+        channels=args.channels,
+        labels=args.labels,
+        level=args.level,
+        rois=args.rois,
+        fmt=args.format,
+        workers=args.workers,
+        max_memory=int(args.max_memory * 1024**2),
+        reset_origin=args.reset_origin,
+        margin=args.margin,
+    )
+    logger.info(
+        f"Exported {result['exported']} ROIs, skipped {result['skipped']}, "
+        f"{result['failed']} failed"
+    )
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+"""
+Reusable output buffers for ROI reads
+
+read_roi, read_intensity_rois & read_label_roi (see utils) decode the chunks
+of a ROI straight into a caller-provided array. A BufferPool hands out such
+arrays & takes them back once the caller is done with them, so reading many
+ROIs of the same size (e.g. all FOVs of a plate in a batch job) does not
+allocate a new array per ROI. With `shared=True`, the buffers live in
+shared memory & other processes can map a ROI without copying it (see
+BufferPool.shared_name).
+"""
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    Pool of preallocated arrays, reused by shape & dtype
+
+    Only arrays returned by get can be released back into the pool. A
+    released array must not be used by the caller anymore.
+
+    params: max_bytes: Maximum size of the idle buffers kept for reuse
+            shared: If True, the buffers are allocated in shared memory.
+                    Shared memory is freed by close (or when the pool is
+                    used as a context manager)
+    """
+
+    def __init__(self, max_bytes=512 * 1024**2, shared=False):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._idle = {}
+        self._idle_nbytes = 0
+        self._shared_memory = {}
+        self._retired = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def idle_nbytes(self):
+        return self._idle_nbytes
+
+    def get(self, shape, dtype):
+        # Returns an (uninitialized) array of the given shape & dtype
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.hits += 1
+                array = idle.pop()
+                self._idle_nbytes -= array.nbytes
+                return array
+            self.misses += 1
+        return self._allocate(shape, np.dtype(dtype))
+
+    def release(self, array):
+        # Returns an array from get to the pool. Arrays that don't fit the
+        # budget are freed
+        key = (array.shape, array.dtype.str)
+        with self._lock:
+            if self._idle_nbytes + array.nbytes <= self.max_bytes:
+                self._idle.setdefault(key, []).append(array)
+                self._idle_nbytes += array.nbytes
+                return
+            self._free(array)
+            self._close_retired()
+
+    def shared_name(self, array):
+        # Name of the shared memory block of an array from a shared pool,
+        # which other processes can attach to with
+        # multiprocessing.shared_memory.SharedMemory(name)
+        return self._shared_memory[id(array)].name
+
+    def close(self):
+        # Frees all buffers of the pool
+        with self._lock:
+            for idle in self._idle.values():
+                for array in idle:
+                    self._free(array)
+            self._idle.clear()
+            self._idle_nbytes = 0
+            for shm in list(self._shared_memory.values()):
+                shm.unlink()
+                self._retired.append(shm)
+            self._shared_memory.clear()
+            self._close_retired()
+
+    def _allocate(self, shape, dtype):
+        if not self.shared:
+            return np.empty(shape, dtype=dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        with self._lock:
+            self._shared_memory[id(array)] = shm
+        return array
+
+    def _free(self, array):
+        shm = self._shared_memory.pop(id(array), None)
+        if shm is not None:
+            shm.unlink()
+            self._retired.append(shm)
+
+    def _close_retired(self):
+        # Shared memory can only be closed once no array uses it anymore
+        retired = []
+        for shm in self._retired:
+            try:
+                shm.close()
+            except BufferError:
+                retired.append(shm)
+        self._retired = retired
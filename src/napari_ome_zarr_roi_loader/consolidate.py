@@ -0,0 +1,93 @@
+"""
+Writes consolidated metadata (`.zmetadata`) for OME-Zarr images
+
+The metadata of an image, its pyramid levels, label images & tables is
+collected into a single `.zmetadata` file in the image folder, in the zarr
+v2 consolidated metadata format. The plugin then reads all metadata it
+needs for an image from that one file (see stores.py). For plates, each
+image is consolidated separately.
+
+Usage:
+    python -m napari_ome_zarr_roi_loader.consolidate /path/to/plate.zarr
+"""
+import argparse
+import json
+import logging
+
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.plate import find_images
+from napari_ome_zarr_roi_loader.store_cache import is_remote_url
+from napari_ome_zarr_roi_loader.stores import CONSOLIDATED_KEY
+
+zarr = lazy_import("zarr")
+
+logger = logging.getLogger(__name__)
+
+
+def _collect_metadata(store, group, metadata):
+    # Collects the metadata files of a group & all its children. Only the
+    # group folders are listed, never the chunks of the arrays.
+    prefix = f"{group.path}/" if group.path else ""
+    for file in (".zgroup", ".zattrs"):
+        if prefix + file in store:
+            metadata[prefix + file] = json.loads(store[prefix + file])
+    for name in group.array_keys():
+        for file in (".zarray", ".zattrs"):
+            key = f"{prefix}{name}/{file}"
+            if key in store:
+                metadata[key] = json.loads(store[key])
+    for _, child in group.groups():
+        _collect_metadata(store, child, metadata)
+
+
+def consolidate_metadata(zarr_url):
+    """
+    Writes the consolidated metadata of a single OME-Zarr image
+
+    Includes the image, its pyramid levels, `labels/` & `tables/`. Needs to
+    be run again after tables or label images were added, older
+    consolidated metadata is ignored when reading.
+
+    params: zarr_url: Path to the OME-Zarr image (local)
+    returns the number of consolidated metadata files
+    """
+    if is_remote_url(zarr_url):
+        raise ValueError(
+            "Consolidating metadata is only supported for local images"
+        )
+    group = zarr.open_group(str(zarr_url), mode="r+")
+    metadata = {}
+    _collect_metadata(group.store, group, metadata)
+    group.store[CONSOLIDATED_KEY] = json.dumps(
+        {"zarr_consolidated_format": 1, "metadata": metadata},
+        indent=4,
+        sort_keys=True,
+    ).encode()
+    return len(metadata)
+
+
+def consolidate_plate(zarr_url):
+    # Consolidates the metadata of every image of a plate (or of a single
+    # image). returns the list of consolidated images
+    image_urls = find_images(zarr_url)
+    for image_url in image_urls:
+        nb_files = consolidate_metadata(image_url)
+        logger.info(f"Consolidated {nb_files} metadata files of {image_url}")
+    return image_urls
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Write consolidated metadata (.zmetadata) for the "
+        "images of OME-Zarr images or HCS plates"
+    )
+    parser.add_argument("zarr_urls", nargs="+", help="Images or plates")
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for zarr_url in args.zarr_urls:
+        consolidate_plate(zarr_url)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,216 @@
+"""
+Memory-mapped columnar cache of feature tables
+
+Feature tables are AnnData tables, so attaching features to a label layer
+parses the AnnData store & copies the rows of X into a dataframe. This
+cache converts a feature table once into a folder of npy files in the
+cache folder (see plate.get_cache_dir): one file per feature column plus
+one for the label column. Later reads memory-map the columns & only copy
+the rows they need, without parsing the table.
+
+Each cache entry stores the signature of the table it was built from (the
+modification times of its metadata files, see store_cache.get_signature)
+and is rebuilt when the table changes. Remote tables have no signature and
+are only rebuilt on request (refresh=True).
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.instrumentation import stage
+from napari_ome_zarr_roi_loader.plate import get_cache_dir
+from napari_ome_zarr_roi_loader.store_cache import get_signature, normalize_url
+from napari_ome_zarr_roi_loader.stores import join_url
+from napari_ome_zarr_roi_loader.utils import (
+    TABLE_SIGNATURE_FILES,
+    get_feature_table_columns,
+    get_feature_table_labels,
+    get_metadata,
+    read_table,
+)
+
+pd = lazy_import("pandas")
+zarr = lazy_import("zarr")
+
+# Bumped when the layout of the cache entries changes
+CACHE_VERSION = 1
+LABEL_FILE = "obs_label.npy"
+
+
+class FeatureColumns:
+    """
+    Memory-mapped columns of a cached feature table
+
+    Duplicate feature names are only cached once (the first column with
+    that name), like load_roi_features drops duplicate columns.
+
+    params: path: Folder of the cache entry
+            meta: Parsed meta.json of the cache entry
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.columns = list(meta["columns"])
+        self.n_rows = meta["n_rows"]
+        self._files = dict(zip(self.columns, meta["files"]))
+        self._has_labels = meta["labels"]
+        self._arrays = {}
+
+    def _load(self, file):
+        if file not in self._arrays:
+            # Empty files can't be memory-mapped
+            mmap_mode = "r" if self.n_rows > 0 else None
+            self._arrays[file] = np.load(
+                os.path.join(self.path, file), mmap_mode=mmap_mode
+            )
+        return self._arrays[file]
+
+    @property
+    def labels(self):
+        # The label of each row or None if the table has no label column
+        if not self._has_labels:
+            return None
+        return self._load(LABEL_FILE)
+
+    def column(self, name):
+        # Returns a feature column as a read-only memory-mapped array
+        return self._load(self._files[name])
+
+    def read_rows(self, rows, columns=None):
+        # Reads the given rows (and optionally columns) into a dataframe.
+        # Only the pages of the columns containing these rows are read
+        # params: rows: Integer indices of the rows to read
+        # params: columns: Optional list of feature names (default: all)
+        if columns is None:
+            columns = self.columns
+        return pd.DataFrame(
+            {name: self.column(name)[rows] for name in columns}
+        )
+
+
+def _entry_path(table_url, cache_dir):
+    url_hash = hashlib.sha1(table_url.encode()).hexdigest()
+    return os.path.join(cache_dir, f"feature_table_{url_hash}")
+
+
+def _read_meta(path, table_url):
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    if meta.get("url") != table_url:
+        return None
+    return meta
+
+
+def _write_columns(zarr_url, feature_table, folder):
+    # Writes the label column & the unique feature columns of a table into
+    # npy files in folder
+    # returns the meta dict of the cache entry (without signature)
+    table_url = join_url(zarr_url, "tables", feature_table)
+    var_names = get_feature_table_columns(zarr_url, feature_table)
+    unique = {}
+    for col_index, name in enumerate(var_names):
+        unique.setdefault(name, col_index)
+    files = {col_index: f"X_{col_index}.npy" for col_index in unique.values()}
+
+    labels = get_feature_table_labels(zarr_url, feature_table)
+    if labels is not None:
+        np.save(os.path.join(folder, LABEL_FILE), labels)
+
+    X = get_metadata(table_url)["X"]
+    if isinstance(X, zarr.Array):
+        # X is read one column of chunks at a time, so only a slab of the
+        # table is in memory at once
+        n_rows = X.shape[0]
+        for start in range(0, X.shape[1], X.chunks[1]):
+            end = min(start + X.chunks[1], X.shape[1])
+            slab = X[:, start:end]
+            for col_index in range(start, end):
+                if col_index in files:
+                    np.save(
+                        os.path.join(folder, files[col_index]),
+                        np.ascontiguousarray(slab[:, col_index - start]),
+                    )
+    else:
+        # Sparse X matrices are stored as groups, read the whole table
+        X = read_table(zarr_url, feature_table).X
+        n_rows = X.shape[0]
+        for col_index, file in files.items():
+            column = X[:, col_index]
+            if hasattr(column, "toarray"):
+                column = column.toarray()
+            np.save(os.path.join(folder, file), np.ravel(column))
+
+    return {
+        "version": CACHE_VERSION,
+        "url": table_url,
+        "columns": list(unique),
+        "files": [files[col_index] for col_index in unique.values()],
+        "labels": labels is not None,
+        "n_rows": int(n_rows),
+    }
+
+
+def build_feature_cache(zarr_url, feature_table, path):
+    """
+    Converts a feature table into a cache entry at path
+
+    The entry is written to a temporary folder first & moved into place
+    once it's complete, so concurrent readers never see a partial entry.
+    returns the meta dict of the entry
+    """
+    zarr_url = normalize_url(zarr_url)
+    table_url = join_url(zarr_url, "tables", feature_table)
+    # The signature is taken before reading, so a table that changes while
+    # it's converted is converted again on the next read
+    signature = list(get_signature(table_url, TABLE_SIGNATURE_FILES))
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        meta = _write_columns(zarr_url, feature_table, tmp_path)
+        meta["signature"] = signature
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return meta
+
+
+def get_feature_columns(
+    zarr_url, feature_table, cache_dir=None, refresh=False
+):
+    """
+    Returns the memory-mapped columns of a feature table
+
+    The table is converted into the cache on first use & whenever it
+    changed since. Only the small meta.json of the entry is read here, the
+    columns are memory-mapped when they are first accessed.
+
+    params: zarr_url: Path to the OME-Zarr image
+            feature_table: Name of the feature table in the `tables` folder
+            cache_dir: Folder of the cache (default: get_cache_dir())
+            refresh: If True, the cache entry is rebuilt
+    returns a FeatureColumns
+    """
+    zarr_url = normalize_url(zarr_url)
+    table_url = join_url(zarr_url, "tables", feature_table)
+    path = _entry_path(table_url, os.fspath(cache_dir or get_cache_dir()))
+
+    meta = None if refresh else _read_meta(path, table_url)
+    signature = list(get_signature(table_url, TABLE_SIGNATURE_FILES))
+    if meta is None or meta["signature"] != signature:
+        with stage("build_feature_cache", feature_table):
+            meta = build_feature_cache(zarr_url, feature_table, path)
+    return FeatureColumns(path, meta)
@@ -0,0 +1,317 @@
+"""
+Selection of objects & ROIs by queries over feature tables
+
+A query is a condition on the columns of a feature table, e.g.
+`area > 200 and intensity_mean_C01 < 50`. It is evaluated on whole columns
+of the memory-mapped columnar cache of the table (see feature_cache), so
+only the columns the query uses are read & no row is parsed one by one.
+The matching objects are ranked by a column & paged. The object index of
+the label image (see object_index) maps them to the ROIs they are in & to
+their object ROIs, so only the hits have to be loaded.
+
+Queries support comparisons (chained ones too), `and`, `or`, `not` (or
+`&`, `|`, `~`), arithmetic & numbers. Feature names that aren't Python
+identifiers can be quoted with backticks, e.g. `` `area-um` > 10 ``.
+"""
+import ast
+import math
+import re
+
+import numpy as np
+
+from napari_ome_zarr_roi_loader.feature_cache import get_feature_columns
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.instrumentation import stage
+from napari_ome_zarr_roi_loader.object_index import get_object_index_name
+from napari_ome_zarr_roi_loader.store_cache import normalize_url
+from napari_ome_zarr_roi_loader.stores import join_url, url_exists
+from napari_ome_zarr_roi_loader.utils import get_metadata, read_elem
+
+pd = lazy_import("pandas")
+
+# Number of hits per page
+PAGE_SIZE = 50
+# Number of rows a query is evaluated on at once, bounds the memory of the
+# intermediate arrays of large tables
+QUERY_BLOCK_ROWS = 2**20
+
+_COMPARISONS = {
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.BitAnd: np.logical_and,
+    ast.BitOr: np.logical_or,
+}
+_UNARY_OPERATORS = {
+    ast.Not: np.logical_not,
+    ast.Invert: np.logical_not,
+    ast.USub: np.negative,
+    ast.UAdd: np.positive,
+}
+
+
+def parse_query(query, columns):
+    """
+    Parses a feature query & checks that it only uses known features
+
+    params: query: Query string, see the module docstring
+            columns: Names of the features of the table
+    returns the parsed expression & a dict of the placeholder names of
+    backtick-quoted features to the feature names
+    raises a ValueError for invalid queries
+    """
+    quoted = {}
+
+    def quote(match):
+        name = f"__feature_{len(quoted)}"
+        quoted[name] = match.group(1)
+        return name
+
+    try:
+        tree = ast.parse(re.sub(r"`([^`]*)`", quote, query), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid query {query!r}: {e.msg}") from None
+
+    allowed = (
+        ast.Expression,
+        ast.BoolOp,
+        ast.And,
+        ast.Or,
+        ast.Compare,
+        ast.BinOp,
+        ast.UnaryOp,
+        ast.Name,
+        ast.Load,
+        ast.Constant,
+        *_COMPARISONS,
+        *_BINARY_OPERATORS,
+        *_UNARY_OPERATORS,
+    )
+    for node in ast.walk(tree):
+        if not isinstance(node, allowed):
+            raise ValueError(
+                f"Unsupported expression in query {query!r}: "
+                f"{type(node).__name__}"
+            )
+        if isinstance(node, ast.Constant) and not isinstance(
+            node.value, (int, float)
+        ):
+            raise ValueError(f"Only numbers are supported in query {query!r}")
+        if isinstance(node, ast.Name):
+            name = quoted.get(node.id, node.id)
+            if name not in columns:
+                raise ValueError(f"Unknown feature {name!r} in query")
+    return tree, quoted
+
+
+def _evaluate(node, column):
+    # Evaluates a parsed query node, column(name) returns a feature column
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, column)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return column(node.id)
+    if isinstance(node, ast.UnaryOp):
+        return _UNARY_OPERATORS[type(node.op)](_evaluate(node.operand, column))
+    if isinstance(node, ast.BinOp):
+        return _BINARY_OPERATORS[type(node.op)](
+            _evaluate(node.left, column), _evaluate(node.right, column)
+        )
+    if isinstance(node, ast.BoolOp):
+        if isinstance(node.op, ast.And):
+            combine = np.logical_and
+        else:
+            combine = np.logical_or
+        result = _evaluate(node.values[0], column)
+        for value in node.values[1:]:
+            result = combine(result, _evaluate(value, column))
+        return result
+    # Comparisons, chained ones (a < b < c) are combined with and
+    result = True
+    left = _evaluate(node.left, column)
+    for op, comparator in zip(node.ops, node.comparators):
+        right = _evaluate(comparator, column)
+        result = np.logical_and(result, _COMPARISONS[type(op)](left, right))
+        left = right
+    return result
+
+
+def evaluate_query(feature_columns, query):
+    """
+    Evaluates a query on the columns of a feature table
+
+    The query is evaluated vectorized on blocks of QUERY_BLOCK_ROWS rows.
+
+    params: feature_columns: FeatureColumns of the table (see
+                             feature_cache.get_feature_columns)
+            query: Query string, see the module docstring
+    returns a boolean numpy array with one entry per row of the table
+    """
+    tree, quoted = parse_query(query, feature_columns.columns)
+    mask = np.zeros(feature_columns.n_rows, dtype=bool)
+    for start in range(0, feature_columns.n_rows, QUERY_BLOCK_ROWS):
+        end = min(start + QUERY_BLOCK_ROWS, feature_columns.n_rows)
+
+        def column(name):
+            values = feature_columns.column(quoted.get(name, name))
+            return values[start:end]
+
+        result = np.asarray(_evaluate(tree, column))
+        if result.dtype != bool:
+            raise ValueError(f"Query {query!r} is not a condition")
+        mask[start:end] = result
+    return mask
+
+
+def _rank(values, descending):
+    # Returns the order of values, NaNs are ranked last
+    order = np.argsort(values, kind="stable")
+    if descending:
+        order = order[::-1]
+    if np.issubdtype(values.dtype, np.floating):
+        is_nan = np.isnan(values[order])
+        order = np.concatenate([order[~is_nan], order[is_nan]])
+    return order
+
+
+def _read_object_rois(zarr_url, label_name):
+    # Reads the label & roi obs columns of the object index of a label
+    # image. Returns None for both if there is no object index. The ROIs are
+    # empty if the index was built without ROI table
+    index_url = join_url(zarr_url, "tables", get_object_index_name(label_name))
+    if not url_exists(index_url):
+        return None, None
+    obs = get_metadata(index_url)["obs"]
+    labels = np.asarray(read_elem(obs["label"])).astype(int)
+    if "roi" not in obs:
+        return labels, np.full(len(labels), "", dtype=object)
+    rois = np.asarray(read_elem(obs["roi"])).astype(object)
+    return labels, rois
+
+
+class QueryHits:
+    """
+    Objects matching a feature query, in rank order
+
+    params: labels: Label IDs of the hits
+            values: Values of the rank column of the hits (or None)
+            rank_by: Name of the rank column (or None)
+            rois: Names of the ROIs the hits are in (or None if there is no
+                  object index)
+            object_roi_table: Object index table the hits can be loaded
+                              from as single objects (or None)
+    """
+
+    def __init__(
+        self,
+        labels,
+        values=None,
+        rank_by=None,
+        rois=None,
+        object_roi_table=None,
+    ):
+        self.labels = labels
+        self.values = values
+        self.rank_by = rank_by
+        self.rois = rois
+        self.object_roi_table = object_roi_table
+
+    def __len__(self):
+        return len(self.labels)
+
+    def n_pages(self, page_size=PAGE_SIZE):
+        return math.ceil(len(self) / page_size)
+
+    def page(self, page, page_size=PAGE_SIZE):
+        # Returns a page of hits as a dataframe with the label (& the rank
+        # value & ROI, if known) of each hit
+        start = page * page_size
+        end = start + page_size
+        page_df = pd.DataFrame({"label": self.labels[start:end]})
+        if self.values is not None:
+            page_df[self.rank_by] = self.values[start:end]
+        if self.rois is not None:
+            page_df["roi"] = self.rois[start:end]
+        return page_df
+
+    def roi_names(self):
+        # Returns the ROIs that contain hits, ordered by their best hit
+        if self.rois is None:
+            return []
+        return [roi for roi in dict.fromkeys(self.rois) if roi]
+
+
+def query_features(
+    zarr_url,
+    feature_table,
+    query,
+    rank_by=None,
+    descending=True,
+    label_name=None,
+    cache_dir=None,
+):
+    """
+    Finds the objects of a feature table that match a query
+
+    params: zarr_url: Path to the OME-Zarr image
+            feature_table: Name of the feature table in the `tables` folder
+            query: Query string, see the module docstring
+            rank_by: Optional feature the hits are ranked by (default: the
+                     order of the table)
+            descending: Whether the hits with the highest rank_by values
+                        come first
+            label_name: Label image of the feature table. If it has an
+                        object index, the hits are mapped to their ROIs
+            cache_dir: Folder of the feature cache (see feature_cache)
+    returns a QueryHits
+    raises a ValueError for invalid queries & tables without label column
+    """
+    zarr_url = normalize_url(zarr_url)
+    feature_columns = get_feature_columns(
+        zarr_url, feature_table, cache_dir=cache_dir
+    )
+    if feature_columns.labels is None:
+        raise ValueError(
+            f"Table {feature_table} does not have a label obs column"
+        )
+    if rank_by is not None and rank_by not in feature_columns.columns:
+        raise ValueError(f"Unknown feature {rank_by!r} to rank by")
+
+    with stage("query_features", feature_table):
+        rows = np.flatnonzero(evaluate_query(feature_columns, query))
+        values = None
+        if rank_by is not None:
+            values = np.asarray(feature_columns.column(rank_by)[rows])
+            order = _rank(values, descending)
+            rows, values = rows[order], values[order]
+        labels = np.asarray(feature_columns.labels[rows])
+
+    rois, object_roi_table = None, None
+    if label_name is not None:
+        index_labels, index_rois = _read_object_rois(zarr_url, label_name)
+        if index_labels is not None:
+            object_roi_table = get_object_index_name(label_name)
+            rois = np.full(len(labels), "", dtype=object)
+        if index_labels is not None and len(index_labels) > 0:
+            sorter = np.argsort(index_labels)
+            positions = np.searchsorted(index_labels, labels, sorter=sorter)
+            positions = np.minimum(positions, len(index_labels) - 1)
+            found = index_labels[sorter[positions]] == labels
+            rois[found] = index_rois[sorter[positions[found]]]
+    return QueryHits(
+        labels,
+        values=values,
+        rank_by=rank_by,
+        rois=rois,
+        object_roi_table=object_roi_table,
+    )
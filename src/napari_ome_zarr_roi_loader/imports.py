@@ -0,0 +1,39 @@
+"""
+Deferred imports of heavy dependencies
+
+napari imports the plugin widget when it is opened. anndata, dask.array,
+pandas & zarr together take longer to import than the rest of the plugin,
+so the modules the widget imports reference them through lazy_import and
+they are only imported on first attribute access, e.g. when the first
+OME-Zarr image is opened.
+"""
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a module that imports it on first attribute access
+
+    Unlike importlib.util.LazyLoader, sys.modules is not modified, so other
+    packages importing the module are not affected.
+
+    params: name: Full name of the module, e.g. "dask.array"
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "imported" if self._module is not None else "not imported"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    # Returns a LazyModule for the module `name`
+    return LazyModule(name)
@@ -0,0 +1,209 @@
+"""
+Per-stage instrumentation of ROI loads
+
+A load is split into stages, e.g. reading the metadata, parsing the ROI
+table & converting it to indices, reading the chunks & adding the napari
+layers. Each stage records:
+- its wall time
+- the chunks read from the stores: their number, compressed bytes & the
+  time spent in the store reads (io_seconds, summed over the reading
+  threads). The rest of a chunk read stage is decompression & copying.
+- the hits & misses of the metadata & table cache (store_cache)
+
+Stages are logged to the `napari_ome_zarr_roi_loader.instrumentation`
+logger (DEBUG level). Stages that run while a LoadStats is recorded (see
+recording) are also collected into it, so a load can be inspected in the
+widget or exported as JSON. Chunk reads & cache counters are global, so
+loads that run at the same time (e.g. prefetching) are counted in the
+stages of both.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from napari_ome_zarr_roi_loader.store_cache import store_cache
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_io_lock = threading.Lock()
+_io_counters = {"chunks": 0, "bytes_read": 0, "io_seconds": 0.0}
+# Counters of a stage that are summed up in LoadStats.totals
+_COUNTER_KEYS = (
+    "seconds",
+    "chunks",
+    "bytes_read",
+    "io_seconds",
+    "cache_hits",
+    "cache_misses",
+)
+
+
+def record_chunk_reads(nb_chunks, nbytes, seconds):
+    # Called by the stores for every batch of chunk reads
+    with _io_lock:
+        _io_counters["chunks"] += nb_chunks
+        _io_counters["bytes_read"] += nbytes
+        _io_counters["io_seconds"] += seconds
+
+
+def get_io_counters():
+    # Returns the total chunks, bytes & seconds read since the start
+    with _io_lock:
+        return dict(_io_counters)
+
+
+class LoadStats:
+    """
+    Stages recorded for one load
+
+    params: name: Name of the load, e.g. the ROI name
+            info: json-serializable details of the load (e.g. the url)
+    """
+
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+        self.stages = []
+        self.started = time.time()
+        self.wall_seconds = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_stage(self, record):
+        with self._lock:
+            self.stages.append(record)
+
+    def finish(self):
+        # Sets the wall time of the whole load (including the time between
+        # stages, e.g. for passing the layers to the main thread)
+        self.wall_seconds = time.perf_counter() - self._start
+        logger.debug("%s", self.format())
+
+    def totals(self):
+        # Sums of the top level stages (nested stages are included in the
+        # stage they ran in)
+        with self._lock:
+            stages = [s for s in self.stages if s["depth"] == 0]
+        totals = {}
+        for key in _COUNTER_KEYS:
+            totals[key] = sum(s[key] for s in stages)
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            stages = list(self.stages)
+        return {
+            "name": self.name,
+            "info": self.info,
+            "started": self.started,
+            "wall_seconds": self.wall_seconds,
+            "totals": self.totals(),
+            "stages": stages,
+        }
+
+    def format(self):
+        # Human-readable summary: one line per stage, nested stages are
+        # indented
+        wall = (
+            ""
+            if self.wall_seconds is None
+            else f" in {self.wall_seconds:.3f} s"
+        )
+        lines = [f"Load {self.name}{wall}"]
+        with self._lock:
+            stages = list(self.stages)
+        for record in _in_call_order(stages):
+            lines.append("  " * (record["depth"] + 1) + _format_stage(record))
+        return "\n".join(lines)
+
+
+def _in_call_order(stages):
+    # Stages are recorded when they end, so nested stages come before the
+    # stage they ran in. Sorting by start time restores the call order
+    return sorted(stages, key=lambda record: record["start"])
+
+
+def _format_stage(record):
+    name = record["stage"]
+    if record["detail"]:
+        name = f"{name} ({record['detail']})"
+    line = f"{name}: {record['seconds']:.4f} s"
+    if record["chunks"]:
+        line += (
+            f", {record['chunks']} chunks, "
+            f"{record['bytes_read'] / 1024**2:.2f} MB "
+            f"({record['io_seconds']:.4f} s I/O)"
+        )
+    if record["cache_hits"] or record["cache_misses"]:
+        line += (
+            f", cache {record['cache_hits']} hits / "
+            f"{record['cache_misses']} misses"
+        )
+    return line
+
+
+def get_active_stats():
+    # Returns the LoadStats recorded in this thread (or None)
+    return getattr(_local, "stats", None)
+
+
+@contextmanager
+def recording(stats):
+    """
+    Collects the stages run in this thread into stats
+
+    params: stats: LoadStats (or None to only log the stages)
+    """
+    previous = get_active_stats()
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+@contextmanager
+def stage(name, detail=None):
+    """
+    Records the wall time, chunk reads & cache hits of a stage of a load
+
+    params: name: Name of the stage, e.g. "read_chunks"
+            detail: Optional detail, e.g. the name of the layer
+    """
+    stats = get_active_stats()
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    io_start = get_io_counters()
+    cache_start = store_cache.stats()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _local.depth = depth
+        io_end = get_io_counters()
+        cache_end = store_cache.stats()
+        record = {
+            "stage": name,
+            "detail": detail,
+            "depth": depth,
+            "start": start,
+            "seconds": seconds,
+            "chunks": io_end["chunks"] - io_start["chunks"],
+            "bytes_read": io_end["bytes_read"] - io_start["bytes_read"],
+            "io_seconds": io_end["io_seconds"] - io_start["io_seconds"],
+            "cache_hits": cache_end["hits"] - cache_start["hits"],
+            "cache_misses": cache_end["misses"] - cache_start["misses"],
+        }
+        logger.debug("%s", _format_stage(record))
+        if stats is not None:
+            stats.add_stage(record)
+
+
+def export_stats(stats, path):
+    # Writes a list of LoadStats to a JSON file
+    with open(path, "w") as f:
+        json.dump([load_stats.to_dict() for load_stats in stats], f, indent=2)
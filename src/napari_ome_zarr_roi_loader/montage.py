@@ -0,0 +1,220 @@
+"""
+Montages of many ROIs of an image
+
+A montage places the selected ROIs of a ROI table in a grid. Each channel &
+label image gets a single preallocated array that holds all ROIs, and the
+chunks of every ROI are read in parallel straight into its tile (see
+utils.store_rois). So a montage of N ROIs has as many layers as a single
+ROI, whatever N. The Montage keeps track of which ROI each tile shows, so
+positions (e.g. mouse clicks) resolve back to the source ROI.
+"""
+import math
+
+import numpy as np
+
+from napari_ome_zarr_roi_loader.utils import (
+    get_label_level,
+    get_lazy_intensity_roi,
+    get_lazy_label_roi,
+    store_rois,
+)
+
+
+def select_rois(roi_names, rois=None, sample=None, seed=None):
+    # Selects the ROIs of a montage: the given rois (all ROIs if rois is
+    # empty) or a random sample of `sample` of them, in table order
+    # params: seed: Seed of the random sample, for reproducible montages
+    roi_names = list(roi_names)
+    if rois:
+        selected = set(rois)
+        roi_names = [
+            roi_name for roi_name in roi_names if roi_name in selected
+        ]
+    if sample and sample < len(roi_names):
+        rng = np.random.default_rng(seed)
+        indices = np.sort(rng.choice(len(roi_names), sample, replace=False))
+        roi_names = [roi_names[i] for i in indices]
+    return roi_names
+
+
+class Montage:
+    """
+    Grid layout of ROIs & the arrays of the montage layers
+
+    Tiles are placed row by row. The layout is in world units (micrometers),
+    so the arrays of channels & label images with different pixel sizes
+    line up.
+
+    params: roi_names: ROIs of the tiles, in order
+            tile_size: (y, x) size of a tile in micrometers, i.e. of the
+                       largest ROI
+            columns: Number of tiles per row (default: a square grid)
+            gap: Gap between the tiles as a fraction of the tile size
+    """
+
+    def __init__(self, roi_names, tile_size, columns=None, gap=0.1):
+        self.roi_names = list(roi_names)
+        self.columns = columns or math.ceil(math.sqrt(len(self.roi_names)))
+        self.rows = math.ceil(len(self.roi_names) / self.columns)
+        self.tile_size = tuple(tile_size)
+        self.gap = gap
+        # (layer_type, name, data, scale) tuples, see add_layer
+        self.layers = []
+
+    @property
+    def pitch(self):
+        # Distance between the origins of neighboring tiles in micrometers
+        return tuple(size * (1 + self.gap) for size in self.tile_size)
+
+    def tile_origin(self, index):
+        # (y, x) position of the top left corner of a tile in micrometers
+        row, column = divmod(index, self.columns)
+        return (row * self.pitch[0], column * self.pitch[1])
+
+    def roi_at(self, position):
+        """
+        Returns the name of the ROI shown at a position or None
+
+        params: position: World position in micrometers, e.g. the position
+                          of a mouse event. Only the last 2 (y, x)
+                          coordinates are used.
+        """
+        y, x = position[-2:]
+        row, column = int(y // self.pitch[0]), int(x // self.pitch[1])
+        if y < 0 or x < 0 or column >= self.columns:
+            return None
+        # Positions in the gap between tiles don't belong to a ROI
+        if y - row * self.pitch[0] >= self.tile_size[0]:
+            return None
+        if x - column * self.pitch[1] >= self.tile_size[1]:
+            return None
+        index = row * self.columns + column
+        if index >= len(self.roi_names):
+            return None
+        return self.roi_names[index]
+
+    def allocate(self, tile_shape, scale, dtype):
+        # Preallocates the array of a layer with tiles of tile_shape ((z,)
+        # y, x) pixels of a given scale ((z,) y, x) & returns it with the
+        # pixel offsets of the tiles
+        offsets = [
+            tuple(
+                int(round(origin / pxl_size))
+                for origin, pxl_size in zip(self.tile_origin(i), scale[-2:])
+            )
+            for i in range(len(self.roi_names))
+        ]
+        shape = tuple(tile_shape[:-2]) + (
+            max(y for y, _ in offsets) + tile_shape[-2],
+            max(x for _, x in offsets) + tile_shape[-1],
+        )
+        return np.zeros(shape, dtype=dtype), offsets
+
+    def add_layer(self, layer_type, name, rois, scale):
+        """
+        Allocates the array of a layer & lists where each ROI goes
+
+        params: layer_type: "image" or "labels"
+                name: Channel or label image name
+                rois: dask arrays ((z,) y, x) of the ROIs, in tile order.
+                      2D ROIs (e.g. of CYX images) give a 2D layer
+                scale: ((z,) y, x) pixel size of the ROIs
+        returns the ROIs & the views of the array they are read into
+        """
+        tile_shape = np.max([roi.shape for roi in rois], axis=0)
+        data, offsets = self.allocate(tile_shape, scale, rois[0].dtype)
+        targets = []
+        for roi, (y, x) in zip(rois, offsets):
+            size_y, size_x = roi.shape[-2:]
+            end_y, end_x = y + size_y, x + size_x
+            leading = tuple(slice(0, size) for size in roi.shape[:-2])
+            targets.append(data[leading + (slice(y, end_y), slice(x, end_x))])
+        self.layers.append((layer_type, name, data, scale))
+        return list(rois), targets
+
+
+def load_montage(
+    zarr_url,
+    roi_names,
+    channels,
+    labels=(),
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    columns=None,
+    gap=0.1,
+    cancel_event=None,
+):
+    """
+    Loads a montage of ROIs with one array per channel & label image
+
+    The arrays are allocated once & the chunks of all ROIs are read in
+    parallel straight into their tiles.
+
+    params: channels: dict of channel names to channel indices
+            labels: Names of the label images, loaded at the level closest
+                    to the image level
+            columns, gap: see Montage
+            cancel_event: Optional threading.Event that aborts the load with
+                          a LoadCancelled exception
+    returns the Montage, its layers are in Montage.layers
+    """
+    img_rois, scale_img = [], None
+    for roi_name in roi_names:
+        img_roi, scale_img = get_lazy_intensity_roi(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_name,
+            level=level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+        )
+        img_rois.append(img_roi)
+
+    target_scale = scale_img if len(channels) > 0 else None
+    lbl_rois, scale_lbls = {}, {}
+    for label in labels:
+        lbl_level = get_label_level(zarr_url, label, target_scale)
+        lbl_rois[label] = []
+        for roi_name in roi_names:
+            lbl_roi, scale_lbls[label] = get_lazy_label_roi(
+                zarr_url=zarr_url,
+                roi_of_interest=roi_name,
+                label_name=label,
+                level=lbl_level,
+                roi_table=roi_table,
+                reset_origin=reset_origin,
+                margin=margin,
+            )
+            lbl_rois[label].append(lbl_roi)
+
+    # The tiles fit the largest ROI (ROIs are clipped at the image border)
+    if len(channels) > 0:
+        rois, scale = img_rois, scale_img
+    else:
+        rois, scale = lbl_rois[labels[0]], scale_lbls[labels[0]]
+    tile_size = np.max([roi.shape[-2:] for roi in rois], axis=0) * np.array(
+        scale[-2:]
+    )
+    montage = Montage(roi_names, tile_size, columns=columns, gap=gap)
+
+    sources, targets = [], []
+    for channel, channel_index in channels.items():
+        layer_sources, layer_targets = montage.add_layer(
+            "image",
+            channel,
+            [img_roi[channel_index] for img_roi in img_rois],
+            scale_img,
+        )
+        sources += layer_sources
+        targets += layer_targets
+    for label in labels:
+        layer_sources, layer_targets = montage.add_layer(
+            "labels", label, lbl_rois[label], scale_lbls[label]
+        )
+        sources += layer_sources
+        targets += layer_targets
+
+    store_rois(sources, targets, cancel_event=cancel_event)
+    return montage
@@ -0,0 +1,372 @@
+"""
+Per-object spatial index of label images
+
+The index maps each label ID of a label image to its bounding box. It is
+stored as a masking ROI table (`tables/<label_name>_ROI_table`) with one
+row per label ID, so single objects can be loaded with the regular ROI
+loading functions (optionally grown by a margin) & only the chunks
+intersecting the object's bounding box are read.
+
+Other tools (e.g. Fractal) write masking ROI tables with the same name, so
+the index is marked with the OBJECT_INDEX_ATTR attribute & tables without
+it are never overwritten.
+"""
+import itertools
+import os
+
+import numpy as np
+
+from napari_ome_zarr_roi_loader.consolidate import consolidate_metadata
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.stores import (
+    CONSOLIDATED_KEY,
+    join_url,
+    lazy_array,
+    url_exists,
+)
+from napari_ome_zarr_roi_loader.utils import (
+    _compute,
+    convert_ROI_table_to_indices,
+    get_attrs,
+    get_available_scales,
+    get_roi_indices,
+    read_table,
+)
+
+ad = lazy_import("anndata")
+dask = lazy_import("dask")
+pd = lazy_import("pandas")
+zarr = lazy_import("zarr")
+
+ROI_COLUMNS = [
+    "x_micrometer",
+    "y_micrometer",
+    "z_micrometer",
+    "len_x_micrometer",
+    "len_y_micrometer",
+    "len_z_micrometer",
+]
+# Attribute that marks a table as an object index written by this plugin
+OBJECT_INDEX_ATTR = "napari_ome_zarr_roi_loader_object_index"
+
+
+def get_object_index_name(label_name):
+    # Name of the table the object index of a label image is stored in
+    return f"{label_name}_ROI_table"
+
+
+def _check_object_index_table(zarr_url, label_name):
+    # Raises a ValueError if the table of the object index of a label image
+    # exists but wasn't written by this plugin (e.g. a Fractal masking ROI
+    # table), so it isn't overwritten
+    index_name = get_object_index_name(label_name)
+    index_url = join_url(zarr_url, "tables", index_name)
+    if url_exists(index_url) and not get_attrs(index_url).get(
+        OBJECT_INDEX_ATTR
+    ):
+        raise ValueError(
+            f"Table {index_name} already exists & is not an object index, "
+            "it is not overwritten"
+        )
+
+
+def _object_bboxes_block(block, offset):
+    # Computes the bounding box of every label in a block
+    # params: offset: Position of the block in the full label image
+    # returns the label IDs, the minimum & the maximum (inclusive) pixel
+    # coordinates of each label in the full image
+    flat_indices = np.flatnonzero(block)
+    if flat_indices.size == 0:
+        return _empty_bboxes(block.ndim)
+    labels = block.ravel()[flat_indices]
+    coords = np.stack(np.unravel_index(flat_indices, block.shape), axis=1)
+    coords += np.asarray(offset)
+    return _reduce_bboxes(labels, coords, coords)
+
+
+def _empty_bboxes(ndim):
+    return (
+        np.empty(0, dtype=np.int64),
+        np.empty((0, ndim), dtype=np.int64),
+        np.empty((0, ndim), dtype=np.int64),
+    )
+
+
+def _reduce_bboxes(labels, mins, maxs):
+    # Merges the bounding boxes of repeated labels
+    order = np.argsort(labels, kind="stable")
+    labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    return (
+        labels[starts].astype(np.int64),
+        np.minimum.reduceat(mins[order], starts, axis=0),
+        np.maximum.reduceat(maxs[order], starts, axis=0),
+    )
+
+
+def compute_object_bboxes(label_data, offset=None, cancel_event=None):
+    # Computes the bounding boxes of all labels in a (dask) label image in
+    # one chunked pass. Chunks are processed in parallel & merged after.
+    # params: label_data: dask array of a label image (zyx)
+    # params: offset: Optional position of label_data in the full image
+    # returns the label IDs, the minimum & the maximum (inclusive) pixel
+    # coordinates of each label
+    if offset is None:
+        offset = (0,) * label_data.ndim
+    chunk_starts = [
+        np.cumsum((start,) + chunks[:-1])
+        for start, chunks in zip(offset, label_data.chunks)
+    ]
+    blocks = label_data.to_delayed()
+    parts = [
+        dask.delayed(_object_bboxes_block)(blocks[block_index], block_offset)
+        for block_index, block_offset in zip(
+            itertools.product(*[range(n) for n in blocks.shape]),
+            itertools.product(*chunk_starts),
+        )
+    ]
+    parts = _compute(*parts, cancel_event=cancel_event)
+    parts = [part for part in parts if len(part[0]) > 0]
+    if not parts:
+        return _empty_bboxes(label_data.ndim)
+    return _reduce_bboxes(
+        np.concatenate([part[0] for part in parts]),
+        np.concatenate([part[1] for part in parts]),
+        np.concatenate([part[2] for part in parts]),
+    )
+
+
+def _bboxes_to_table(label_ids, mins, maxs, pxl_sizes_zyx):
+    # Converts pixel bounding boxes into a masking ROI table (micrometers)
+    pxl_sizes_zyx = np.asarray(pxl_sizes_zyx, dtype=np.float64)
+    starts_zyx = mins * pxl_sizes_zyx
+    lens_zyx = (maxs - mins + 1) * pxl_sizes_zyx
+    X = np.concatenate([starts_zyx[:, ::-1], lens_zyx[:, ::-1]], axis=1)
+    obs = pd.DataFrame(
+        {"label": label_ids.astype(str)},
+        index=label_ids.astype(str),
+    )
+    return ad.AnnData(
+        X=X.astype(np.float32),
+        obs=obs,
+        var=pd.DataFrame(index=ROI_COLUMNS),
+    )
+
+
+def _roi_membership(mins, maxs, roi_indices):
+    # Returns the name of the ROI containing the center of each bounding
+    # box ("" if no ROI contains it)
+    if len(roi_indices) == 0:
+        return np.full(len(mins), "", dtype=object)
+    roi_names = np.array(list(roi_indices.keys()), dtype=object)
+    indices = np.array(list(roi_indices.values()))
+    starts = indices[:, 0::2]
+    ends = indices[:, 1::2]
+    centers = (mins + maxs) / 2
+    inside = np.all(
+        (centers[:, None, :] >= starts[None])
+        & (centers[:, None, :] < ends[None]),
+        axis=2,
+    )
+    membership = roi_names[inside.argmax(axis=1)]
+    membership[~inside.any(axis=1)] = ""
+    return membership
+
+
+def _get_label_level(zarr_url, label_name, level):
+    # Returns the lazy label image & its zyx pixel sizes at a level
+    # FIXME: Only works for 3D (zyx) label images, like the rest of the
+    # ROI loading
+    scales = get_available_scales(join_url(zarr_url, "labels", label_name))
+    pxl_sizes_zyx = scales[level][-3:]
+    label_data = lazy_array(join_url(zarr_url, "labels", label_name, level))
+    return label_data, pxl_sizes_zyx
+
+
+def build_object_index(
+    zarr_url,
+    label_name,
+    level="0",
+    roi_table="FOV_ROI_table",
+    reset_origin=True,
+    cancel_event=None,
+):
+    """
+    Builds the object index of a label image & saves it as a ROI table
+
+    The bounding boxes of all labels are computed in one chunked pass over
+    the label image at the given level. The index is saved as the masking
+    ROI table `tables/<label_name>_ROI_table`, with the label IDs as ROI
+    names.
+
+    params: zarr_url: Path to the OME-Zarr image
+            label_name: Name of the label image in `labels`
+            level: Level of the label image to compute the index on
+            roi_table: Optional ROI table (e.g. FOV_ROI_table). If set, the
+                       ROI containing each object is stored in the `roi`
+                       obs column
+            reset_origin: Whether the origin of roi_table is reset
+    returns the index as an AnnData table
+    raises a ValueError if a table with the name of the index exists that
+    isn't an object index
+    """
+    _check_object_index_table(zarr_url, label_name)
+    label_data, pxl_sizes_zyx = _get_label_level(zarr_url, label_name, level)
+    label_ids, mins, maxs = compute_object_bboxes(
+        label_data, cancel_event=cancel_event
+    )
+    index = _bboxes_to_table(label_ids, mins, maxs, pxl_sizes_zyx)
+    _add_roi_membership(
+        index, zarr_url, mins, maxs, pxl_sizes_zyx, roi_table, reset_origin
+    )
+    write_object_index(zarr_url, label_name, index, level)
+    return index
+
+
+def update_object_index(
+    zarr_url,
+    label_name,
+    roi_of_interest,
+    roi_table="FOV_ROI_table",
+    reset_origin=True,
+    cancel_event=None,
+):
+    """
+    Updates the object index for a single ROI, e.g. after re-segmenting it
+
+    The updated objects are the objects in the ROI & the objects that were
+    in it before. Only the chunks of the ROI are read, grown to the previous
+    bounding boxes of the updated objects & until none of them touches the
+    border of the region, so their new bounding boxes are complete. The
+    rows of the updated objects are replaced, all other rows of the index
+    are kept.
+
+    params: zarr_url: Path to the OME-Zarr image
+            label_name: Name of the label image in `labels`
+            roi_of_interest: Name of the ROI in roi_table to update
+            roi_table: ROI table that contains roi_of_interest
+            reset_origin: Whether the origin of roi_table is reset
+    returns the updated index as an AnnData table
+    raises a ValueError if the table of the index isn't an object index
+    """
+    _check_object_index_table(zarr_url, label_name)
+    index_name = get_object_index_name(label_name)
+    level = get_attrs(join_url(zarr_url, "tables", index_name))["level"]
+    label_data, pxl_sizes_zyx = _get_label_level(zarr_url, label_name, level)
+    old_index = read_table(zarr_url, index_name)
+
+    region = get_roi_indices(
+        zarr_url,
+        roi_table,
+        pxl_sizes_zyx=tuple(pxl_sizes_zyx),
+        reset_origin=reset_origin,
+    )[roi_of_interest]
+    old_indices = np.array(
+        list(
+            convert_ROI_table_to_indices(
+                old_index, pxl_sizes_zyx=pxl_sizes_zyx
+            ).values()
+        )
+    ).reshape(-1, 6)
+    shape = np.array(label_data.shape)
+    chunk_sizes = np.array([chunks[0] for chunks in label_data.chunks])
+    region_starts = np.maximum(np.array(region[0::2]), 0)
+    region_ends = np.minimum(np.array(region[1::2]), shape)
+
+    def scan(starts, ends):
+        # Bounding boxes of the objects in a region
+        region_slice = tuple(
+            slice(start, end) for start, end in zip(starts, ends)
+        )
+        return compute_object_bboxes(
+            label_data[region_slice],
+            offset=tuple(starts),
+            cancel_event=cancel_event,
+        )
+
+    # The updated objects are those in the ROI now & those that were in it
+    label_ids = scan(region_starts, region_ends)[0]
+    updated = np.all(
+        (old_indices[:, 0::2] < region_ends)
+        & (old_indices[:, 1::2] > region_starts),
+        axis=1,
+    ) | old_index.obs_names.isin(label_ids.astype(str))
+    updated_ids = set(old_index.obs_names[updated]) | set(
+        label_ids.astype(str)
+    )
+
+    # Grow the region to the previous bounding boxes of the updated objects
+    # & until none of them touches its border (by a chunk at a time), so
+    # their bounding boxes aren't cut off
+    region_starts = np.vstack([region_starts, old_indices[updated, 0::2]]).min(
+        axis=0
+    )
+    region_ends = np.vstack([region_ends, old_indices[updated, 1::2]]).max(
+        axis=0
+    )
+    while True:
+        label_ids, mins, maxs = scan(region_starts, region_ends)
+        is_updated = np.isin(label_ids.astype(str), list(updated_ids))
+        label_ids, mins, maxs = (
+            label_ids[is_updated],
+            mins[is_updated],
+            maxs[is_updated],
+        )
+        at_start = (mins == region_starts).any(axis=0) & (region_starts > 0)
+        at_end = (maxs + 1 == region_ends).any(axis=0) & (region_ends < shape)
+        if not (at_start.any() or at_end.any()):
+            break
+        region_starts = np.maximum(region_starts - at_start * chunk_sizes, 0)
+        region_ends = np.minimum(region_ends + at_end * chunk_sizes, shape)
+    new_rows = _bboxes_to_table(label_ids, mins, maxs, pxl_sizes_zyx)
+    _add_roi_membership(
+        new_rows, zarr_url, mins, maxs, pxl_sizes_zyx, roi_table, reset_origin
+    )
+
+    kept = old_index[~old_index.obs_names.isin(updated_ids)]
+    index = ad.concat([kept, new_rows])
+    index.var = new_rows.var
+    order = np.argsort(index.obs["label"].astype(np.int64).to_numpy())
+    index = index[order].copy()
+    write_object_index(zarr_url, label_name, index, level)
+    return index
+
+
+def _add_roi_membership(
+    index, zarr_url, mins, maxs, pxl_sizes_zyx, roi_table, reset_origin
+):
+    if roi_table is None:
+        return
+    roi_indices = get_roi_indices(
+        zarr_url,
+        roi_table,
+        pxl_sizes_zyx=tuple(pxl_sizes_zyx),
+        reset_origin=reset_origin,
+    )
+    index.obs["roi"] = _roi_membership(mins, maxs, roi_indices)
+
+
+def write_object_index(zarr_url, label_name, index, level):
+    # Saves the object index as a masking ROI table & registers it in the
+    # tables metadata. Raises a ValueError if a table with the name of the
+    # index exists that isn't an object index
+    _check_object_index_table(zarr_url, label_name)
+    index_name = get_object_index_name(label_name)
+    image_group = zarr.open_group(str(zarr_url), mode="r+")
+    tables_group = image_group.require_group("tables")
+    index.write_zarr(os.path.join(zarr_url, "tables", index_name))
+    tables_group[index_name].attrs.update(
+        {
+            "type": "masking_roi_table",
+            "region": {"path": f"../labels/{label_name}"},
+            "instance_key": "label",
+            "level": level,
+            OBJECT_INDEX_ATTR: True,
+        }
+    )
+    tables = tables_group.attrs.get("tables", [])
+    if index_name not in tables:
+        tables_group.attrs["tables"] = tables + [index_name]
+    if CONSOLIDATED_KEY in image_group.store:
+        # Keeps the consolidated metadata up to date with the new table
+        consolidate_metadata(zarr_url)
@@ -0,0 +1,217 @@
+"""
+Browsing of HCS plates: a cached index of the images & ROIs of all wells
+
+The plate & well metadata are read to find all images of a plate. The
+tables, ROIs, channels & label images of each image are then scanned
+concurrently (the scans are I/O bound) and collected into a plate index.
+
+The index is cached on disk (see get_cache_dir), together with a signature
+of the metadata files each image entry was read from. Reopening a plate
+only rescans the images whose metadata changed since, so it is instant for
+unchanged plates. Remote plates have no signature and are only rescanned on
+request (refresh=True).
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from napari_ome_zarr_roi_loader.store_cache import get_signature, normalize_url
+from napari_ome_zarr_roi_loader.stores import join_url
+from napari_ome_zarr_roi_loader.utils import (
+    TABLE_SIGNATURE_FILES,
+    get_attrs,
+    get_channel_dict,
+    get_feature_dict,
+    get_label_dict,
+    get_metadata,
+    read_elem,
+)
+
+# Bumped when the structure of the index entries changes
+INDEX_VERSION = 1
+
+
+def get_cache_dir():
+    # Folder the plate indices are cached in. Can be set with the
+    # OME_ZARR_ROI_LOADER_CACHE_DIR environment variable
+    return os.environ.get(
+        "OME_ZARR_ROI_LOADER_CACHE_DIR",
+        os.path.join(
+            os.path.expanduser("~"), ".cache", "napari-ome-zarr-roi-loader"
+        ),
+    )
+
+
+def is_plate(zarr_url):
+    return "plate" in get_attrs(zarr_url)
+
+
+def find_images(zarr_url, max_workers=16):
+    # Returns the urls of all images in an HCS plate (in the order of the
+    # plate & well metadata) or [zarr_url] if it is a single image. The
+    # well metadata is read concurrently
+    plate_attrs = get_attrs(zarr_url).get("plate")
+    if plate_attrs is None:
+        return [zarr_url]
+    well_urls = [
+        join_url(zarr_url, well["path"]) for well in plate_attrs["wells"]
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        well_attrs = list(executor.map(get_attrs, well_urls))
+    image_urls = []
+    for well_url, attrs in zip(well_urls, well_attrs):
+        for image in attrs["well"]["images"]:
+            image_urls.append(join_url(well_url, image["path"]))
+    return image_urls
+
+
+def get_image_id(zarr_url, image_url):
+    # Name of an image of a plate: its path in the plate (e.g. B/03/0) or
+    # the folder name of a single image
+    zarr_url = os.fspath(zarr_url).rstrip("/")
+    image_url = os.fspath(image_url).rstrip("/")
+    if image_url == zarr_url:
+        return image_url.replace("\\", "/").split("/")[-1]
+    prefix_len = len(zarr_url) + 1
+    return image_url[prefix_len:].replace("\\", "/")
+
+
+def _image_signature(image_url, roi_tables):
+    # Modification times of all metadata files a scan of the image reads
+    files = [".zattrs", "labels/.zattrs", "tables/.zattrs"]
+    for roi_table in roi_tables:
+        files += [
+            f"tables/{roi_table}/{file}" for file in TABLE_SIGNATURE_FILES
+        ]
+    return list(get_signature(normalize_url(image_url), files))
+
+
+def read_roi_names(image_url, roi_table):
+    # Reads only the obs index (the ROI names) of a ROI table
+    obs = get_metadata(join_url(image_url, "tables", roi_table))["obs"]
+    return [str(name) for name in read_elem(obs[obs.attrs["_index"]])]
+
+
+def scan_image(image_url):
+    """
+    Reads the tables, ROIs, channels & label images of a single image
+
+    ROI tables are recognized by "ROI" in their name, like in the widget.
+    Only the obs index of ROI tables is read.
+    returns a json-serializable dict
+    """
+    tables = list(get_feature_dict(join_url(image_url, "tables")).values())
+    roi_tables = {
+        table: read_roi_names(image_url, table)
+        for table in tables
+        if "ROI" in table
+    }
+    return {
+        "url": os.fspath(image_url),
+        "tables": tables,
+        "roi_tables": roi_tables,
+        "channels": [
+            channel.get("label", str(index))
+            for index, channel in get_channel_dict(image_url).items()
+        ],
+        "labels": list(get_label_dict(join_url(image_url, "labels")).values()),
+        "signature": _image_signature(image_url, roi_tables),
+    }
+
+
+def _index_path(zarr_url, cache_dir):
+    url_hash = hashlib.sha1(normalize_url(zarr_url).encode()).hexdigest()
+    return os.path.join(cache_dir, f"plate_index_{url_hash}.json")
+
+
+def _read_cached_index(path, zarr_url):
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+    if index.get("url") != normalize_url(zarr_url):
+        return None
+    return index
+
+
+def _write_cached_index(path, index):
+    # Writes to a temporary file first, so concurrent readers never see a
+    # partial index
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def get_plate_index(zarr_url, max_workers=16, cache_dir=None, refresh=False):
+    """
+    Returns the index of all images & ROIs of a plate (or single image)
+
+    Images are scanned concurrently. Entries of the cached index are reused
+    if the metadata of their image did not change.
+
+    params: zarr_url: Path or url of the HCS plate
+            max_workers: Number of images that are scanned concurrently
+            cache_dir: Folder of the index cache (default: get_cache_dir())
+            refresh: If True, all images are scanned again
+    returns a dict with the image ids (e.g. "B/03/0") as keys & the scans
+    of the images (see scan_image) as values, in plate order
+    """
+    cache_path = _index_path(zarr_url, cache_dir or get_cache_dir())
+    cached = None if refresh else _read_cached_index(cache_path, zarr_url)
+    cached_images = cached["images"] if cached else {}
+
+    images = {
+        get_image_id(zarr_url, image_url): image_url
+        for image_url in find_images(zarr_url, max_workers=max_workers)
+    }
+    to_scan = [
+        image_id
+        for image_id, image_url in images.items()
+        if image_id not in cached_images
+        or cached_images[image_id]["signature"]
+        != _image_signature(image_url, cached_images[image_id]["roi_tables"])
+    ]
+
+    scans = {}
+    if to_scan:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for image_id, scan in zip(
+                to_scan,
+                executor.map(
+                    scan_image, [images[image_id] for image_id in to_scan]
+                ),
+            ):
+                scans[image_id] = scan
+
+    index = {
+        image_id: scans.get(image_id, cached_images.get(image_id))
+        for image_id in images
+    }
+    if to_scan or cached is None or len(cached_images) != len(index):
+        _write_cached_index(
+            cache_path,
+            {
+                "version": INDEX_VERSION,
+                "url": normalize_url(zarr_url),
+                "images": index,
+            },
+        )
+    return index
+
+
+def get_images_with_roi(index, roi_table, roi_name, image_ids=None):
+    # Returns the ids of the images (optionally only of image_ids) that
+    # contain the ROI roi_name in roi_table
+    if image_ids is None:
+        image_ids = list(index)
+    return [
+        image_id
+        for image_id in image_ids
+        if roi_name in index[image_id]["roi_tables"].get(roi_table, [])
+    ]
@@ -0,0 +1,260 @@
+"""
+In-memory cache for loaded ROIs, bounded by a byte budget
+
+Used by the RoiLoader widget to keep recently viewed ROIs in memory and to
+prefetch the neighboring ROIs of a ROI table in the background.
+"""
+import threading
+from collections import OrderedDict
+
+from napari_ome_zarr_roi_loader.utils import (
+    label_projection,
+    load_intensity_rois,
+    load_label_roi,
+)
+
+
+class RoiCache:
+    """
+    Least recently used cache of ROI arrays, bounded by their total size
+
+    Items are (array, scale) tuples. When adding an item exceeds max_bytes,
+    the least recently used items are evicted. Items that are larger than
+    max_bytes on their own are not cached. The cache is thread-safe, so it
+    can be filled by a prefetch worker while the main thread reads from it.
+    Cached arrays are made read-only, so edits (e.g. painting a labels
+    layer) can't change the cached ROI. Copy them before editing.
+
+    params: max_bytes: Maximum total size of the cached arrays in bytes
+    """
+
+    def __init__(self, max_bytes=2 * 1024**3):
+        self._max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        # Returns the cached (array, scale) tuple or None
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, array, scale):
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._items.pop(key)[0].nbytes
+            if array.nbytes > self._max_bytes:
+                return
+            array.setflags(write=False)
+            self._items[key] = (array, scale)
+            self._nbytes += array.nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+
+    def _evict(self):
+        while self._nbytes > self._max_bytes:
+            _, (array, _) = self._items.popitem(last=False)
+            self._nbytes -= array.nbytes
+
+
+def load_intensity_rois_cached(
+    cache,
+    zarr_url,
+    roi_of_interest,
+    channel_indices,
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    cancel_event=None,
+    projection=None,
+    z_range=None,
+    display_dtype=None,
+):
+    # Same as load_intensity_rois, but channels found in the cache are not
+    # read again. Missing channels are loaded in a single pass and added to
+    # the cache.
+    # returns a list of numpy arrays (one per channel) + a list of the
+    # image scale
+    def key(channel_index):
+        return (
+            "intensity",
+            str(zarr_url),
+            roi_table,
+            roi_of_interest,
+            level,
+            reset_origin,
+            margin,
+            projection,
+            tuple(z_range) if z_range else None,
+            display_dtype,
+            channel_index,
+        )
+
+    cached = {
+        channel_index: cache.get(key(channel_index))
+        for channel_index in channel_indices
+    }
+    missing = [
+        channel_index for channel_index, item in cached.items() if item is None
+    ]
+    if missing:
+        img_rois, scale_img = load_intensity_rois(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_of_interest,
+            channel_indices=missing,
+            level=level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+            cancel_event=cancel_event,
+            projection=projection,
+            z_range=z_range,
+            display_dtype=display_dtype,
+        )
+        for channel_index, img_roi in zip(missing, img_rois):
+            cache.put(key(channel_index), img_roi, scale_img)
+            cached[channel_index] = (img_roi, scale_img)
+
+    img_rois = [cached[channel_index][0] for channel_index in channel_indices]
+    scale_img = cached[channel_indices[0]][1]
+    return img_rois, scale_img
+
+
+def load_label_roi_cached(
+    cache,
+    zarr_url,
+    roi_of_interest,
+    label_name,
+    target_scale=None,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    cancel_event=None,
+    projection=None,
+    z_range=None,
+):
+    # Same as load_label_roi, but returns the label ROI from the cache if
+    # it was loaded before
+    key = (
+        "label",
+        str(zarr_url),
+        roi_table,
+        roi_of_interest,
+        label_name,
+        tuple(target_scale) if target_scale else None,
+        reset_origin,
+        margin,
+        projection,
+        tuple(z_range) if z_range else None,
+    )
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    label_roi, scale_label = load_label_roi(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        label_name=label_name,
+        target_scale=target_scale,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+        cancel_event=cancel_event,
+        projection=projection,
+        z_range=z_range,
+    )
+    cache.put(key, label_roi, scale_label)
+    return label_roi, scale_label
+
+
+def prefetch_rois(
+    cache,
+    zarr_url,
+    roi_names,
+    channel_indices,
+    labels,
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    cancel_event=None,
+    projection=None,
+    z_range=None,
+    display_dtype=None,
+):
+    # Loads the given ROIs with the same channels, labels, level & projection
+    # as a regular load into the cache, so they display without reading from
+    # disk when they are selected later. Label images are max projected if
+    # a projection is set
+    for roi_name in roi_names:
+        scale_img = None
+        if len(channel_indices) > 0:
+            _, scale_img = load_intensity_rois_cached(
+                cache,
+                zarr_url=zarr_url,
+                roi_of_interest=roi_name,
+                channel_indices=channel_indices,
+                level=level,
+                roi_table=roi_table,
+                reset_origin=reset_origin,
+                margin=margin,
+                cancel_event=cancel_event,
+                projection=projection,
+                z_range=z_range,
+                display_dtype=display_dtype,
+            )
+        for label in labels:
+            load_label_roi_cached(
+                cache,
+                zarr_url=zarr_url,
+                roi_of_interest=roi_name,
+                label_name=label,
+                target_scale=scale_img,
+                roi_table=roi_table,
+                reset_origin=reset_origin,
+                margin=margin,
+                cancel_event=cancel_event,
+                projection=label_projection(projection),
+                z_range=z_range,
+            )
+
+
+def get_neighbor_rois(roi_names, roi_name):
+    # Returns the next & previous ROI of roi_name in the list of roi_names
+    if roi_name not in roi_names:
+        return []
+    index = roi_names.index(roi_name)
+    neighbors = []
+    if index + 1 < len(roi_names):
+        neighbors.append(roi_names[index + 1])
+    if index > 0:
+        neighbors.append(roi_names[index - 1])
+    return neighbors
@@ -4,33 +4,385 @@ This widget allows users to load individual ROIs from an OME-Zarr file
 Written by:
 Joel Luethi, joel.luethi@fmi.ch
 """
-from pathlib import Path
+import threading
+from functools import partial
 
 import napari
 import numpy as np
-import zarr
 from magicgui.widgets import (
     CheckBox,
     ComboBox,
     Container,
     FileEdit,
+    FloatSpinBox,
+    Label,
+    LineEdit,
+    ProgressBar,
     PushButton,
+    RangeSlider,
     Select,
+    SpinBox,
+    TextEdit,
 )
+from napari.qt.threading import thread_worker
 from napari.utils.colormaps import Colormap
 from napari.utils.notifications import show_info
+from superqt.utils import ensure_main_thread
 
+from napari_ome_zarr_roi_loader.feature_cache import get_feature_columns
+from napari_ome_zarr_roi_loader.feature_query import query_features
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.instrumentation import (
+    LoadStats,
+    export_stats,
+    recording,
+    stage,
+)
+from napari_ome_zarr_roi_loader.montage import load_montage, select_rois
+from napari_ome_zarr_roi_loader.object_index import build_object_index
+from napari_ome_zarr_roi_loader.plate import (
+    get_images_with_roi,
+    get_plate_index,
+    is_plate,
+)
+from napari_ome_zarr_roi_loader.roi_cache import (
+    RoiCache,
+    get_neighbor_rois,
+    load_intensity_rois_cached,
+    load_label_roi_cached,
+    prefetch_rois,
+)
+from napari_ome_zarr_roi_loader.store_cache import is_remote_url
+from napari_ome_zarr_roi_loader.stores import (
+    get_max_concurrent_requests,
+    join_url,
+    set_max_concurrent_requests,
+)
+from napari_ome_zarr_roi_loader.streaming import TiledArray, stream_pyramid
 from napari_ome_zarr_roi_loader.utils import (
+    DISPLAY_DTYPES,
+    PROJECTIONS,
+    LoadCancelled,
+    estimate_roi_nbytes,
+    get_attrs,
+    get_auto_level,
     get_channel_dict,
+    get_channel_window,
+    get_display_contrast_limits,
     get_feature_dict,
+    get_feature_table_columns,
     get_label_dict,
-    get_metadata,
-    load_features,
-    load_intensity_roi,
-    load_label_roi,
+    get_label_level,
+    get_lazy_intensity_roi,
+    get_projection_window,
+    get_roi_label_counts,
+    label_projection,
+    load_intensity_roi_pyramid,
+    load_label_roi_pyramid,
+    load_roi_features,
+    project_roi,
     read_table,
+    to_display_dtype,
 )
 
+zarr = lazy_import("zarr")
+
+# Number of loads whose stats are kept for the export
+MAX_LOAD_STATS = 100
+# Level choice that picks the finest level fitting the memory budget
+AUTO_LEVEL = "auto"
+# Projection choice that loads the ZYX ROI
+NO_PROJECTION = "none"
+# Display dtype choice that loads the raw data
+RAW_DTYPE = "raw"
+# Rank choice that keeps query hits in the order of the feature table
+NO_RANKING = "none"
+
+
+def _format_nbytes(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+def _multiscale_data(pyramid):
+    # napari only accepts a list of arrays as multiscale data if there is
+    # more than one level
+    if len(pyramid) == 1:
+        return pyramid[0]
+    return pyramid
+
+
+def _iter_roi_layers(
+    zarr_url,
+    roi_table,
+    roi_name,
+    level,
+    channels,
+    labels,
+    feature_table,
+    reset_origin,
+    margin,
+    lazy,
+    cache,
+    cancel_event,
+    streaming=False,
+    projection=None,
+    z_range=None,
+    display_dtype=None,
+    feature_cache=False,
+):
+    """
+    Loads the ROI data, meant to run in a worker thread
+
+    Yields (layer_type, name, data, scale) tuples as soon as each channel,
+    label image or feature table is loaded, so the layers can be added
+    progressively in the main thread. layer_type is one of "image",
+    "labels", "features" or "info" (a message to show to the user).
+
+    params: channels: dict of channel names to channel indices
+    params: margin: Margin in micrometers the ROI is grown by
+    params: lazy: If True, the layers are multiscale dask arrays covering
+                  all pyramid levels & only the displayed tiles are read
+    params: cache: RoiCache used for (and filled by) non-lazy loads & the
+                   tiles of streamed loads
+    params: streaming: If True (& lazy), the levels of the layers are
+                       TiledArrays that read the visible tiles in the
+                       background (see streaming)
+    params: projection: Optional Z projection of the channels over the
+                        z_range, label images are max projected (see
+                        utils.project_roi)
+    params: display_dtype: Optional compact dtype the channels are rescaled
+                           to with their omero window (see
+                           utils.to_display_dtype)
+    params: feature_cache: If True, features are read from the memory-mapped
+                           columnar cache of the feature table (see
+                           feature_cache)
+    """
+    empty_roi_msg = (
+        "Could not load this ROI. Did you correctly set the "
+        "`Reset ROI Origin`?"
+    )
+    # Prefix of the cache keys of the tiles of streamed layers
+    tile_key = (
+        "tile",
+        str(zarr_url),
+        roi_table,
+        roi_name,
+        level,
+        reset_origin,
+        margin,
+        projection,
+        z_range,
+        display_dtype,
+    )
+    try:
+        # Load intensity images of all selected channels in a single pass
+        scale_img = None
+        if len(channels) > 0 and lazy:
+            pyramid, scale_img = load_intensity_roi_pyramid(
+                zarr_url=zarr_url,
+                roi_of_interest=roi_name,
+                channel_indices=list(channels.values()),
+                level=level,
+                roi_table=roi_table,
+                reset_origin=reset_origin,
+                margin=margin,
+            )
+            windows = [
+                get_channel_window(zarr_url, channel_index, pyramid[0].dtype)
+                for channel_index in channels.values()
+            ]
+            if len(scale_img) == 3:
+                windows = [
+                    get_projection_window(
+                        window, pyramid[0], projection, z_range
+                    )
+                    for window in windows
+                ]
+                pyramid = [
+                    project_roi(img_roi, projection, z_range)
+                    for img_roi in pyramid
+                ]
+            if pyramid[0].size == 0:
+                yield "info", None, empty_roi_msg, None
+                return
+            for i, (channel, window) in enumerate(zip(channels, windows)):
+                channel_pyramid = [
+                    to_display_dtype(img_roi[i], window, display_dtype)
+                    for img_roi in pyramid
+                ]
+                if streaming:
+                    channel_pyramid = stream_pyramid(
+                        channel_pyramid,
+                        key=tile_key + ("channel", channels[channel]),
+                        cache=cache,
+                    )
+                channel_pyramid = _multiscale_data(channel_pyramid)
+                yield "image", channel, channel_pyramid, scale_img
+        elif len(channels) > 0:
+            img_rois, scale_img = load_intensity_rois_cached(
+                cache,
+                zarr_url=zarr_url,
+                roi_of_interest=roi_name,
+                channel_indices=list(channels.values()),
+                level=level,
+                roi_table=roi_table,
+                reset_origin=reset_origin,
+                margin=margin,
+                cancel_event=cancel_event,
+                projection=projection,
+                z_range=z_range,
+                display_dtype=display_dtype,
+            )
+            if not any(np.any(img_roi) for img_roi in img_rois):
+                yield "info", None, empty_roi_msg, None
+                return
+            for channel, img_roi in zip(channels, img_rois):
+                yield "image", channel, img_roi, scale_img
+
+        # Load labels
+        for label in labels:
+            if lazy:
+                pyramid, scale_label = load_label_roi_pyramid(
+                    zarr_url=zarr_url,
+                    roi_of_interest=roi_name,
+                    label_name=label,
+                    target_scale=scale_img,
+                    roi_table=roi_table,
+                    reset_origin=reset_origin,
+                    margin=margin,
+                )
+                pyramid = [
+                    project_roi(lbl_roi, label_projection(projection), z_range)
+                    for lbl_roi in pyramid
+                ]
+                if pyramid[0].size == 0:
+                    yield "info", None, empty_roi_msg, None
+                    return
+                label_roi = pyramid[0]
+                if streaming:
+                    pyramid = stream_pyramid(
+                        pyramid,
+                        key=tile_key + ("label", label, tuple(scale_label)),
+                        cache=cache,
+                    )
+                yield "labels", label, _multiscale_data(pyramid), scale_label
+            else:
+                label_roi, scale_label = load_label_roi_cached(
+                    cache,
+                    zarr_url=zarr_url,
+                    roi_of_interest=roi_name,
+                    label_name=label,
+                    target_scale=scale_img,
+                    roi_table=roi_table,
+                    reset_origin=reset_origin,
+                    margin=margin,
+                    cancel_event=cancel_event,
+                    projection=label_projection(projection),
+                    z_range=z_range,
+                )
+                if not np.any(label_roi):
+                    yield "info", None, empty_roi_msg, None
+                    return
+                yield "labels", label, label_roi, scale_label
+
+        # Load features for the (single) label image
+        if feature_table is not None:
+            # The label IDs present in the ROI are counted chunk by chunk
+            # (without materializing lazy label images) & cached per ROI
+            label_ids, _ = get_roi_label_counts(
+                zarr_url=zarr_url,
+                roi_of_interest=roi_name,
+                label_name=label,
+                level=get_label_level(zarr_url, label, scale_img),
+                roi_table=roi_table,
+                reset_origin=reset_origin,
+                margin=margin,
+                cancel_event=cancel_event,
+            )
+            feature_columns = None
+            if feature_cache:
+                feature_columns = get_feature_columns(zarr_url, feature_table)
+            features_df = load_roi_features(
+                zarr_url=zarr_url,
+                feature_table=feature_table,
+                label_roi=None,
+                roi_name=roi_name,
+                label_ids=label_ids,
+                feature_columns=feature_columns,
+            )
+            yield "features", feature_table, (label, features_df), None
+    except LoadCancelled:
+        return
+
+
+@thread_worker
+def _load_roi(stats=None, **kwargs):
+    # Loads a ROI in a worker thread, see _iter_roi_layers. The stages of
+    # the load are recorded into stats (see instrumentation)
+    with recording(stats):
+        yield from _iter_roi_layers(**kwargs)
+
+
+@thread_worker
+def _load_images_roi(images, cancel_event, gap=0.1, stats=None, **kwargs):
+    """
+    Loads the same ROI of multiple images (e.g. of the wells of a plate)
+
+    Yields (image_id, offset, loaded) tuples, where loaded is a tuple
+    yielded by _iter_roi_layers. The ROIs of the images are placed side by
+    side: offset is the x position (in micrometers) of the layers of the
+    image, with a gap of `gap` times the ROI width between the images.
+
+    params: images: dict of image ids to image urls
+    params: stats: Optional LoadStats the stages of the load are recorded in
+    """
+    offset = 0.0
+    with recording(stats):
+        for image_id, image_url in images.items():
+            if cancel_event.is_set():
+                return
+            width = 0.0
+            for loaded in _iter_roi_layers(
+                zarr_url=image_url, cancel_event=cancel_event, **kwargs
+            ):
+                layer_type, _, data, scale = loaded
+                if layer_type in ("image", "labels"):
+                    level_data = data[0] if isinstance(data, list) else data
+                    width = max(width, level_data.shape[-1] * scale[-1])
+                yield image_id, offset, loaded
+            offset += width * (1 + gap)
+
+
+@thread_worker
+def _load_montage(stats=None, **kwargs):
+    # Loads a montage of ROIs in a worker thread, see montage.load_montage.
+    # Returns None if the load was cancelled
+    with recording(stats):
+        try:
+            return load_montage(**kwargs)
+        except LoadCancelled:
+            return None
+
+
+@thread_worker
+def _build_object_indices(zarr_url, labels):
+    # Builds the object index of each label image in a worker thread
+    for label in labels:
+        build_object_index(zarr_url, label)
+
+
+@thread_worker
+def _prefetch_rois(**kwargs):
+    # Fills the ROI cache in a worker thread, see roi_cache.prefetch_rois
+    try:
+        prefetch_rois(**kwargs)
+    except LoadCancelled:
+        return
+
 
 class RoiLoader(Container):
     def __init__(self, viewer: napari.viewer.Viewer):
@@ -39,80 +391,778 @@ class RoiLoader(Container):
         self.channel_names_dict = {}
         self.labels_dict = {}
         self._zarr_url_picker = FileEdit(label="Zarr URL", mode="d")
+        self._well_picker = Select(
+            label="Wells",
+            tooltip="Images of the plate. The selected ROI is loaded for "
+            "each selected image, side by side",
+            visible=False,
+        )
         self._roi_table_picker = ComboBox(label="ROI Table")
         self._roi_picker = ComboBox(label="ROI")
         self._channel_picker = Select(
             label="Channels",
         )
         self._level_picker = ComboBox(label="Image Level")
+        self._memory_budget = SpinBox(
+            label="Memory budget (MB)",
+            tooltip="The auto image level picks the finest level at which "
+            "the selected channels & labels of the ROI fit this budget",
+            value=4096,
+            min=1,
+            max=1024**2,
+            step=256,
+        )
+        self._expected_size = Label(label="Expected size")
+        self._projection = ComboBox(
+            label="Z projection",
+            tooltip="Projects the channels along Z while they are read, only "
+            "the projection is kept in memory. Labels are max projected",
+            choices=[NO_PROJECTION, *PROJECTIONS],
+            value=NO_PROJECTION,
+        )
+        self._display_dtype = ComboBox(
+            label="Display dtype",
+            tooltip="Rescales the channels to uint8 or float16 with their "
+            "contrast window while they are read. Takes a half or a quarter "
+            "of the memory of the raw data",
+            choices=[RAW_DTYPE, *DISPLAY_DTYPES],
+            value=RAW_DTYPE,
+        )
+        self._z_range = RangeSlider(
+            label="Z planes",
+            tooltip="Z planes of the ROI that are projected",
+            min=0,
+            max=0,
+            value=(0, 0),
+            visible=False,
+        )
         self._label_picker = Select(
             label="Labels",
         )
         self._feature_picker = Select(
             label="Features",
         )
+        self._feature_cache = CheckBox(
+            label="Cache feature tables",
+            tooltip="Converts the feature tables into memory-mapped columns "
+            "on disk once, so attaching features doesn't parse the tables",
+        )
         self._reset_origin = CheckBox(
             label="Reset ROI Origin",
         )
+        self._margin = FloatSpinBox(
+            label="ROI margin (µm)",
+            value=0.0,
+            min=0.0,
+            max=10000.0,
+        )
+        self._lazy = CheckBox(
+            label="Lazy multiscale loading",
+        )
+        self._streaming = CheckBox(
+            label="Stream visible tiles",
+            tooltip="Lazy multiscale loading that keeps the visible tiles "
+            "in the cache & shows a low resolution preview until they are "
+            "read in the background",
+        )
+        self._prefetch = CheckBox(
+            label="Prefetch neighboring ROIs",
+            value=True,
+        )
+        self._cache_size = SpinBox(
+            label="Cache size (MB)",
+            value=2048,
+            min=0,
+            max=1024**2,
+            step=256,
+        )
+        self._concurrency = SpinBox(
+            label="Concurrent requests",
+            tooltip="Concurrent chunk requests for remote (http, s3) stores",
+            value=get_max_concurrent_requests(),
+            min=1,
+            max=1024,
+        )
         self._run_button = PushButton(value=False, text="Load ROI")
+        self._raw_button = PushButton(
+            text="Load raw data",
+            tooltip="Loads the selected ROI with the raw dtype, whatever the "
+            "display dtype",
+        )
+        self._progress = ProgressBar(label="Loading", visible=False)
+        self._cancel_button = PushButton(text="Cancel", enabled=False)
+        self._montage_rois = Select(
+            label="Montage ROIs",
+            tooltip="ROIs of the montage (all ROIs if none is selected)",
+        )
+        self._montage_sample = SpinBox(
+            label="Random sample",
+            tooltip="Number of ROIs randomly picked for the montage "
+            "(0: all)",
+            value=0,
+            min=0,
+            max=1000000,
+        )
+        self._montage_button = PushButton(text="Load montage")
+        self._index_button = PushButton(text="Build object index")
+        self._query = LineEdit(
+            label="Feature query",
+            tooltip="Condition on the features of the selected feature "
+            "table, e.g. area > 200 and intensity_mean_DAPI < 50",
+        )
+        self._rank_by = ComboBox(
+            label="Rank by", choices=[NO_RANKING], value=NO_RANKING
+        )
+        self._highest_first = CheckBox(label="Highest first", value=True)
+        self._query_button = PushButton(text="Run query")
+        self._query_page = SpinBox(label="Hits page", value=0, min=0, max=0)
+        self._hits = ComboBox(label="Hits", choices=[])
+        self._hit_button = PushButton(text="Load hit")
+        self._hits_montage_button = PushButton(text="Load hits montage")
+        self._show_stats = CheckBox(label="Show load stats")
+        self._stats_text = TextEdit(label="Load stats", visible=False)
+        self._stats_text.read_only = True
+        self._stats_export = FileEdit(
+            label="Export load stats",
+            mode="w",
+            filter="*.json",
+            visible=False,
+        )
+        self._worker = None
+        self._cancel_event = None
+        self._label_layers = {}
+        self._roi_cache = RoiCache(
+            max_bytes=self._cache_size.value * 1024**2
+        )
+        self._prefetch_worker = None
+        self._prefetch_cancel_event = None
+        self._prefetch_kwargs = None
+        self._plate_index = None
+        self._stats = None
+        self._load_stats = []
+        self._load_display_dtype = None
+        self._query_hits = None
 
         # Initialize possible choices
         # self.update_roi_tables()
         self.update_roi_selection()
 
         # Update selections & bind buttons
-        self._zarr_url_picker.changed.connect(self.update_roi_tables)
+        self._zarr_url_picker.changed.connect(self.update_plate)
+        self._well_picker.changed.connect(self.update_roi_tables)
         self._run_button.clicked.connect(self.run)
+        self._raw_button.clicked.connect(self.load_raw)
+        self._cancel_button.clicked.connect(self.cancel)
+        self._montage_button.clicked.connect(self.load_montage)
+        self._index_button.clicked.connect(self.build_object_index)
+        self._query_button.clicked.connect(self.run_query)
+        self._query_page.changed.connect(self.update_hits)
+        self._hit_button.clicked.connect(self.load_hit)
+        self._hits_montage_button.clicked.connect(self.load_hits_montage)
+        self._feature_picker.changed.connect(self.update_rank_choices)
+        self._cache_size.changed.connect(self._update_cache_size)
+        self._concurrency.changed.connect(set_max_concurrent_requests)
         self._roi_table_picker.changed.connect(self.update_roi_selection)
+        for widget in (
+            self._roi_picker,
+            self._channel_picker,
+            self._level_picker,
+            self._label_picker,
+            self._reset_origin,
+            self._margin,
+            self._memory_budget,
+            self._projection,
+            self._z_range,
+            self._display_dtype,
+        ):
+            widget.changed.connect(self.update_expected_size)
+        for widget in (
+            self._roi_picker,
+            self._reset_origin,
+            self._margin,
+            self._projection,
+        ):
+            widget.changed.connect(self.update_z_range)
+        self._show_stats.changed.connect(self._toggle_stats)
+        self._stats_export.changed.connect(self.export_load_stats)
 
         super().__init__(
             widgets=[
                 self._zarr_url_picker,
+                self._well_picker,
                 self._roi_table_picker,
                 self._roi_picker,
                 self._channel_picker,
                 self._level_picker,
+                self._memory_budget,
+                self._expected_size,
+                self._projection,
+                self._z_range,
+                self._display_dtype,
                 self._label_picker,
                 self._feature_picker,
+                self._feature_cache,
                 self._reset_origin,
+                self._margin,
+                self._lazy,
+                self._streaming,
+                self._prefetch,
+                self._cache_size,
+                self._concurrency,
                 self._run_button,
+                self._raw_button,
+                self._progress,
+                self._cancel_button,
+                self._montage_rois,
+                self._montage_sample,
+                self._montage_button,
+                self._index_button,
+                self._query,
+                self._rank_by,
+                self._highest_first,
+                self._query_button,
+                self._query_page,
+                self._hits,
+                self._hit_button,
+                self._hits_montage_button,
+                self._show_stats,
+                self._stats_text,
+                self._stats_export,
             ]
         )
 
+    @property
+    def zarr_url(self):
+        # The selected OME-Zarr image. The value of the FileEdit is a Path,
+        # which collapses the "//" of remote urls, so those are read from
+        # the text field directly
+        url = self._zarr_url_picker.line_edit.value
+        if is_remote_url(url):
+            return url.strip()
+        return self._zarr_url_picker.value
+
+    @property
+    def image_url(self):
+        # The image the choices are read from & that is loaded: the zarr
+        # url or, for plates, the first selected image of the plate
+        if self._plate_index is None:
+            return self.zarr_url
+        image_ids = self._well_picker.value or list(self._plate_index)[:1]
+        if not image_ids:
+            return self.zarr_url
+        return self._plate_index[image_ids[0]]["url"]
+
+    @property
+    def projection(self):
+        # The selected Z projection or None
+        if self._projection.value == NO_PROJECTION:
+            return None
+        return self._projection.value
+
+    @property
+    def z_range(self):
+        # The (start, stop) range of the Z planes that are projected or None
+        # if all planes are
+        start, end = self._z_range.value
+        if (start, end) == (self._z_range.min, self._z_range.max):
+            return None
+        return (start, end + 1)
+
+    @property
+    def display_dtype(self):
+        # The selected display dtype or None for the raw data
+        if self._display_dtype.value == RAW_DTYPE:
+            return None
+        return self._display_dtype.value
+
     def run(self):
+        self._start_load(display_dtype=self.display_dtype)
+
+    def load_raw(self):
+        """
+        Loads the selected ROI with the raw data, whatever the display dtype
+        """
+        self._start_load(display_dtype=None)
+
+    def _start_load(self, display_dtype):
         roi_table = self._roi_table_picker.value
         roi_name = self._roi_picker.value
         level = self._level_picker.value
         channels = self._channel_picker.value
         labels = self._label_picker.value
+        features = self._feature_picker.value
         reset_origin = self._reset_origin.value
+        margin = self._margin.value
         if len(channels) < 1 and len(labels) < 1:
             show_info(
                 "No channel or labels selected. "
                 "Select the channels/labels you want to load"
             )
             return
-        blending = None
-        scale_img = None
 
-        # Load intensity images
-        for channel in channels:
-            img_roi, scale_img = load_intensity_roi(
-                zarr_url=self._zarr_url_picker.value,
-                roi_of_interest=roi_name,
-                channel_index=self.channel_names_dict[channel],
-                level=level,
-                roi_table=roi_table,
-                reset_origin=reset_origin,
-            )
-            if not np.any(img_roi):
+        # Load features
+        # Initially a bearbones implementation that only works when a single
+        # label image is also loaded at that moment
+        feature_table = None
+        if len(features) > 0:
+            if len(labels) != 1:
+                show_info(
+                    "Not implemented yet: Please select exactly one label "
+                    "image to load features for"
+                )
+            # TODO: Implement loading multiple features at once
+            # (and mapping them to the correct labels)
+            elif len(features) > 1:
                 show_info(
-                    "Could not load this ROI. Did you correctly set the "
-                    "`Reset ROI Origin`?"
+                    "Not implemented yet: Please select exactly one "
+                    "feature to load"
+                )
+            else:
+                feature_table = features[0]
+
+        if level == AUTO_LEVEL:
+            level, _ = self._get_load_estimate()
+
+        # Starting a new load cancels a load (or prefetch) that is still
+        # running
+        self.cancel()
+        self._cancel_prefetch()
+
+        cancel_event = threading.Event()
+        self._cancel_event = cancel_event
+        self._label_layers = {}
+        self._progress.max = (
+            len(channels) + len(labels) + (feature_table is not None)
+        )
+        self._progress.value = 0
+        self._progress.visible = True
+        self._cancel_button.enabled = True
+
+        zarr_url = self.image_url
+        lazy = self._lazy.value or self._streaming.value
+        self._load_display_dtype = display_dtype
+        self._stats = LoadStats(
+            roi_name,
+            zarr_url=str(zarr_url),
+            roi_table=roi_table,
+            channels=list(channels),
+            labels=list(labels),
+            feature_table=feature_table,
+            lazy=lazy,
+            streaming=self._streaming.value,
+            projection=self.projection,
+            z_range=self.z_range,
+            display_dtype=display_dtype,
+        )
+        channel_indices = {
+            channel: self.channel_names_dict[channel] for channel in channels
+        }
+        load_kwargs = dict(
+            roi_table=roi_table,
+            roi_name=roi_name,
+            level=level,
+            channels=channel_indices,
+            labels=labels,
+            feature_table=feature_table,
+            reset_origin=reset_origin,
+            margin=margin,
+            lazy=lazy,
+            streaming=self._streaming.value,
+            projection=self.projection,
+            z_range=self.z_range,
+            display_dtype=display_dtype,
+            feature_cache=self._feature_cache.value,
+            cache=self._roi_cache,
+            cancel_event=cancel_event,
+            stats=self._stats,
+        )
+        self._prefetch_kwargs = None
+        if self._plate_index is not None:
+            # Plate mode: Load the ROI of all selected images side by side
+            image_ids = self._get_load_images()
+            worker = _load_images_roi(
+                images={
+                    image_id: self._plate_index[image_id]["url"]
+                    for image_id in image_ids
+                },
+                **load_kwargs,
+            )
+            self._progress.max = self._progress.max * len(image_ids)
+            worker.yielded.connect(
+                partial(self._add_image_layer, cancel_event)
+            )
+        else:
+            worker = _load_roi(zarr_url=zarr_url, **load_kwargs)
+            # Lazy loads don't read the data, thus there's nothing to
+            # prefetch
+            if self._prefetch.value and not lazy:
+                self._prefetch_kwargs = dict(
+                    zarr_url=zarr_url,
+                    roi_names=get_neighbor_rois(
+                        list(self._roi_picker.choices), roi_name
+                    ),
+                    channel_indices=list(channel_indices.values()),
+                    labels=labels,
+                    level=level,
+                    roi_table=roi_table,
+                    reset_origin=reset_origin,
+                    margin=margin,
+                    projection=self.projection,
+                    z_range=self.z_range,
+                    display_dtype=display_dtype,
                 )
+            worker.yielded.connect(partial(self._add_layer, cancel_event))
+        worker.finished.connect(partial(self._load_finished, worker))
+        self._worker = worker
+        worker.start()
+
+    def load_montage(self):
+        """
+        Loads the montage ROIs side by side in a grid
+
+        Each channel & label image is loaded into a single layer, whatever
+        the number of ROIs. Clicking a montage layer shows the ROI under
+        the mouse.
+        """
+        channels = self._channel_picker.value
+        labels = self._label_picker.value
+        if len(channels) < 1 and len(labels) < 1:
+            show_info(
+                "No channel or labels selected. "
+                "Select the channels/labels you want to load"
+            )
+            return
+        roi_names = select_rois(
+            self._roi_picker.choices,
+            rois=self._montage_rois.value,
+            sample=self._montage_sample.value,
+        )
+        if not roi_names or roi_names == [""]:
+            show_info("No ROIs to load for the montage")
+            return
+        channel_indices = {
+            channel: self.channel_names_dict[channel] for channel in channels
+        }
+        kwargs = dict(
+            zarr_url=self.image_url,
+            roi_names=roi_names,
+            channels=channel_indices,
+            labels=labels,
+            roi_table=self._roi_table_picker.value,
+            reset_origin=self._reset_origin.value,
+            margin=self._margin.value,
+        )
+        level = self._level_picker.value
+        if level == AUTO_LEVEL:
+            # The budget is shared by all ROIs, the first ROI is estimated
+            level, _ = get_auto_level(
+                zarr_url=self.image_url,
+                roi_of_interest=roi_names[0],
+                channel_indices=list(channel_indices.values()),
+                labels=labels,
+                max_bytes=self._memory_budget.value
+                * 1024**2
+                / len(roi_names),
+                roi_table=self._roi_table_picker.value,
+                reset_origin=self._reset_origin.value,
+                margin=self._margin.value,
+            )
+
+        self.cancel()
+        self._cancel_prefetch()
+        cancel_event = threading.Event()
+        self._cancel_event = cancel_event
+        self._label_layers = {}
+        self._prefetch_kwargs = None
+        self._load_display_dtype = None
+        self._progress.max = len(channels) + len(labels)
+        self._progress.value = 0
+        self._progress.visible = True
+        self._cancel_button.enabled = True
+        self._stats = LoadStats(
+            "montage",
+            zarr_url=str(self.image_url),
+            roi_table=self._roi_table_picker.value,
+            rois=roi_names,
+            channels=list(channels),
+            labels=list(labels),
+        )
+        worker = _load_montage(
+            level=level, cancel_event=cancel_event, stats=self._stats, **kwargs
+        )
+        worker.returned.connect(partial(self._add_montage, cancel_event))
+        worker.finished.connect(partial(self._load_finished, worker))
+        self._worker = worker
+        worker.start()
+        return worker
+
+    def _add_montage(self, cancel_event, montage):
+        # Adds the layers of a loaded montage. Runs in the main thread
+        if montage is None:
+            return
+        for layer_type, name, data, scale in montage.layers:
+            self._add_layer(
+                cancel_event, (layer_type, name, data, scale), prefix="montage"
+            )
+            if cancel_event.is_set():
                 return
+            layer = self._viewer.layers[-1]
+            layer.metadata["montage"] = montage
+            layer.mouse_drag_callbacks.append(self._show_montage_roi)
+
+    @staticmethod
+    def _show_montage_roi(layer, event):
+        # Mouse callback of montage layers: shows the ROI that was clicked
+        roi_name = layer.metadata["montage"].roi_at(event.position)
+        if roi_name is not None:
+            show_info(f"ROI {roi_name}")
+
+    def build_object_index(self):
+        """
+        Builds the object index of the selected label images
 
-            channel_meta = self.channel_dict[self.channel_names_dict[channel]]
+        Each index is saved as a `<label>_ROI_table` ROI table that lists
+        every object as a ROI, so single objects can be loaded (with a
+        margin) without loading a whole FOV.
+        """
+        labels = self._label_picker.value
+        if len(labels) < 1:
+            show_info("Select the label images to build an object index for")
+            return
+        self._index_button.enabled = False
+        worker = _build_object_indices(self.image_url, labels)
+        worker.finished.connect(self._object_index_built)
+        worker.start()
+        return worker
+
+    def _object_index_built(self):
+        self._index_button.enabled = True
+        self.update_roi_tables()
+
+    def run_query(self):
+        """
+        Finds the objects of the selected feature table matching the query
+
+        The query is evaluated on the memory-mapped columns of the feature
+        table (see feature_query). If the selected label image has an
+        object index, the hits can be loaded as single objects.
+        returns the QueryHits (or None if the query could not be run)
+        """
+        features = self._feature_picker.value
+        labels = self._label_picker.value
+        if len(features) != 1:
+            show_info("Select exactly one feature table to query")
+            return None
+        rank_by = self._rank_by.value
+        try:
+            hits = query_features(
+                self.image_url,
+                features[0],
+                self._query.value,
+                rank_by=None if rank_by == NO_RANKING else rank_by,
+                descending=self._highest_first.value,
+                label_name=labels[0] if len(labels) == 1 else None,
+            )
+        except ValueError as e:
+            show_info(str(e))
+            return None
+        self._query_hits = hits
+        with self._query_page.changed.blocked():
+            self._query_page.max = max(hits.n_pages() - 1, 0)
+            self._query_page.value = 0
+        self.update_hits()
+        show_info(f"{len(hits)} objects match the query")
+        return hits
+
+    def update_hits(self):
+        """
+        Lists the hits of the selected page of the last query
+        """
+        choices = []
+        if self._query_hits is not None:
+            page = self._query_hits.page(self._query_page.value)
+            for _, hit in page.iterrows():
+                name = str(hit["label"])
+                if hit.get("roi"):
+                    name += f" in {hit['roi']}"
+                if self._query_hits.rank_by is not None:
+                    name += f" ({hit[self._query_hits.rank_by]:g})"
+                choices.append((name, str(hit["label"])))
+        self._hits.choices = choices
+        self._hits._default_choices = choices
+
+    def update_rank_choices(self):
+        # Offers the features of the selected feature table for ranking
+        features = self._feature_picker.value
+        columns = []
+        if len(features) == 1:
+            columns = get_feature_table_columns(self.image_url, features[0])
+        choices = [NO_RANKING] + list(dict.fromkeys(columns))
+        self._rank_by.choices = choices
+        self._rank_by._default_choices = choices
+
+    def _select_object_roi_table(self):
+        # Switches the ROI table to the object index the query hits can be
+        # loaded from. Returns False if there is none
+        hits = self._query_hits
+        if hits is None or hits.object_roi_table is None:
+            show_info(
+                "Select the label image of the feature table & build its "
+                "object index to load the hits of a query"
+            )
+            return False
+        if self._roi_table_picker.value != hits.object_roi_table:
+            self._roi_table_picker.value = hits.object_roi_table
+        return True
+
+    def load_hit(self):
+        """
+        Loads the selected hit of the last query as a single object ROI
+        """
+        label = self._hits.value
+        if label is None or not self._select_object_roi_table():
+            return
+        if label not in self._roi_picker.choices:
+            show_info(f"Object {label} is not in the object index")
+            return
+        self._roi_picker.value = label
+        self.run()
+
+    def load_hits_montage(self):
+        """
+        Loads the hits of the selected page of the last query as a montage
+        """
+        if self._query_hits is None or not self._select_object_roi_table():
+            return None
+        page = self._query_hits.page(self._query_page.value)
+        self._montage_rois.value = [
+            label
+            for label in page["label"].astype(str)
+            if label in self._montage_rois.choices
+        ]
+        if not self._montage_rois.value:
+            show_info("No hits to load for the montage")
+            return None
+        self._montage_sample.value = 0
+        return self.load_montage()
+
+    def cancel(self):
+        """
+        Cancels the running ROI load (if any)
+
+        Layers that were already added stay in the viewer, chunk reads that
+        have not started yet are skipped.
+        """
+        if self._worker is not None:
+            self._cancel_event.set()
+            self._worker.quit()
+            self._load_finished(self._worker)
+
+    def _load_finished(self, worker):
+        # Finished signals of cancelled loads must not reset the state of
+        # a newer load
+        if worker is not self._worker:
+            return
+        self._worker = None
+        self._progress.visible = False
+        self._cancel_button.enabled = False
+        self._record_stats(self._stats)
+        if not self._cancel_event.is_set() and self._prefetch_kwargs:
+            self._start_prefetch(**self._prefetch_kwargs)
+
+    def _start_prefetch(self, **kwargs):
+        # Warms the ROI cache with the neighboring ROIs in the background
+        cancel_event = threading.Event()
+        self._prefetch_cancel_event = cancel_event
+        worker = _prefetch_rois(
+            cache=self._roi_cache,
+            cancel_event=cancel_event,
+            **kwargs,
+        )
+        worker.finished.connect(partial(self._prefetch_finished, worker))
+        self._prefetch_worker = worker
+        worker.start()
+
+    def _cancel_prefetch(self):
+        if self._prefetch_worker is not None:
+            self._prefetch_cancel_event.set()
+            self._prefetch_worker = None
+
+    def _prefetch_finished(self, worker):
+        if worker is self._prefetch_worker:
+            self._prefetch_worker = None
+
+    def _record_stats(self, stats):
+        # Finishes the stats of a load & shows them in the stats panel
+        stats.finish()
+        self._load_stats.append(stats)
+        del self._load_stats[:-MAX_LOAD_STATS]
+        self._stats_text.value = stats.format()
+
+    def _toggle_stats(self):
+        self._stats_text.visible = self._show_stats.value
+        self._stats_export.visible = self._show_stats.value
+
+    def export_load_stats(self, path=None):
+        """
+        Exports the stats of the last loads as JSON
+
+        params: path: Path of the JSON file (default: the path selected in
+                      the stats panel)
+        """
+        path = path or self._stats_export.value
+        if not self._load_stats or not str(path) or str(path) == ".":
+            return
+        export_stats(self._load_stats, path)
+        show_info(f"Exported the stats of {len(self._load_stats)} loads")
+
+    def _update_cache_size(self):
+        self._roi_cache.max_bytes = self._cache_size.value * 1024**2
+
+    def _add_image_layer(self, cancel_event, loaded):
+        # Adds a layer of one of multiple images loaded side by side
+        image_id, offset, loaded = loaded
+        self._add_layer(cancel_event, loaded, prefix=image_id, offset=offset)
+
+    def _add_layer(self, cancel_event, loaded, prefix=None, offset=None):
+        # Adds a layer yielded by the load worker to the viewer. Runs in the
+        # main thread.
+        # params: prefix: Optional prefix of the layer name (e.g. the well)
+        # params: offset: Optional x position of the layer in micrometers
+        if cancel_event.is_set():
+            return
+        layer_type, name, data, scale = loaded
+        layer_name = f"{prefix} {name}" if prefix else name
+        layer_kwargs = {}
+        if offset is not None and layer_type in ("image", "labels"):
+            level_data = data[0] if isinstance(data, list) else data
+            layer_kwargs["translate"] = [0.0] * (level_data.ndim - 1) + [
+                offset
+            ]
+        if layer_type == "info":
+            show_info(data)
+            return
+        if isinstance(data, list) and isinstance(data[0], TiledArray):
+            # Streamed layers are refreshed when visible tiles were loaded
+            data[0].loader.on_loaded = partial(self._refresh_layer, layer_name)
+        with recording(self._stats), stage(f"add_{layer_type}", layer_name):
+            self._add_layer_data(
+                layer_type, name, layer_name, data, scale, prefix, layer_kwargs
+            )
+        self._progress.value = self._progress.value + 1
+
+    @ensure_main_thread
+    def _refresh_layer(self, layer_name):
+        # Redraws a streamed layer with the tiles that were loaded in the
+        # background (the layer may have been removed in the meantime)
+        if layer_name in self._viewer.layers:
+            self._viewer.layers[layer_name].refresh()
+
+    def _add_layer_data(
+        self, layer_type, name, layer_name, data, scale, prefix, layer_kwargs
+    ):
+        if layer_type == "image":
+            channel_meta = self.channel_dict[self.channel_names_dict[name]]
             colormap = Colormap(
                 ["#000000", f"#{channel_meta['color']}"],
                 name=channel_meta["color"],
@@ -124,98 +1174,73 @@ class RoiLoader(Container):
                 )
             except KeyError:
                 rescaling = None
+            if self._load_display_dtype is not None:
+                # The window was applied while loading
+                rescaling = get_display_contrast_limits(
+                    self._load_display_dtype
+                )
+            # Only the first loaded channel is not blended additively
+            blending = "additive" if self._progress.value > 0 else None
 
             self._viewer.add_image(
-                img_roi,
-                scale=scale_img,
+                data,
+                multiscale=isinstance(data, list),
+                scale=scale,
                 blending=blending,
                 contrast_limits=rescaling,
                 colormap=colormap,
-                name=channel,
+                name=layer_name,
+                **layer_kwargs,
             )
-            blending = "additive"
-
-        # Load labels
-        label_layers = []
-        for label in labels:
-            label_roi, scale_label = load_label_roi(
-                zarr_url=self._zarr_url_picker.value,
-                roi_of_interest=roi_name,
-                label_name=label,
-                target_scale=scale_img,
-                roi_table=roi_table,
-                reset_origin=reset_origin,
+        elif layer_type == "labels":
+            if isinstance(data, np.ndarray) and not data.flags.writeable:
+                # Cached label ROIs are read-only, the layer gets its own
+                # copy to paint on
+                data = data.copy()
+            self._label_layers[layer_name] = self._viewer.add_labels(
+                data,
+                multiscale=isinstance(data, list),
+                scale=scale,
+                name=layer_name,
+                **layer_kwargs,
             )
-            if not np.any(label_roi):
-                show_info(
-                    "Could not load this ROI. Did you correctly set the "
-                    "`Reset ROI Origin`?"
-                )
-                return
-            label_layers.append(
-                self._viewer.add_labels(
-                    label_roi, scale=scale_label, name=label
-                )
+        elif layer_type == "features":
+            label_name, features_df = data
+            if prefix:
+                label_name = f"{prefix} {label_name}"
+            self.set_layer_features(
+                name, self._label_layers[label_name], features_df
             )
 
-        # Load features
-        # Initially a bearbones implementation that only works when a single
-        # label image is also loaded at that moment
-        features = self._feature_picker.value
-        if len(features) > 0:
-            if len(labels) != 1:
-                show_info(
-                    "Not implemented yet: Please select exactly one label "
-                    "image to load features for"
-                )
-                return
-            else:
-                # TODO: Implement loading multiple features at once
-                # (and mapping them to the correct labels)
-                if len(features) > 1:
-                    show_info(
-                        "Not implemented yet: Please select exactly one "
-                        "feature to load"
-                    )
-                    return
-                else:
-                    # Actual feature loading
-                    feature_table = features[0]
-                    label_layer = label_layers[0]
-                    self.add_feature_table_to_layer(
-                        feature_table,
-                        label_layer,
-                        roi_name,
-                    )
-
     def add_feature_table_to_layer(self, feature_table, label_layer, roi_name):
-        feature_ad = load_features(
-            zarr_url=self._zarr_url_picker.value,
-            feature_table=feature_table,
+        stats = LoadStats(
+            roi_name, zarr_url=str(self.image_url), feature_table=feature_table
         )
-        if "label" in feature_ad.obs:
-            # TODO: Only load the feature for the ROI,
-            # not the whole table
-            labels_current_layer = np.unique(label_layer.data)[1:]
-            shared_labels = list(
-                set(feature_ad.obs["label"].astype(int))
-                & set(labels_current_layer)
+        with recording(stats):
+            feature_columns = None
+            if self._feature_cache.value:
+                feature_columns = get_feature_columns(
+                    self.image_url, feature_table
+                )
+            features_df = load_roi_features(
+                zarr_url=self.image_url,
+                feature_table=feature_table,
+                label_roi=(
+                    label_layer.data[0]
+                    if label_layer.multiscale
+                    else label_layer.data
+                ),
+                roi_name=roi_name,
+                feature_columns=feature_columns,
             )
-            features_roi = feature_ad[
-                feature_ad.obs["label"].astype(int).isin(shared_labels)
-            ]
-            features_df = features_roi.to_df()
-            # Drop duplicate columns
-            features_df = features_df.loc[
-                :, ~features_df.columns.duplicated()
-            ].copy()
-            features_df["label"] = feature_ad.obs["label"].astype(int)
-            features_df[
-                "roi_id"
-            ] = f"{self._zarr_url_picker.value}:ROI_{roi_name}"
-            features_df.set_index("label", inplace=True, drop=False)
-            # To display correct
-            features_df["index"] = features_df["label"]
+            with stage("set_features", feature_table):
+                self.set_layer_features(
+                    feature_table, label_layer, features_df
+                )
+        self._record_stats(stats)
+
+    def set_layer_features(self, feature_table, label_layer, features_df):
+        if features_df is not None:
             label_layer.features = features_df
         else:
             show_info(
@@ -224,6 +1249,25 @@ class RoiLoader(Container):
                 f"layer {label_layer}"
             )
 
+    def update_plate(self):
+        """
+        Switches to plate mode if the zarr url is an HCS plate
+
+        In plate mode, the (cached) plate index lists all images of the
+        plate, which are offered in the well picker.
+        """
+        self._plate_index = None
+        if self.zarr_url and is_plate(self.zarr_url):
+            self._plate_index = get_plate_index(self.zarr_url)
+        image_ids = list(self._plate_index or [])
+        self._well_picker.visible = self._plate_index is not None
+        # Setting the choices emits changed, which updates the ROI tables
+        with self._well_picker.changed.blocked():
+            self._well_picker.choices = image_ids
+            self._well_picker._default_choices = image_ids
+            self._well_picker.value = image_ids[:1]
+        self.update_roi_tables()
+
     def update_roi_tables(self):
         """
         Handles updating the list of available ROI tables
@@ -245,6 +1289,10 @@ class RoiLoader(Container):
         new_rois = self._get_roi_choices()
         self._roi_picker.choices = new_rois
         self._roi_picker._default_choices = new_rois
+        montage_rois = [roi for roi in new_rois if roi]
+        self._montage_rois.choices = montage_rois
+        self._montage_rois._default_choices = montage_rois
+        self._montage_rois.value = []
         channels = self._get_channel_choices()
         self._channel_picker.choices = channels
         self._channel_picker._default_choices = channels
@@ -267,15 +1315,127 @@ class RoiLoader(Container):
             self._reset_origin.value = True
         else:
             self._reset_origin.value = False
+        self.update_z_range()
+        self.update_expected_size()
+
+    def _get_load_images(self):
+        # Ids of the images of the plate the selected ROI is loaded for
+        return get_images_with_roi(
+            self._plate_index,
+            self._roi_table_picker.value,
+            self._roi_picker.value,
+            image_ids=self._well_picker.value,
+        )
+
+    def _get_load_estimate(self):
+        """
+        Resolves the auto level & estimates the size of the selected load
+
+        In plate mode, the size of the ROI of the first selected image is
+        multiplied by the number of images it is loaded for (& the budget
+        is split between them).
+        returns the image level that is loaded & the expected size in bytes
+        """
+        nb_images = 1
+        if self._plate_index is not None:
+            nb_images = max(len(self._get_load_images()), 1)
+        kwargs = dict(
+            zarr_url=self.image_url,
+            roi_of_interest=self._roi_picker.value,
+            channel_indices=[
+                self.channel_names_dict[channel]
+                for channel in self._channel_picker.value
+            ],
+            labels=self._label_picker.value,
+            roi_table=self._roi_table_picker.value,
+            reset_origin=self._reset_origin.value,
+            margin=self._margin.value,
+            projection=self.projection,
+            z_range=self.z_range,
+            display_dtype=self.display_dtype,
+        )
+        level = self._level_picker.value
+        if level == AUTO_LEVEL:
+            level, nbytes = get_auto_level(
+                max_bytes=self._memory_budget.value * 1024**2 / nb_images,
+                **kwargs,
+            )
+        else:
+            nbytes = estimate_roi_nbytes(level=level, **kwargs)
+        return level, nbytes * nb_images
+
+    def update_expected_size(self):
+        """
+        Shows how much memory loading the selected ROI takes
+
+        Only the metadata & the ROI table are read for the estimate.
+        """
+        if self._level_picker.value in ("", None):
+            self._expected_size.value = ""
+            return
+        try:
+            level, nbytes = self._get_load_estimate()
+        except (
+            KeyError,
+            IndexError,
+            zarr.errors.GroupNotFoundError,
+            zarr.errors.PathNotFoundError,
+        ):
+            # No valid image, ROI or level selected (yet)
+            self._expected_size.value = ""
+            return
+        expected_size = f"{_format_nbytes(nbytes)} at level {level}"
+        if nbytes > self._memory_budget.value * 1024**2:
+            expected_size += ", exceeds the memory budget"
+        self._expected_size.value = expected_size
+
+    def update_z_range(self):
+        """
+        Offers the Z planes of the selected ROI for the projection
+        """
+        self._z_range.visible = self.projection is not None
+        try:
+            img_roi, scale_img = get_lazy_intensity_roi(
+                zarr_url=self.image_url,
+                roi_of_interest=self._roi_picker.value,
+                roi_table=self._roi_table_picker.value,
+                reset_origin=self._reset_origin.value,
+                margin=self._margin.value,
+            )
+            nb_planes = img_roi.shape[-3] if len(scale_img) == 3 else 1
+        except (
+            KeyError,
+            IndexError,
+            zarr.errors.GroupNotFoundError,
+            zarr.errors.PathNotFoundError,
+        ):
+            # No valid image or ROI selected (yet)
+            nb_planes = 1
+        last_plane = max(nb_planes, 1) - 1
+        if self._z_range.max != last_plane:
+            # Resets the range to all planes of the new ROI
+            self._z_range.max = last_plane
+            self._z_range.value = (0, last_plane)
 
     def _get_roi_choices(self):
         if not self._roi_table_picker.value:
             # When no roi table is provided.
             # E.g. during bug with self._roi_table_picker reset
             return [""]
+        if self._plate_index is not None:
+            # All ROIs of the selected images, read from the plate index
+            image_ids = self._well_picker.value or list(self._plate_index)
+            roi_names = {}
+            for image_id in image_ids:
+                roi_tables = self._plate_index[image_id]["roi_tables"]
+                for roi_name in roi_tables.get(
+                    self._roi_table_picker.value, []
+                ):
+                    roi_names[roi_name] = None
+            return list(roi_names) or [""]
         try:
             roi_table = read_table(
-                self._zarr_url_picker.value, self._roi_table_picker.value
+                self.image_url, self._roi_table_picker.value
             )
             new_choices = list(roi_table.obs_names)
             return new_choices
@@ -284,7 +1444,7 @@ class RoiLoader(Container):
             return new_choices
 
     def _get_channel_choices(self):
-        self.channel_dict = get_channel_dict(self._zarr_url_picker.value)
+        self.channel_dict = get_channel_dict(self.image_url)
         self.channel_names_dict = {}
         for channel_index in self.channel_dict.keys():
             channel_name = self.channel_dict[channel_index]["label"]
@@ -292,17 +1452,13 @@ class RoiLoader(Container):
         return list(self.channel_names_dict.keys())
 
     def _get_label_choices(self):
-        self.label_dict = get_label_dict(
-            Path(self._zarr_url_picker.value) / "labels"
-        )
+        self.label_dict = get_label_dict(join_url(self.image_url, "labels"))
         return list(self.label_dict.values())
 
     def _get_table_choices(self, type):
         # TODO: Once we have relevant metadata, allow this function to only
         # load ROI tables or only feature tables => type features or ROIs
-        self.label_dict = get_feature_dict(
-            Path(self._zarr_url_picker.value) / "tables"
-        )
+        self.label_dict = get_feature_dict(join_url(self.image_url, "tables"))
         potential_tables = list(self.label_dict.values())
         if type == "ROIs":
             return [table for table in potential_tables if "ROI" in table]
@@ -311,11 +1467,12 @@ class RoiLoader(Container):
 
     def _get_level_choices(self):
         try:
-            metadata = get_metadata(self._zarr_url_picker.value)
+            metadata = get_attrs(self.image_url)
             dataset = 0  # FIXME, hard coded in case multiple multiscale
             # datasets would be present & multiscales is a list
-            nb_levels = len(metadata.attrs["multiscales"][dataset]["datasets"])
-            return list(range(nb_levels))
+            nb_levels = len(metadata["multiscales"][dataset]["datasets"])
+            # Level 0 stays the default, auto is offered as an option
+            return list(range(nb_levels)) + [AUTO_LEVEL]
         except KeyError:
             # This happens when no valid OME-Zarr file is selected, thus no
             # metadata file is found & no levels can be set
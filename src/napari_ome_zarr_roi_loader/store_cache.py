@@ -0,0 +1,144 @@
+"""
+Cache for open zarr groups, parsed .zattrs & AnnData tables
+
+Entries are keyed on the normalized zarr url, so `Path` and `str` forms of
+the same url share an entry. Each entry stores a signature of the files it
+was read from (their modification times). When the signature changes, e.g.
+because a Fractal task wrote a new table while napari is open, the entry is
+reloaded (remote stores are assumed not to change while they are open). The
+cache is bounded by the estimated memory footprint of its
+entries & evicts the least recently used ones first.
+"""
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+def is_remote_url(zarr_url):
+    # Whether zarr_url points to a remote (fsspec) store, e.g. https:// or
+    # s3:// urls
+    zarr_url = os.fspath(zarr_url)
+    return "://" in zarr_url and not zarr_url.startswith("file://")
+
+
+def normalize_url(zarr_url):
+    # Normalizes a zarr url (str or Path) into an absolute path string
+    # without trailing separators. Remote urls are kept as they are.
+    if is_remote_url(zarr_url):
+        return os.fspath(zarr_url).rstrip("/")
+    zarr_url = os.fspath(zarr_url)
+    if zarr_url.startswith("file://"):
+        zarr_url = zarr_url.replace("file://", "", 1)
+    return os.path.abspath(zarr_url).rstrip(os.sep) or os.sep
+
+
+def get_signature(zarr_url, files):
+    # Returns the modification times of the given files relative to
+    # zarr_url. Missing files are recorded as None. Remote stores have an
+    # empty signature
+    if is_remote_url(zarr_url):
+        return ()
+    signature = []
+    for file in files:
+        try:
+            signature.append(os.stat(os.path.join(zarr_url, file)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def estimate_nbytes(value):
+    # Estimates the memory footprint of a cached value in bytes. anndata is
+    # not imported here: if it was not imported yet, value is no AnnData
+    anndata = sys.modules.get("anndata")
+    if anndata is not None and isinstance(value, anndata.AnnData):
+        X = value.X
+        nbytes = getattr(X, "nbytes", None)
+        if nbytes is None:
+            # Sparse matrices
+            nbytes = getattr(getattr(X, "data", None), "nbytes", 0)
+        nbytes += value.obs.memory_usage(deep=True).sum()
+        nbytes += value.var.memory_usage(deep=True).sum()
+        return int(nbytes)
+    if isinstance(value, dict):
+        return len(json.dumps(value, default=str))
+    return sys.getsizeof(value)
+
+
+class StoreCache:
+    """
+    Least recently used cache of values read from OME-Zarr stores
+
+    params: max_bytes: Maximum estimated memory footprint of all entries
+    """
+
+    def __init__(self, max_bytes=512 * 1024**2):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key, zarr_url, files, loader):
+        """
+        Returns the cached value for key or loads it with loader()
+
+        params: key: Hashable key. Should contain the normalized zarr url.
+                zarr_url: Normalized url the signature files are relative to
+                files: Files whose modification times invalidate the entry
+                loader: Function without arguments that loads the value
+        """
+        signature = get_signature(zarr_url, files)
+        with self._lock:
+            if key in self._entries:
+                entry_signature, value, nbytes = self._entries[key]
+                if entry_signature == signature:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return value
+                self.invalidations += 1
+                self._pop(key)
+            self.misses += 1
+
+        value = loader()
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (signature, value, nbytes)
+                self._nbytes += nbytes
+                while self._nbytes > self.max_bytes:
+                    self._pop(next(iter(self._entries)))
+                    self.evictions += 1
+        return value
+
+    def stats(self):
+        # Returns the hit/miss counters & the current size of the cache
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "nbytes": self._nbytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _pop(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+
+# Shared cache used by the loading functions in utils
+store_cache = StoreCache()
@@ -0,0 +1,241 @@
+"""
+URL-agnostic access to local & remote (fsspec) OME-Zarr stores
+
+Local paths are opened directly by zarr. Remote urls (e.g. `https://...` or
+`s3://...`) are opened through fsspec. Chunk reads of remote stores are
+fetched concurrently: zarr requests all chunks of a slice in one
+`getitems` call, which fetches them in parallel with up to
+`max_concurrent_requests` requests in flight. Remote arrays are also split
+into larger dask chunks (multiples of the zarr chunks), so a ROI slice is
+coalesced into few batched fetches instead of one task per chunk. The
+stores are defined in zarr_stores.py.
+
+If an image has consolidated metadata (`.zmetadata`, see consolidate.py),
+the metadata of the image, its label images & tables is read from that
+single file instead of from separate `.zattrs`, `.zgroup` & `.zarray`
+files. Nodes whose metadata files were modified after `.zmetadata` was
+written (e.g. a table that was written again) are read from their own
+files.
+"""
+import os
+
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.store_cache import (
+    get_signature,
+    is_remote_url,
+    normalize_url,
+    store_cache,
+)
+
+da = lazy_import("dask.array")
+zarr = lazy_import("zarr")
+
+# Maximum number of chunk requests in flight per batched remote read
+_max_concurrent_requests = 16
+
+# Target size of the dask chunks of remote arrays. Each dask chunk is read
+# with a single batched fetch of all zarr chunks it contains
+REMOTE_CHUNK_NBYTES = 64 * 1024**2
+
+CONSOLIDATED_KEY = ".zmetadata"
+# Metadata files of an image that change when labels or tables are added.
+# Consolidated metadata older than them is out of date & not used
+CONSOLIDATED_SIGNATURE_FILES = (
+    CONSOLIDATED_KEY,
+    ".zattrs",
+    "labels/.zattrs",
+    "tables/.zattrs",
+)
+# Metadata files of the nodes of an image. A node whose files are newer than
+# the consolidated metadata was rewritten since (e.g. a table written again
+# by a Fractal task) & is read without the consolidated metadata
+NODE_METADATA_FILES = (".zattrs", ".zgroup", ".zarray")
+# Metadata files of the arrays & groups of AnnData tables that are read
+# through the table's node
+TABLE_METADATA_FILES = ("X/.zarray", "obs/.zattrs", "obs/.zgroup")
+
+
+def get_max_concurrent_requests():
+    return _max_concurrent_requests
+
+
+def set_max_concurrent_requests(max_concurrent_requests):
+    # Sets the number of concurrent chunk requests for remote stores
+    global _max_concurrent_requests
+    if max_concurrent_requests < 1:
+        raise ValueError(
+            "max_concurrent_requests needs to be at least 1, "
+            f"not {max_concurrent_requests}"
+        )
+    _max_concurrent_requests = int(max_concurrent_requests)
+
+
+def get_chunk_store(zarr_url):
+    # Returns the store the chunks of arrays at zarr_url are read from:
+    # the store itself for remote urls (which counts its reads) & a
+    # CountingDirectoryStore for local paths
+    zarr_url = normalize_url(zarr_url)
+    if is_remote_url(zarr_url):
+        return get_store(zarr_url)
+    from napari_ome_zarr_roi_loader.zarr_stores import CountingDirectoryStore
+
+    return CountingDirectoryStore(zarr_url)
+
+
+def join_url(zarr_url, *parts):
+    # Joins path components to a local path or a remote url
+    if is_remote_url(zarr_url):
+        return "/".join([str(zarr_url).rstrip("/")] + [str(p) for p in parts])
+    return os.path.join(os.fspath(zarr_url), *[str(p) for p in parts])
+
+
+def get_store(zarr_url):
+    # Returns what zarr should open for zarr_url: the path for local stores
+    # & a (cached) ConcurrentFSStore for remote urls
+    zarr_url = normalize_url(zarr_url)
+    if not is_remote_url(zarr_url):
+        return zarr_url
+    from napari_ome_zarr_roi_loader.zarr_stores import ConcurrentFSStore
+
+    return store_cache.get(
+        key=("store", zarr_url),
+        zarr_url=zarr_url,
+        files=(),
+        loader=lambda: ConcurrentFSStore(zarr_url),
+    )
+
+
+def split_image_url(zarr_url, is_array=False):
+    # Splits the url of a node of an OME-Zarr image into the url of the
+    # image & the path of the node in the image, e.g. .../0/labels/nuclei
+    # into .../0 & labels/nuclei. Arrays of the image itself (e.g. .../0/1)
+    # are split at their parent.
+    zarr_url = normalize_url(zarr_url)
+    separator = "/" if is_remote_url(zarr_url) else os.sep
+    parts = zarr_url.split(separator)
+    for i in range(len(parts) - 1, 0, -1):
+        if parts[i] in ("labels", "tables"):
+            return separator.join(parts[:i]), "/".join(parts[i:])
+    if is_array:
+        return separator.join(parts[:-1]), parts[-1]
+    return zarr_url, ""
+
+
+def _open_consolidated(image_url):
+    # Opens the consolidated metadata of an image. Returns None if there is
+    # none or if it is older than the metadata it consolidates
+    if not is_remote_url(image_url):
+        mtimes = get_signature(image_url, CONSOLIDATED_SIGNATURE_FILES)
+        if mtimes[0] is None:
+            return None
+        if any(mtime is not None and mtime > mtimes[0] for mtime in mtimes):
+            return None
+    try:
+        return zarr.open_consolidated(
+            get_store(image_url),
+            metadata_key=CONSOLIDATED_KEY,
+            mode="r",
+            chunk_store=get_chunk_store(image_url),
+        )
+    except (KeyError, zarr.errors.GroupNotFoundError):
+        return None
+
+
+def get_consolidated_group(image_url):
+    # Returns the (cached) root group of an image opened with its
+    # consolidated metadata, or None if it has no (up to date) .zmetadata
+    image_url = normalize_url(image_url)
+    return store_cache.get(
+        key=("consolidated", image_url),
+        zarr_url=image_url,
+        files=CONSOLIDATED_SIGNATURE_FILES,
+        loader=lambda: _open_consolidated(image_url),
+    )
+
+
+def _is_outdated_node(image_url, path):
+    # Whether the metadata files of the node at path (or of the groups
+    # containing it) were modified after the consolidated metadata of the
+    # image was written
+    if is_remote_url(image_url):
+        return False
+    parts = path.split("/")
+    files = [CONSOLIDATED_KEY]
+    for i in range(1, len(parts) + 1):
+        node_path = "/".join(parts[:i])
+        files += [f"{node_path}/{file}" for file in NODE_METADATA_FILES]
+    if len(parts) == 2 and parts[0] == "tables":
+        files += [f"{path}/{file}" for file in TABLE_METADATA_FILES]
+    mtimes = get_signature(image_url, files)
+    return any(mtime is not None and mtime > mtimes[0] for mtime in mtimes[1:])
+
+
+def get_consolidated_node(zarr_url, is_array=False):
+    # Returns the group or array at zarr_url from the consolidated metadata
+    # of its image. Returns None if the image has no consolidated metadata
+    # or if the node was rewritten after consolidating & raises a KeyError
+    # if the node is not in the consolidated metadata
+    image_url, path = split_image_url(zarr_url, is_array=is_array)
+    group = get_consolidated_group(image_url)
+    if group is None or not path:
+        return group
+    if _is_outdated_node(image_url, path):
+        return None
+    return group[path]
+
+
+def url_exists(zarr_url):
+    # Whether there is a zarr group or array at zarr_url. For local stores,
+    # any existing folder counts
+    try:
+        if get_consolidated_node(zarr_url) is not None:
+            return True
+    except KeyError:
+        return False
+    if not is_remote_url(zarr_url):
+        return os.path.exists(zarr_url)
+    store = get_store(zarr_url)
+    return any(key in store for key in (".zattrs", ".zgroup", ".zarray"))
+
+
+def get_array(zarr_url):
+    # Returns the (cached) zarr array at zarr_url, opened read-only
+    zarr_url = normalize_url(zarr_url)
+    try:
+        array = get_consolidated_node(zarr_url, is_array=True)
+    except KeyError:
+        array = None
+    if isinstance(array, zarr.Array):
+        return array
+    return store_cache.get(
+        key=("array", zarr_url),
+        zarr_url=zarr_url,
+        files=(".zarray",),
+        loader=lambda: zarr.open_array(
+            get_store(zarr_url),
+            mode="r",
+            chunk_store=get_chunk_store(zarr_url),
+        ),
+    )
+
+
+def get_read_chunks(array):
+    # Returns the dask chunks to read a zarr array with. Local arrays are
+    # read chunk by chunk, remote arrays in blocks of multiple zarr chunks
+    # (up to REMOTE_CHUNK_NBYTES) that are fetched concurrently
+    if not isinstance(array.chunk_store, zarr.storage.FSStore):
+        return array.chunks
+    return da.core.normalize_chunks(
+        "auto",
+        shape=array.shape,
+        limit=REMOTE_CHUNK_NBYTES,
+        dtype=array.dtype,
+        previous_chunks=array.chunks,
+    )
+
+
+def lazy_array(zarr_url):
+    # Opens the zarr array at zarr_url as a dask array without reading any
+    # chunks
+    array = get_array(zarr_url)
+    return da.from_zarr(array, chunks=get_read_chunks(array))
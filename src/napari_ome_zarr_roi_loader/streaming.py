@@ -0,0 +1,282 @@
+"""
+Viewport-driven streaming of large ROIs
+
+Streamed layers are multiscale layers whose levels are TiledArrays. napari
+slices multiscale layers itself on camera & dims changes: it only requests
+the region under the current view, in the current plane, at the level
+matching the zoom. TiledArrays serve these requests from tiles (the chunks
+of the level's dask array) that are kept in a RoiCache, so panning back
+& forth or switching planes does not read the same chunks again.
+
+Tiles that are not cached yet are read in the background. Until they are
+loaded, their region is filled with the upsampled data of the coarsest
+level, which is read when the layer is created. Once the tiles are in, the
+layer is refreshed (see TileLoader.on_loaded), so the resolution is refined
+progressively as the user zooms in.
+"""
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.utils import compute_roi
+
+dask = lazy_import("dask")
+
+# Number of tile batches that are read in the background at the same time
+MAX_BACKGROUND_READS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_BACKGROUND_READS,
+                thread_name_prefix="tile-loader",
+            )
+        return _executor
+
+
+class TileLoader:
+    """
+    Reads missing tiles of the TiledArrays of a layer in the background
+
+    Requests that have not started yet are dropped when a new request comes
+    in, so only the tiles under the latest view are read.
+
+    params: cache: RoiCache the tiles are stored in
+            on_loaded: Called (from a background thread) without arguments
+                       after a batch of tiles was loaded, e.g. to refresh
+                       the layer
+    """
+
+    def __init__(self, cache, on_loaded=None):
+        self.cache = cache
+        self.on_loaded = on_loaded
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def request(self, tiles):
+        # tiles: dict of cache keys to the (lazy) dask arrays of the tiles
+        with self._lock:
+            for future in list(self._pending):
+                if future.cancel():
+                    del self._pending[future]
+            pending = set().union(*self._pending.values())
+            tiles = {
+                key: tile for key, tile in tiles.items() if key not in pending
+            }
+            if not tiles:
+                return None
+            future = _get_executor().submit(self._load, tiles)
+            self._pending[future] = set(tiles)
+        future.add_done_callback(self._done)
+        return future
+
+    def _load(self, tiles):
+        values = dask.compute(*tiles.values())
+        for key, value in zip(tiles, values):
+            self.cache.put(key, np.asarray(value), None)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.pop(future, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        if self.on_loaded is not None:
+            self.on_loaded()
+
+    def wait(self):
+        # Waits until all requested tiles are loaded (e.g. for tests)
+        while True:
+            with self._lock:
+                futures = list(self._pending)
+            if not futures:
+                return
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+
+
+class TiledArray:
+    """
+    Array-like over one pyramid level of a ROI that is read tile by tile
+
+    Indexing returns a numpy array. Tiles that are not cached are read in
+    the background by the loader & filled with the upsampled fallback (the
+    coarsest level of the ROI) in the meantime.
+
+    params: array: dask array of the ROI at this level. Its chunks are the
+                   tiles
+            key: Hashable prefix of the cache keys of the tiles
+            loader: TileLoader of the layer
+            fallback: numpy array of the coarsest level of the ROI. Without
+                      fallback, missing tiles are read before returning
+    """
+
+    def __init__(self, array, key, loader, fallback=None):
+        self._array = array
+        self._key = key
+        self.loader = loader
+        self._fallback = fallback
+        self._edges = [np.cumsum((0,) + chunks) for chunks in array.chunks]
+
+    @property
+    def shape(self):
+        return self._array.shape
+
+    @property
+    def dtype(self):
+        return self._array.dtype
+
+    @property
+    def ndim(self):
+        return self._array.ndim
+
+    @property
+    def size(self):
+        return self._array.size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self._read(tuple(slice(0, n) for n in self.shape), True)
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        region, squeeze = _normalize_key(key, self.shape)
+        if region is None:
+            # Fancy indexing or steps: not served from tiles
+            return compute_roi(self._array[key])
+        data = self._read(region, blocking=self._fallback is None)
+        return data[squeeze]
+
+    def _tiles(self, region):
+        # Yields the block indices of all tiles intersecting the region
+        ranges = []
+        for (start, stop), edges in zip(region, self._edges):
+            first = np.searchsorted(edges, start, side="right") - 1
+            last = np.searchsorted(edges, max(stop, start + 1), side="left")
+            ranges.append(range(first, last))
+        return itertools.product(*ranges)
+
+    def _read(self, region, blocking):
+        region = [(s.start, s.stop) for s in region]
+        out = np.zeros([stop - start for start, stop in region], self.dtype)
+        if out.size == 0:
+            return out
+        missing = {}
+        for block in self._tiles(region):
+            key = self._key + (block,)
+            item = self.loader.cache.get(key)
+            if item is None:
+                missing[block] = key
+                continue
+            self._copy_tile(out, region, block, item[0])
+
+        if missing and blocking:
+            tiles = dask.compute(
+                *[self._array.blocks[block] for block in missing]
+            )
+            for (block, key), tile in zip(missing.items(), tiles):
+                tile = np.asarray(tile)
+                self.loader.cache.put(key, tile, None)
+                self._copy_tile(out, region, block, tile)
+        elif missing:
+            for block in missing:
+                self._copy_fallback(out, region, block)
+            self.loader.request(
+                {
+                    key: self._array.blocks[block]
+                    for block, key in missing.items()
+                }
+            )
+        return out
+
+    def _block_region(self, region, block):
+        # Intersection of a tile with the region: as slices into the tile
+        # & into the output array
+        tile_slices, out_slices = [], []
+        for (start, stop), edges, index in zip(region, self._edges, block):
+            lo = max(start, edges[index])
+            hi = min(stop, edges[index + 1])
+            tile_slices.append(slice(lo - edges[index], hi - edges[index]))
+            out_slices.append(slice(lo - start, hi - start))
+        return tuple(tile_slices), tuple(out_slices)
+
+    def _copy_tile(self, out, region, block, tile):
+        tile_slices, out_slices = self._block_region(region, block)
+        out[out_slices] = tile[tile_slices]
+
+    def _copy_fallback(self, out, region, block):
+        # Fills the region of a missing tile with the nearest voxels of the
+        # coarsest level
+        _, out_slices = self._block_region(region, block)
+        indices = []
+        for (start, _), out_slice, size, coarse_size in zip(
+            region, out_slices, self.shape, self._fallback.shape
+        ):
+            fine = np.arange(out_slice.start, out_slice.stop) + start
+            indices.append(
+                np.minimum(fine * coarse_size // size, coarse_size - 1)
+            )
+        out[out_slices] = self._fallback[np.ix_(*indices)]
+
+
+def _normalize_key(key, shape):
+    # Converts an index into one (start, stop) slice per dimension & the
+    # index that drops the dimensions indexed by integers. Returns None as
+    # region for keys that are not served from tiles (steps, arrays, ...)
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = key.index(Ellipsis)
+        after = i + 1
+        expanded = (slice(None),) * (len(shape) - len(key) + 1)
+        key = key[:i] + expanded + key[after:]
+    key = key + (slice(None),) * (len(shape) - len(key))
+    region, squeeze = [], []
+    for k, size in zip(key, shape):
+        if isinstance(k, (int, np.integer)):
+            k = int(k) + size if k < 0 else int(k)
+            region.append(slice(k, k + 1))
+            squeeze.append(0)
+        elif isinstance(k, slice):
+            start, stop, step = k.indices(size)
+            if step != 1:
+                return None, None
+            region.append(slice(start, max(start, stop)))
+            squeeze.append(slice(None))
+        else:
+            return None, None
+    return region, tuple(squeeze)
+
+
+def stream_pyramid(pyramid, key, cache, on_loaded=None):
+    """
+    Wraps the levels of a lazy ROI pyramid into TiledArrays
+
+    The coarsest level is read right away & serves as the fallback of the
+    finer levels until their tiles are loaded.
+
+    params: pyramid: list of dask arrays (from high to low resolution), e.g.
+                     from load_label_roi_pyramid
+            key: Hashable that identifies the ROI & channel or label image
+            cache: RoiCache the tiles are kept in
+            on_loaded: see TileLoader
+    returns a list of TiledArrays (& the coarsest level as numpy array)
+    """
+    loader = TileLoader(cache, on_loaded=on_loaded)
+    coarsest = compute_roi(pyramid[-1])
+    levels = [
+        TiledArray(level, key + (i,), loader, fallback=coarsest)
+        for i, level in enumerate(pyramid[:-1])
+    ]
+    return levels + [coarsest]
@@ -0,0 +1,258 @@
+"""
+Generator for synthetic OME-Zarr images, e.g. for benchmarks & demos
+
+Writes a Fractal-style OME-Zarr image with random intensity channels, a
+pyramid, label images with a regular grid of square objects, a FOV ROI
+table & a feature table. All arrays are generated & written chunk by chunk
+with dask, so large images can be generated without holding them in
+memory.
+"""
+import math
+import os
+
+import anndata as ad
+import dask.array as da
+import numpy as np
+import pandas as pd
+import zarr
+
+from napari_ome_zarr_roi_loader.object_index import ROI_COLUMNS
+
+CHANNEL_COLORS = ["00FFFF", "00FF00", "FF00FF", "FFFF00", "FF0000", "0000FF"]
+
+
+def _multiscales(nb_levels, pxl_sizes_zyx, channel_axis, coarsening=2):
+    axes = [
+        {"name": "z", "type": "space", "unit": "micrometer"},
+        {"name": "y", "type": "space", "unit": "micrometer"},
+        {"name": "x", "type": "space", "unit": "micrometer"},
+    ]
+    if channel_axis:
+        axes = [{"name": "c", "type": "channel"}] + axes
+    datasets = []
+    for level in range(nb_levels):
+        scale = [
+            pxl_sizes_zyx[0],
+            pxl_sizes_zyx[1] * coarsening**level,
+            pxl_sizes_zyx[2] * coarsening**level,
+        ]
+        if channel_axis:
+            scale = [1.0] + scale
+        datasets.append(
+            {
+                "path": str(level),
+                "coordinateTransformations": [
+                    {"type": "scale", "scale": scale}
+                ],
+            }
+        )
+    return [{"version": "0.4", "axes": axes, "datasets": datasets}]
+
+
+def _object_grid_block(block, object_size, spacing, nb_columns, block_info):
+    # Labels of a block of the object grid: object (i, j) covers the
+    # first object_size pixels of each spacing x spacing cell
+    (_, _), (s_y, e_y), (s_x, e_x) = block_info[None]["array-location"]
+    y = np.arange(s_y, e_y)[:, None]
+    x = np.arange(s_x, e_x)[None, :]
+    inside = (y % spacing < object_size) & (x % spacing < object_size)
+    labels = np.where(
+        inside, (y // spacing) * nb_columns + x // spacing + 1, 0
+    )
+    return np.broadcast_to(labels, block.shape).astype(block.dtype)
+
+
+def make_object_grid(shape_zyx, chunks_zyx, object_size=16, spacing=24):
+    """
+    Lazy label image with a regular grid of square objects
+
+    Objects are object_size pixels wide & spaced by `spacing` pixels in y
+    & x. They span all z planes. Label IDs increase row by row from 1.
+    returns a dask array & the number of objects
+    """
+    nb_rows = math.ceil(shape_zyx[1] / spacing)
+    nb_columns = math.ceil(shape_zyx[2] / spacing)
+    template = da.zeros(shape_zyx, chunks=chunks_zyx, dtype=np.uint32)
+    labels = template.map_blocks(
+        _object_grid_block,
+        object_size=object_size,
+        spacing=spacing,
+        nb_columns=nb_columns,
+        dtype=np.uint32,
+    )
+    return labels, nb_rows * nb_columns
+
+
+def make_roi_table(nb_rois, shape_zyx, pxl_sizes_zyx):
+    # FOV ROI table that tiles the image into a grid of nb_rois FOVs
+    nb_columns = math.ceil(math.sqrt(nb_rois))
+    nb_rows = math.ceil(nb_rois / nb_columns)
+    len_z = shape_zyx[0] * pxl_sizes_zyx[0]
+    len_y = shape_zyx[1] // nb_rows * pxl_sizes_zyx[1]
+    len_x = shape_zyx[2] // nb_columns * pxl_sizes_zyx[2]
+    roi_x = np.array(
+        [
+            [
+                (i % nb_columns) * len_x,
+                (i // nb_columns) * len_y,
+                0.0,
+                len_x,
+                len_y,
+                len_z,
+            ]
+            for i in range(nb_rois)
+        ],
+        dtype=np.float32,
+    )
+    return ad.AnnData(
+        X=roi_x,
+        obs=pd.DataFrame(index=[f"FOV_{i + 1}" for i in range(nb_rois)]),
+        var=pd.DataFrame(index=ROI_COLUMNS),
+    )
+
+
+def make_feature_table(nb_rows, nb_columns, seed=0):
+    # Feature table with random features for the labels 1 to nb_rows
+    rng = np.random.default_rng(seed)
+    label_ids = np.arange(1, nb_rows + 1)
+    return ad.AnnData(
+        X=rng.random((nb_rows, nb_columns), dtype=np.float32),
+        obs=pd.DataFrame(
+            {"label": label_ids.astype(str)},
+            index=[str(i) for i in range(nb_rows)],
+        ),
+        var=pd.DataFrame(index=[f"feature_{i}" for i in range(nb_columns)]),
+    )
+
+
+def _write_pyramid(group, data, nb_levels, chunks, coarsening=2):
+    # Writes data & its downsampled (by striding) levels to the group
+    for level in range(nb_levels):
+        step = coarsening**level
+        level_data = data[..., ::step, ::step].rechunk(chunks)
+        level_data.to_zarr(
+            group.store,
+            component=f"{group.path}/{level}".lstrip("/"),
+            overwrite=True,
+        )
+
+
+def _write_table(zarr_url, tables_group, name, table, table_type, attrs=None):
+    table.write_zarr(os.path.join(zarr_url, "tables", name))
+    tables_group[name].attrs.update({"type": table_type, **(attrs or {})})
+    tables_group.attrs["tables"] = tables_group.attrs.get("tables", []) + [
+        name
+    ]
+
+
+def make_ome_zarr_image(
+    zarr_url,
+    shape_zyx=(1, 1080, 1280),
+    channels=("DAPI", "GFP"),
+    nb_levels=3,
+    chunks_zyx=(1, 540, 640),
+    pxl_sizes_zyx=(1.0, 0.1625, 0.1625),
+    label_names=("nuclei",),
+    object_size=16,
+    object_spacing=24,
+    nb_rois=4,
+    nb_features=None,
+    nb_feature_columns=10,
+    dtype=np.uint16,
+    seed=0,
+):
+    """
+    Writes a synthetic OME-Zarr image
+
+    params: zarr_url: Local path the image is written to (overwritten)
+            shape_zyx: Shape of the highest resolution level
+            channels: Names of the intensity channels
+            nb_levels: Number of pyramid levels (downsampled by 2 in yx)
+            chunks_zyx: Chunks of each level (per channel)
+            label_names: Names of the label images. All contain the same
+                         grid of objects (see make_object_grid)
+            nb_rois: Number of rows of the FOV_ROI_table. The FOVs tile
+                     the image in a grid
+            nb_features: Number of rows of the `<label>_features` table of
+                         each label image. Defaults to the number of objects
+            nb_feature_columns: Number of columns of the feature tables
+    returns a dict describing the image (zarr_url, shape_zyx, nb_objects,
+    roi_names, pxl_sizes_zyx)
+    """
+    zarr_url = str(zarr_url)
+    image_group = zarr.open_group(zarr_url, mode="w")
+    image_group.attrs["multiscales"] = _multiscales(
+        nb_levels, pxl_sizes_zyx, channel_axis=True
+    )
+    max_value = np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else 1
+    image_group.attrs["omero"] = {
+        "channels": [
+            {
+                "label": channel,
+                "wavelength_id": f"A01_C{i + 1:02d}",
+                "color": CHANNEL_COLORS[i % len(CHANNEL_COLORS)],
+                "window": {
+                    "min": 0,
+                    "max": max_value,
+                    "start": 0,
+                    "end": 1000,
+                },
+            }
+            for i, channel in enumerate(channels)
+        ]
+    }
+
+    rng = da.random.default_rng(seed)
+    img = rng.integers(
+        0,
+        1000,
+        size=(len(channels),) + tuple(shape_zyx),
+        chunks=(1,) + tuple(chunks_zyx),
+        dtype=dtype,
+    )
+    _write_pyramid(image_group, img, nb_levels, (1,) + tuple(chunks_zyx))
+
+    labels, nb_objects = make_object_grid(
+        shape_zyx, chunks_zyx, object_size, object_spacing
+    )
+    labels_group = image_group.create_group("labels")
+    labels_group.attrs["labels"] = list(label_names)
+    for label_name in label_names:
+        label_group = labels_group.create_group(label_name)
+        label_group.attrs["multiscales"] = _multiscales(
+            nb_levels, pxl_sizes_zyx, channel_axis=False
+        )
+        label_group.attrs["image-label"] = {
+            "version": "0.4",
+            "source": {"image": "../../"},
+        }
+        _write_pyramid(label_group, labels, nb_levels, chunks_zyx)
+
+    tables_group = image_group.create_group("tables")
+    roi_table = make_roi_table(nb_rois, shape_zyx, pxl_sizes_zyx)
+    _write_table(
+        zarr_url, tables_group, "FOV_ROI_table", roi_table, "roi_table"
+    )
+    for label_name in label_names:
+        feature_table = make_feature_table(
+            nb_features or nb_objects, nb_feature_columns, seed=seed
+        )
+        _write_table(
+            zarr_url,
+            tables_group,
+            f"{label_name}_features",
+            feature_table,
+            "feature_table",
+            {
+                "region": {"path": f"../labels/{label_name}"},
+                "instance_key": "label",
+            },
+        )
+
+    return {
+        "zarr_url": zarr_url,
+        "shape_zyx": tuple(shape_zyx),
+        "nb_objects": nb_objects,
+        "roi_names": list(roi_table.obs_names),
+        "pxl_sizes_zyx": list(pxl_sizes_zyx),
+    }
@@ -1,17 +1,422 @@
-from functools import lru_cache
-from pathlib import Path
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable, List
 
-import anndata as ad
-import dask.array as da
-
 # import matplotlib.pyplot as plt
 import numpy as np
-import zarr
+
+from napari_ome_zarr_roi_loader.imports import lazy_import
+from napari_ome_zarr_roi_loader.instrumentation import stage
+from napari_ome_zarr_roi_loader.store_cache import (
+    is_remote_url,
+    normalize_url,
+    store_cache,
+)
+from napari_ome_zarr_roi_loader.stores import (
+    get_array,
+    get_consolidated_node,
+    get_store,
+    join_url,
+    lazy_array,
+    url_exists,
+)
+
+# Heavy dependencies are imported on first use, see imports.py
+ad = lazy_import("anndata")
+dask = lazy_import("dask")
+da = lazy_import("dask.array")
+pd = lazy_import("pandas")
+zarr = lazy_import("zarr")
+
+
+def read_elem(elem):
+    # Reads an element (e.g. a dataframe or an array) of an AnnData store
+    try:
+        from anndata.io import read_elem as _read_elem
+    except ImportError:
+        # anndata < 0.11
+        from anndata.experimental import read_elem as _read_elem
+    return _read_elem(elem)
+
+
+# Files whose modification invalidates cached metadata & tables
+GROUP_SIGNATURE_FILES = (".zattrs", ".zgroup")
+TABLE_SIGNATURE_FILES = (".zattrs", ".zgroup", "X/.zarray", "obs/.zattrs")
+
+
+# Number of threads read_roi decodes the chunks of a ROI with
+READ_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Z projections ROIs can be loaded with, see project_roi
+PROJECTIONS = ("max", "mean", "sum")
+# Compact dtypes intensity ROIs can be loaded in for display, see
+# to_display_dtype
+DISPLAY_DTYPES = ("uint8", "float16")
+
+
+class LoadCancelled(Exception):
+    """Raised when a ROI load is cancelled before all chunks were read"""
+
+
+class _CancelCallback:
+    """
+    Dask callback that stops a compute once the cancel_event is set
+
+    Chunk reads that are already running finish, but no further chunk reads
+    are started. _callback is the (start, start_state, pretask, posttask,
+    finish) tuple dask accepts as a callback, which avoids subclassing
+    dask.callbacks.Callback at import time.
+    """
+
+    def __init__(self, cancel_event):
+        self._cancel_event = cancel_event
+        self._callback = (None, None, self._pretask, None, None)
+
+    def _pretask(self, key, dask, state):
+        if self._cancel_event.is_set():
+            raise LoadCancelled("The ROI load was cancelled")
+
+
+def compute_roi(roi, cancel_event=None):
+    # Computes a lazy ROI into a numpy array
+    # params: roi: dask array of the ROI
+    # params: cancel_event: Optional threading.Event. Once it is set, the
+    #         compute is aborted with a LoadCancelled exception
+    with stage("read_chunks"):
+        return _compute(roi, cancel_event=cancel_event)[0]
+
+
+def store_rois(sources, targets, cancel_event=None):
+    # Reads lazy ROIs straight into preallocated arrays, e.g. into slices
+    # of a larger buffer, without intermediate copies. The chunks of all
+    # ROIs are read in parallel in a single pass
+    # params: sources: list of dask arrays of the ROIs
+    # params: targets: list of writable numpy arrays (or views) with the
+    #         shapes of the sources
+    # params: cancel_event: see compute_roi
+    kwargs = {}
+    if cancel_event is not None:
+        if cancel_event.is_set():
+            raise LoadCancelled("The ROI load was cancelled")
+        kwargs["callbacks"] = [_CancelCallback(cancel_event)._callback]
+    with stage("read_chunks"):
+        da.store(sources, targets, lock=False, **kwargs)
+
+
+_read_executor = None
+_read_executor_lock = threading.Lock()
+
+
+def _get_read_executor():
+    global _read_executor
+    with _read_executor_lock:
+        if _read_executor is None:
+            _read_executor = ThreadPoolExecutor(
+                max_workers=READ_WORKERS, thread_name_prefix="roi-reader"
+            )
+        return _read_executor
+
+
+def _selection_shape(selection, shape):
+    # Shape of the result of a selection of an array (ints, slices & at
+    # most one list of indices)
+    out_shape = []
+    for key, size in zip(selection, shape):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(size)
+            if step != 1:
+                raise ValueError("Only selections without steps can be read")
+            out_shape.append(max(stop - start, 0))
+        elif not isinstance(key, (int, np.integer)):
+            out_shape.append(len(key))
+    return tuple(out_shape)
+
+
+def _chunk_groups(key, size, chunk_size, split):
+    # Splits the key of one axis of a selection into groups of indices in
+    # the same chunks. Returns (key, out_key) pairs: the key of the group &
+    # its position on the axis of the output array
+    if isinstance(key, slice):
+        start, stop, _ = key.indices(size)
+        bounds = [start]
+        if split:
+            bounds += range(
+                (start // chunk_size + 1) * chunk_size, stop, chunk_size
+            )
+        bounds.append(stop)
+        return [
+            (slice(b_start, b_stop), slice(b_start - start, b_stop - start))
+            for b_start, b_stop in zip(bounds[:-1], bounds[1:])
+        ]
+    chunks = np.asarray(key) // chunk_size if split else np.zeros(len(key))
+    groups = []
+    for chunk in dict.fromkeys(chunks.tolist()):
+        positions = np.flatnonzero(chunks == chunk)
+        groups.append(([key[i] for i in positions], positions))
+    return groups
+
+
+def _allocate(shape, dtype, pool=None):
+    # Returns an uninitialized array, from the BufferPool if one is given
+    if pool is None:
+        return np.empty(shape, dtype=dtype)
+    return pool.get(shape, dtype)
+
+
+def read_roi(array_url, selection, out=None, pool=None, cancel_event=None):
+    """
+    Reads a selection of a zarr array straight into an output array
+
+    No dask graph is built: zarr decodes the chunks directly into `out`,
+    e.g. a reused buffer (see buffers.BufferPool), a shared memory array or
+    a slice of a larger array. The selection is split into slabs of whole
+    chunks along its list of indices & its first sliced axis, which are
+    read in parallel.
+
+    params: array_url: Url of the zarr array
+            selection: Tuple of ints, slices & at most one list of indices
+                       (e.g. channels), e.g. from get_intensity_roi_selection
+            out: Optional writable array with the shape of the selection
+            pool: Optional buffers.BufferPool that out is taken from if it
+                  isn't given. Release it to the pool once it's not needed
+                  anymore
+            cancel_event: Optional threading.Event. Once it is set, slabs
+                          that did not start yet are skipped & a
+                          LoadCancelled exception is raised
+    returns out (or a new array if out is None)
+    """
+    with stage("open_array"):
+        array = get_array(array_url)
+    selection = tuple(selection) + (slice(None),) * (
+        array.ndim - len(selection)
+    )
+    if (
+        sum(isinstance(key, (list, tuple, np.ndarray)) for key in selection)
+        > 1
+    ):
+        raise ValueError("Only one list of indices can be read")
+    out_shape = _selection_shape(selection, array.shape)
+    if out is None:
+        out = _allocate(out_shape, array.dtype, pool)
+    elif out.shape != out_shape:
+        raise ValueError(
+            f"The output array has the shape {out.shape}, the selection has "
+            f"the shape {out_shape}"
+        )
+    if out.size == 0:
+        return out
+
+    # Slabs of whole chunks along the list of indices (e.g. the channels)
+    # & the first sliced axis, so every chunk is decoded once, even if it
+    # holds multiple of the selected indices. Remote stores fetch all chunks
+    # of a read concurrently already (up to max_concurrent_requests), so
+    # they are read in a single slab
+    split = not is_remote_url(array_url)
+    axes = [
+        axis
+        for axis, key in enumerate(selection)
+        if not isinstance(key, (int, np.integer))
+    ]
+    list_axes = [a for a in axes if not isinstance(selection[a], slice)]
+    slice_axes = [a for a in axes if isinstance(selection[a], slice)]
+    split_axes = list_axes + slice_axes[:1]
+    groups = [
+        _chunk_groups(
+            selection[axis], array.shape[axis], array.chunks[axis], split
+        )
+        for axis in split_axes
+    ]
+    slabs = list(itertools.product(*groups))
+
+    def read_slab(slab_groups):
+        if cancel_event is not None and cancel_event.is_set():
+            raise LoadCancelled("The ROI load was cancelled")
+        slab = list(selection)
+        out_slab = [slice(None)] * out.ndim
+        for axis, (key, out_key) in zip(split_axes, slab_groups):
+            slab[axis] = key
+            out_slab[axes.index(axis)] = out_key
+        if not list_axes:
+            array.get_basic_selection(tuple(slab), out=out[tuple(out_slab)])
+            return
+        positions = out_slab[axes.index(list_axes[0])]
+        if np.all(np.diff(positions) == 1):
+            # Consecutive positions: the chunks are decoded into a view
+            out_slab[axes.index(list_axes[0])] = slice(
+                positions[0], positions[-1] + 1
+            )
+            array.get_orthogonal_selection(
+                tuple(slab), out=out[tuple(out_slab)]
+            )
+        else:
+            out[tuple(out_slab)] = array.get_orthogonal_selection(tuple(slab))
+
+    if cancel_event is not None and cancel_event.is_set():
+        raise LoadCancelled("The ROI load was cancelled")
+    with stage("read_chunks"):
+        # Consumes the results to raise the errors of the reads
+        list(_get_read_executor().map(read_slab, slabs))
+    return out
+
+
+def _compute(*collections, cancel_event=None):
+    # Computes dask collections in a single pass, optionally cancellable
+    if cancel_event is None:
+        return dask.compute(*collections)
+    if cancel_event.is_set():
+        raise LoadCancelled("The ROI load was cancelled")
+    return dask.compute(
+        *collections, callbacks=[_CancelCallback(cancel_event)._callback]
+    )
+
+
+def project_roi(roi, projection=None, z_range=None):
+    # Lazily projects a ROI along Z (its third last axis). dask reduces each
+    # chunk as soon as it is read & merges the partial projections in a
+    # tree, so only 2D partial results are held in memory, never the ZYX
+    # ROI.
+    # params: roi: dask array of a ZYX or CZYX ROI
+    # params: projection: One of PROJECTIONS or None (no projection)
+    # params: z_range: Optional (start, stop) range of the Z planes of the
+    #         ROI that are projected (default: all planes)
+    # returns the projection with a Z axis of length 1, so the scale of the
+    # ROI still applies
+    if projection is None:
+        return roi
+    if projection not in PROJECTIONS:
+        raise ValueError(
+            f"Unknown projection {projection!r}, must be one of {PROJECTIONS}"
+        )
+    if z_range is not None:
+        start, stop, _ = slice(*z_range).indices(roi.shape[-3])
+        if stop <= start:
+            raise ValueError(
+                f"The Z range {z_range} does not contain any plane of the "
+                f"ROI (which has {roi.shape[-3]} planes)"
+            )
+        roi = roi[..., start:stop, :, :]
+    if projection == "mean":
+        return roi.mean(axis=-3, keepdims=True, dtype=np.float32)
+    return getattr(roi, projection)(axis=-3, keepdims=True)
+
+
+def _rescale_block(block, start, end, dtype):
+    # Maps the window [start, end] of a block to [0, 1] (clipping values
+    # outside of it) & stores the result as uint8 (0 to 255) or float16
+    scaled = (block.astype(np.float32) - start) / max(end - start, 1e-12)
+    np.clip(scaled, 0.0, 1.0, out=scaled)
+    if dtype == np.uint8:
+        return np.rint(scaled * 255).astype(np.uint8)
+    return scaled.astype(dtype)
+
+
+def to_display_dtype(roi, window, display_dtype=None):
+    # Lazily rescales the display window of an intensity ROI to a compact
+    # dtype. Each chunk is rescaled as soon as it is read, so the raw data
+    # of the ROI is never held in memory.
+    # params: roi: dask array of a single channel ROI
+    # params: window: (start, end) intensities mapped to 0 & the maximum
+    #         (255 for uint8, 1 for float16), see get_channel_window
+    # params: display_dtype: One of DISPLAY_DTYPES or None (raw data)
+    if display_dtype is None:
+        return roi
+    if display_dtype not in DISPLAY_DTYPES:
+        raise ValueError(
+            f"Unknown display dtype {display_dtype!r}, must be one of "
+            f"{DISPLAY_DTYPES}"
+        )
+    dtype = np.dtype(display_dtype)
+    start, end = window
+    return roi.map_blocks(
+        _rescale_block, float(start), float(end), dtype, dtype=dtype
+    )
+
+
+def get_projection_window(window, roi, projection=None, z_range=None):
+    # Display window of the projection of a ROI: sum projections add up the
+    # intensities of the projected Z planes, so their window is scaled by
+    # the number of planes. Other projections keep the intensity range
+    # params: window: (start, end) window of the ROI, see get_channel_window
+    # params: roi: ROI before the projection (see project_roi)
+    if projection != "sum":
+        return window
+    nb_planes = roi.shape[-3]
+    if z_range is not None:
+        nb_planes = len(range(*slice(*z_range).indices(nb_planes)))
+    return window[0] * nb_planes, window[1] * nb_planes
+
+
+def get_display_contrast_limits(display_dtype):
+    # Contrast limits of ROIs loaded with to_display_dtype: the window
+    # spans the whole value range
+    if np.dtype(display_dtype) == np.uint8:
+        return (0, 255)
+    return (0.0, 1.0)
+
+
+def label_projection(projection):
+    # Label images are max projected whenever the channels are projected,
+    # mean or sum projections would mix the label values
+    return None if projection is None else "max"
+
+
+def _count_labels_block(block):
+    # Counts the voxels of each label in a block. Uses a bincount when the
+    # label values are small compared to the block size & falls back to
+    # np.unique otherwise (e.g. for sparse, high label IDs)
+    # The background is not counted, label images are mostly background
+    block = block[block != 0]
+    if block.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    max_label = int(block.max())
+    if max_label <= 4 * block.size:
+        if not np.can_cast(block.dtype, np.intp):
+            # e.g. uint64 labels
+            block = block.astype(np.intp)
+        counts = np.bincount(block)
+        label_ids = np.flatnonzero(counts)
+        return label_ids, counts[label_ids]
+    label_ids, counts = np.unique(block, return_counts=True)
+    return label_ids.astype(np.int64), counts
+
+
+def count_labels(label_roi, cancel_event=None):
+    # Counts the voxels of every label present in a label ROI. Each chunk
+    # is counted in parallel & the per-chunk counts are merged afterwards,
+    # so the full volume is never sorted.
+    # params: label_roi: Label image as a numpy or dask array
+    # returns the present label IDs (sorted, without the background 0) &
+    # their voxel counts as numpy arrays
+    if not isinstance(label_roi, da.Array):
+        # Only split in-memory arrays along the first axis, so the blocks
+        # are contiguous views that don't need to be copied
+        label_roi = np.asarray(label_roi)
+        label_roi = da.from_array(
+            label_roi,
+            chunks=("auto",) + label_roi.shape[1:],
+            # Skips hashing the whole array for the dask key
+            name=False,
+        )
+    block_counts = _compute(
+        *[
+            dask.delayed(_count_labels_block)(block)
+            for block in label_roi.to_delayed().ravel()
+        ],
+        cancel_event=cancel_event,
+    )
+    all_ids = np.concatenate([ids for ids, _ in block_counts])
+    all_counts = np.concatenate([counts for _, counts in block_counts])
+    label_ids, inverse = np.unique(all_ids, return_inverse=True)
+    counts = np.zeros(len(label_ids), dtype=np.int64)
+    np.add.at(counts, inverse, all_counts)
+    foreground = label_ids != 0
+    return label_ids[foreground], counts[foreground]
 
 
 def convert_ROI_table_to_indices(
-    ROI: ad.AnnData,
+    ROI: "ad.AnnData",
     pxl_sizes_zyx: Iterable[float] = None,
     cols_xyz_pos: Iterable[str] = [
         "x_micrometer",
@@ -33,67 +438,176 @@ def convert_ROI_table_to_indices(
     # Set pyramid-level pixel sizes
     pxl_size_z, pxl_size_y, pxl_size_x = pxl_sizes_zyx
 
-    x_pos, y_pos, z_pos = cols_xyz_pos[:]
-    x_len, y_len, z_len = cols_xyz_len[:]
+    # Extract all position & length columns at once as (n_rois, 3) arrays,
+    # instead of building an AnnData view per ROI & column
+    pos_xyz = ROI[:, list(cols_xyz_pos)].X
+    len_xyz = ROI[:, list(cols_xyz_len)].X
 
     if reset_origin:
-        origin_x = min(ROI[:, x_pos].X[:, 0])
-        origin_y = min(ROI[:, y_pos].X[:, 0])
-        origin_z = min(ROI[:, z_pos].X[:, 0])
-    else:
-        origin_x = 0.0
-        origin_y = 0.0
-        origin_z = 0.0
-
-    # list_indices = []
-    indices_dict = {}
-    for FOV in ROI.obs_names:
-
-        # Extract data from anndata table
-        x_micrometer = ROI[FOV, x_pos].X[0, 0] - origin_x
-        y_micrometer = ROI[FOV, y_pos].X[0, 0] - origin_y
-        z_micrometer = ROI[FOV, z_pos].X[0, 0] - origin_z
-        len_x_micrometer = ROI[FOV, x_len].X[0, 0]
-        len_y_micrometer = ROI[FOV, y_len].X[0, 0]
-        len_z_micrometer = ROI[FOV, z_len].X[0, 0]
-
-        # Identify indices along the three dimensions
-        start_x = x_micrometer / pxl_size_x
-        end_x = (x_micrometer + len_x_micrometer) / pxl_size_x
-        start_y = y_micrometer / pxl_size_y
-        end_y = (y_micrometer + len_y_micrometer) / pxl_size_y
-        start_z = z_micrometer / pxl_size_z
-        end_z = (z_micrometer + len_z_micrometer) / pxl_size_z
-        indices = [start_z, end_z, start_y, end_y, start_x, end_x]
-
-        # Round indices to lower integer
-        indices = list(map(round, indices))
-
-        # Append ROI indices to to list
-        # ist_indices.append(indices[:])
-        indices_dict[FOV] = indices[:]
+        pos_xyz = pos_xyz - pos_xyz.min(axis=0)
+
+    # Identify indices along the three dimensions. Pixel sizes are cast to
+    # the table dtype to keep the same rounding as a per-ROI computation
+    pxl_sizes_xyz = np.array(
+        [pxl_size_x, pxl_size_y, pxl_size_z], dtype=pos_xyz.dtype
+    )
+    start_xyz = pos_xyz / pxl_sizes_xyz
+    end_xyz = (pos_xyz + len_xyz) / pxl_sizes_xyz
+
+    # Order as [start_z, end_z, start_y, end_y, start_x, end_x] per ROI
+    indices = np.empty((len(ROI.obs_names), 6))
+    indices[:, 0::2] = start_xyz[:, ::-1]
+    indices[:, 1::2] = end_xyz[:, ::-1]
+
+    # Round indices to lower integer
+    indices = np.round(indices).astype(int)
+
+    indices_dict = dict(zip(ROI.obs_names, indices.tolist()))
 
     return indices_dict
 
 
-@lru_cache(maxsize=16)
+def get_roi_indices(
+    zarr_url,
+    roi_table,
+    pxl_sizes_zyx,
+    reset_origin=False,
+):
+    """
+    Cached conversion of a whole ROI table into pixel indices
+
+    The conversion is memoized per (zarr_url, roi_table, pxl_sizes_zyx,
+    reset_origin), so loading multiple channels or labels of the same ROI
+    table only converts it once & single ROIs are looked up in the
+    returned dict. The cached indices are invalidated together with the
+    ROI table.
+
+    params: zarr_url: Path to the OME-Zarr image
+            roi_table: Name of the ROI table in the `tables` folder
+            pxl_sizes_zyx: tuple of pixel sizes (needs to be hashable)
+            reset_origin: Whether the ROI origin is reset to the
+                          minimum of the table
+    """
+    zarr_url = normalize_url(zarr_url)
+
+    def convert_table():
+        with stage("read_table", roi_table):
+            table = read_table(zarr_url, roi_table)
+        with stage("convert_indices"):
+            return convert_ROI_table_to_indices(
+                table,
+                pxl_sizes_zyx=pxl_sizes_zyx,
+                reset_origin=reset_origin,
+            )
+
+    with stage("roi_indices"):
+        return store_cache.get(
+            key=(
+                "roi_indices",
+                zarr_url,
+                roi_table,
+                pxl_sizes_zyx,
+                reset_origin,
+            ),
+            zarr_url=join_url(zarr_url, "tables", roi_table),
+            files=TABLE_SIGNATURE_FILES,
+            loader=convert_table,
+        )
+
+
+def add_margin(indices, margin, pxl_sizes_zyx):
+    # Grows ROI indices by a margin (in micrometers) on each side. The start
+    # indices are clipped at 0, end indices beyond the image are clipped
+    # when slicing.
+    # params: indices: [start_z, end_z, start_y, end_y, start_x, end_x]
+    # params: pxl_sizes_zyx: Pixel sizes of the level the indices refer to
+    if not margin:
+        return indices
+    margins_zyx = [
+        int(np.ceil(margin / pxl_size)) for pxl_size in pxl_sizes_zyx
+    ]
+    grown = []
+    for i, margin_pxl in enumerate(margins_zyx):
+        grown.append(max(indices[2 * i] - margin_pxl, 0))
+        grown.append(indices[2 * i + 1] + margin_pxl)
+    return grown
+
+
 def get_metadata(zarr_url):
-    with zarr.open(zarr_url) as metadata:
-        return metadata
+    # Returns the (cached) zarr group at zarr_url, opened read-only. Uses
+    # the consolidated metadata of the image if there is one
+    zarr_url = normalize_url(zarr_url)
+    try:
+        group = get_consolidated_node(zarr_url)
+    except KeyError:
+        raise zarr.errors.GroupNotFoundError(zarr_url) from None
+    if group is not None:
+        return group
+    return store_cache.get(
+        key=("group", zarr_url),
+        zarr_url=zarr_url,
+        files=GROUP_SIGNATURE_FILES,
+        loader=lambda: zarr.open_group(get_store(zarr_url), mode="r"),
+    )
+
+
+def get_attrs(zarr_url):
+    # Returns the (cached) parsed .zattrs of the zarr group at zarr_url.
+    # Returns an empty dict if there is no zarr group at zarr_url
+    zarr_url = normalize_url(zarr_url)
+    try:
+        group = get_consolidated_node(zarr_url)
+    except KeyError:
+        return {}
+    if group is not None:
+        # Consolidated attributes are already in memory
+        return group.attrs.asdict()
+
+    def load_attrs():
+        try:
+            return get_metadata(zarr_url).attrs.asdict()
+        except (
+            zarr.errors.GroupNotFoundError,
+            zarr.errors.PathNotFoundError,
+        ):
+            return {}
+
+    return store_cache.get(
+        key=("attrs", zarr_url),
+        zarr_url=zarr_url,
+        files=GROUP_SIGNATURE_FILES,
+        loader=load_attrs,
+    )
+
 
+def read_table(zarr_url, roi_table):
+    # Returns the (cached) AnnData table `roi_table` of the OME-Zarr image
+    zarr_url = normalize_url(zarr_url)
+    table_url = join_url(zarr_url, "tables", roi_table)
 
-@lru_cache(maxsize=16)
-def read_table(zarr_url: Path, roi_table):
-    # FIXME: Make this work for cloud-based files => different paths
-    table_url = zarr_url / f"tables/{roi_table}"
-    return ad.read_zarr(table_url)
+    def load_table():
+        try:
+            group = get_consolidated_node(table_url)
+        except KeyError:
+            raise zarr.errors.PathNotFoundError(table_url) from None
+        if group is not None:
+            # Reads the table's metadata from the consolidated metadata
+            return ad.read_zarr(group)
+        return ad.read_zarr(get_store(table_url))
+
+    return store_cache.get(
+        key=("table", zarr_url, roi_table),
+        zarr_url=table_url,
+        files=TABLE_SIGNATURE_FILES,
+        loader=load_table,
+    )
 
 
 def get_channel_dict(zarr_url):
-    metadata = get_metadata(zarr_url)
+    metadata = get_attrs(zarr_url)
     channel_dict = {}
     try:
-        for i, channel in enumerate(metadata.attrs["omero"]["channels"]):
+        for i, channel in enumerate(metadata["omero"]["channels"]):
             channel_dict[i] = channel
     except KeyError:
         pass
@@ -101,18 +615,30 @@ def get_channel_dict(zarr_url):
     return channel_dict
 
 
+def get_channel_window(zarr_url, channel_index, dtype=None):
+    # Returns the (start, end) display window of a channel from the omero
+    # metadata. Channels without window use the range of the (integer)
+    # dtype of the image or (0, 1) for float images
+    window = get_channel_dict(zarr_url).get(channel_index, {}).get("window")
+    if window and "start" in window and "end" in window:
+        return float(window["start"]), float(window["end"])
+    if dtype is not None and np.issubdtype(dtype, np.integer):
+        return float(np.iinfo(dtype).min), float(np.iinfo(dtype).max)
+    return 0.0, 1.0
+
+
 def get_label_dict(label_zarr_url):
     # Based on the label_zarr_url, load the available labels
     # params: label_zarr_url: Path to the label folder in the OME-Zarr file
 
     # Check that the label folder exists
-    if not label_zarr_url.exists():
+    if not url_exists(label_zarr_url):
         return {}
 
-    metadata = get_metadata(label_zarr_url)
+    metadata = get_attrs(label_zarr_url)
     label_dict = {}
     try:
-        for i, label in enumerate(metadata.attrs["labels"]):
+        for i, label in enumerate(metadata["labels"]):
             label_dict[i] = label
     except KeyError:
         pass
@@ -127,13 +653,13 @@ def get_feature_dict(feature_zarr_url):
     # TODO: Once we have metadata for it, exclude ROI tables from this list
 
     # Check that the label folder exists
-    if not feature_zarr_url.exists():
+    if not url_exists(feature_zarr_url):
         return {}
 
-    metadata = get_metadata(feature_zarr_url)
+    metadata = get_attrs(feature_zarr_url)
     label_dict = {}
     try:
-        for i, feature in enumerate(metadata.attrs["tables"]):
+        for i, feature in enumerate(metadata["tables"]):
             label_dict[i] = feature
     except KeyError:
         pass
@@ -149,6 +675,127 @@ def load_features(zarr_url, feature_table):
     return feature_ad
 
 
+def get_feature_table_labels(zarr_url, feature_table):
+    # Reads only the obs/label column of a feature table
+    # params: zarr_url: Path to the OME-Zarr file (the base folder)
+    # params: feature_table: Name of the feature table
+    # returns the label of each row as an int numpy array or None if the
+    # feature table does not have a label obs column
+    zarr_url = normalize_url(zarr_url)
+    table_url = join_url(zarr_url, "tables", feature_table)
+
+    def load_labels():
+        obs = get_metadata(table_url)["obs"]
+        if "label" not in obs:
+            return None
+        return np.asarray(read_elem(obs["label"])).astype(int)
+
+    return store_cache.get(
+        key=("table_labels", zarr_url, feature_table),
+        zarr_url=table_url,
+        files=TABLE_SIGNATURE_FILES,
+        loader=load_labels,
+    )
+
+
+def get_feature_table_columns(zarr_url, feature_table):
+    # Reads only the var names (the feature names) of a feature table
+    # returns a list of the column names of X
+    zarr_url = normalize_url(zarr_url)
+    table_url = join_url(zarr_url, "tables", feature_table)
+    return store_cache.get(
+        key=("table_columns", zarr_url, feature_table),
+        zarr_url=table_url,
+        files=TABLE_SIGNATURE_FILES,
+        loader=lambda: list(read_elem(get_metadata(table_url)["var"]).index),
+    )
+
+
+def read_feature_rows(zarr_url, feature_table, rows, columns=None):
+    # Reads only the given rows (and optionally columns) of the X matrix of
+    # a feature table. Only the zarr chunks containing these rows are read.
+    # params: rows: Sorted integer indices of the rows to read
+    # params: columns: Optional list of feature names to read. Reads all
+    #                  columns if None
+    # returns a dataframe with the feature names as columns
+    zarr_url = normalize_url(zarr_url)
+    table_url = join_url(zarr_url, "tables", feature_table)
+    var_names = get_feature_table_columns(zarr_url, feature_table)
+    if columns is None:
+        col_indices = np.arange(len(var_names))
+    else:
+        col_indices = np.array([var_names.index(col) for col in columns])
+
+    X = get_metadata(table_url)["X"]
+    if isinstance(X, zarr.Array):
+        data = X.get_orthogonal_selection((rows, col_indices))
+    else:
+        # Sparse X matrices are stored as groups, fall back to reading the
+        # whole table
+        data = read_table(zarr_url, feature_table).X[rows][:, col_indices]
+        if hasattr(data, "toarray"):
+            data = data.toarray()
+
+    return pd.DataFrame(
+        data, columns=[var_names[col_index] for col_index in col_indices]
+    )
+
+
+def load_roi_features(
+    zarr_url,
+    feature_table,
+    label_roi,
+    roi_name,
+    columns=None,
+    label_ids=None,
+    feature_columns=None,
+):
+    # Load the features of the labels present in a label ROI. Only the
+    # label column & the rows of the labels in the ROI are read from the
+    # feature table.
+    # params: zarr_url: Path to the OME-Zarr file (the base folder)
+    # params: feature_table: Name of the feature table to load
+    # params: label_roi: Label image of the ROI (numpy or dask array)
+    # params: roi_name: Name of the ROI, used for the roi_id column
+    # params: columns: Optional list of feature names to load (default: all)
+    # params: label_ids: Optional label IDs present in the ROI, e.g. from
+    #                    get_roi_label_counts. label_roi is not used if set
+    # params: feature_columns: Optional memory-mapped columns of the feature
+    #                          table (see feature_cache), read instead of
+    #                          the AnnData table
+    # returns a dataframe indexed by label or None if the feature table
+    # does not have a label obs column
+    with stage("feature_labels", feature_table):
+        if feature_columns is not None:
+            table_labels = feature_columns.labels
+        else:
+            table_labels = get_feature_table_labels(zarr_url, feature_table)
+    if table_labels is None:
+        return None
+
+    if label_ids is None:
+        with stage("count_labels"):
+            label_ids, _ = count_labels(label_roi)
+    rows = np.flatnonzero(np.isin(table_labels, label_ids))
+    with stage("read_features", feature_table):
+        if feature_columns is not None:
+            features_df = feature_columns.read_rows(rows, columns=columns)
+        else:
+            features_df = read_feature_rows(
+                zarr_url, feature_table, rows, columns=columns
+            )
+    # Drop duplicate columns (cached feature columns are already unique)
+    duplicated = features_df.columns.duplicated()
+    if duplicated.any():
+        features_df = features_df.loc[:, ~duplicated].copy()
+    features_df["label"] = table_labels[rows]
+    features_df["roi_id"] = f"{zarr_url}:ROI_{roi_name}"
+    features_df.set_index("label", inplace=True, drop=False)
+    # To display correct
+    features_df["index"] = features_df["label"]
+    return features_df
+
+
 def load_intensity_roi(
     zarr_url,
     roi_of_interest,
@@ -156,21 +803,212 @@ def load_intensity_roi(
     level=0,
     roi_table="FOV_ROI_table",
     reset_origin=False,
+    margin=0.0,
+    cancel_event=None,
+    projection=None,
+    z_range=None,
+    display_dtype=None,
 ):
     # Loads the intensity image of a given ROI in a well
     # returns the image as a numpy array + a list of the image scale
+    # The image is optionally projected along Z (see project_roi) &
+    # rescaled to a display dtype (see to_display_dtype)
+    img_rois, scale_img = load_intensity_rois(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        channel_indices=[channel_index],
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+        cancel_event=cancel_event,
+        projection=projection,
+        z_range=z_range,
+        display_dtype=display_dtype,
+    )
+    return img_rois[0], scale_img
+
+
+def load_intensity_rois(
+    zarr_url,
+    roi_of_interest,
+    channel_indices,
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    cancel_event=None,
+    projection=None,
+    z_range=None,
+    display_dtype=None,
+):
+    # Loads the intensity images of multiple channels of a given ROI in a
+    # well. All channels are sliced in a single dask graph & computed in one
+    # pass, so chunks spanning multiple channels are only read once and
+    # chunk reads run in parallel. With a projection (see project_roi), the
+    # chunks are projected as they are read & only the projections are
+    # held in memory. With a display_dtype, each channel is rescaled to it
+    # using its omero window (see to_display_dtype).
+    # returns the images as a numpy array with the channels as the first
+    # axis (in the order of channel_indices) + a list of the image scale
+    # Setting the optional cancel_event (threading.Event) aborts the load
+    # with a LoadCancelled exception
+    if projection is None and display_dtype is None:
+        # Nothing to compute on the chunks: they are decoded straight into
+        # the result without a dask graph
+        return read_intensity_rois(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_of_interest,
+            channel_indices=channel_indices,
+            level=level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+            cancel_event=cancel_event,
+        )
+    img_roi, scale_img = get_lazy_intensity_roi(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    img_roi = img_roi[list(channel_indices)]
+    windows = [
+        get_channel_window(zarr_url, channel_index, img_roi.dtype)
+        for channel_index in channel_indices
+    ]
+    if len(scale_img) == 3:
+        # 2D images (without Z axis) are not projected
+        windows = [
+            get_projection_window(window, img_roi, projection, z_range)
+            for window in windows
+        ]
+        img_roi = project_roi(img_roi, projection, z_range)
+    img_roi = _to_display_dtype_channels(img_roi, windows, display_dtype)
+
+    return compute_roi(img_roi, cancel_event), scale_img
+
+
+def _to_display_dtype_channels(img_roi, windows, display_dtype):
+    # Rescales each channel of a multi-channel ROI with its own window
+    if display_dtype is None:
+        return img_roi
+    return da.stack(
+        [
+            to_display_dtype(img_roi[i], window, display_dtype)
+            for i, window in enumerate(windows)
+        ]
+    )
+
+
+def read_intensity_rois(
+    zarr_url,
+    roi_of_interest,
+    channel_indices,
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    out=None,
+    pool=None,
+    cancel_event=None,
+):
+    # Reads the intensity images of multiple channels of a given ROI with
+    # read_roi, i.e. the chunks are decoded straight into `out` without
+    # building a dask graph. All channels are read in one selection, so
+    # chunks spanning multiple channels are only read once
+    # params: out: Optional writable array of shape (channels, z, y, x),
+    #         e.g. from a buffers.BufferPool
+    # params: pool: Optional BufferPool that out is taken from if it isn't
+    #         given
+    # returns the images (out) with the channels as the first axis + a
+    # list of the image scale
+    selection, scale_img = get_intensity_roi_selection(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    if out is not None and len(out) != len(channel_indices):
+        raise ValueError(
+            f"The output array has {len(out)} channels, "
+            f"{len(channel_indices)} channels are read"
+        )
+    out = read_roi(
+        join_url(zarr_url, level),
+        (list(channel_indices),) + selection,
+        out=out,
+        pool=pool,
+        cancel_event=cancel_event,
+    )
+    return out, scale_img
+
+
+def load_intensity_roi_pyramid(
+    zarr_url,
+    roi_of_interest,
+    channel_indices,
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+):
+    # Lazily loads the intensity images of multiple channels of a given ROI
+    # for all pyramid levels starting at `level`. Nothing is read from disk
+    # until the arrays are computed (e.g. by napari for the visible tiles).
+    # returns a list of dask arrays (one per level, from high to low
+    # resolution) with the channels as the first axis + a list of the image
+    # scale of the highest resolution level
+    dataset = 0  # FIXME, hard coded in case multiple multiscale
+    # datasets would be present & multiscales is a list
+    metadata = get_attrs(zarr_url)
+    nb_levels = len(metadata["multiscales"][dataset]["datasets"])
+
+    pyramid = []
+    scale_img = None
+    for pyramid_level in range(level, nb_levels):
+        img_roi, scale_level = get_lazy_intensity_roi(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_of_interest,
+            level=pyramid_level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+        )
+        pyramid.append(img_roi[list(channel_indices)])
+        if scale_img is None:
+            scale_img = scale_level
+
+    return pyramid, scale_img
+
+
+def get_intensity_roi_selection(
+    zarr_url,
+    roi_of_interest,
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+):
+    # Resolves a given ROI of the intensity image at a given level into a
+    # selection of the zarr array (without the channel axis), without
+    # reading any data
+    # returns the selection as a tuple of slices + a list of the image scale
+    # The ROI is grown by `margin` micrometers on each side (see add_margin)
 
     # image_index defaults to 0 (Change if you have more than one
     # image per well) => FIXME for multiplexing
 
-    # Get the ROI table
-    roi_an = read_table(zarr_url, roi_table)
-
     # Load the pixel sizes from the OME-Zarr file
     dataset = 0  # FIXME, hard coded in case multiple multiscale
     # datasets would be present & multiscales is a list
-    metadata = get_metadata(zarr_url)
-    scale_img = metadata.attrs["multiscales"][dataset]["datasets"][level][
+    with stage("metadata"):
+        metadata = get_attrs(zarr_url)
+    scale_img = metadata["multiscales"][dataset]["datasets"][level][
         "coordinateTransformations"
     ][0]["scale"]
 
@@ -185,27 +1023,56 @@ def load_intensity_roi(
     # (all Yokogawa images are saved as 3D images) and
     # by accident for 2D MD images (if they are multichannel)
     # See issue 420 on fractal-tasks-core
-    indices_dict = convert_ROI_table_to_indices(
-        roi_an,
-        pxl_sizes_zyx=scale_img,
+    indices_dict = get_roi_indices(
+        zarr_url,
+        roi_table,
+        pxl_sizes_zyx=tuple(scale_img),
         reset_origin=reset_origin,
     )
 
     # Get the indices for a given roi
-    indices = indices_dict[roi_of_interest]
+    indices = add_margin(indices_dict[roi_of_interest], margin, scale_img)
     s_z, e_z, s_y, e_y, s_x, e_x = indices[:]
 
-    # Load data
-    img_data_zyx = da.from_zarr(f"{zarr_url}/{level}")[channel_index]
-    if len(img_data_zyx.shape) == 2:
-        img_roi = img_data_zyx[s_y:e_y, s_x:e_x]
+    with stage("open_array"):
+        ndim = get_array(join_url(zarr_url, level)).ndim
+    if ndim == 3:
+        selection = (slice(s_y, e_y), slice(s_x, e_x))
         # FIXME: Hacky way to drop the channel dimension from the scale
         # (for MD data)
         scale_img = scale_img[1:]
     else:
-        img_roi = img_data_zyx[s_z:e_z, s_y:e_y, s_x:e_x]
+        selection = (slice(s_z, e_z), slice(s_y, e_y), slice(s_x, e_x))
+
+    return selection, scale_img
+
 
-    return np.array(img_roi), scale_img
+def get_lazy_intensity_roi(
+    zarr_url,
+    roi_of_interest,
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+):
+    # Slices a given ROI out of the intensity image at a given level
+    # without reading any data
+    # returns the ROI as a dask array (with all channels) + a list of the
+    # image scale
+    # The ROI is grown by `margin` micrometers on each side (see add_margin)
+    selection, scale_img = get_intensity_roi_selection(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    with stage("open_array"):
+        img_data_czyx = lazy_array(join_url(zarr_url, level))
+    img_roi = img_data_czyx[(slice(None),) + selection]
+
+    return img_roi, scale_img
 
 
 def load_label_roi(
@@ -215,26 +1082,194 @@ def load_label_roi(
     target_scale=None,
     roi_table="FOV_ROI_table",
     reset_origin=False,
+    margin=0.0,
+    cancel_event=None,
+    projection=None,
+    z_range=None,
 ):
     # Loads the label image of a given ROI in a well
     # returns the image as a numpy array + a list of the image scale
+    # The labels are optionally projected along Z (see project_roi), only
+    # "max" keeps the label values meaningful
+    with stage("metadata"):
+        level = get_label_level(zarr_url, label_name, target_scale)
+    if projection is None:
+        # The chunks are decoded straight into the result
+        return read_label_roi(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_of_interest,
+            label_name=label_name,
+            level=level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+            cancel_event=cancel_event,
+        )
+    lbl_roi, scale_lbls = get_lazy_label_roi(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        label_name=label_name,
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    lbl_roi = project_roi(lbl_roi, projection, z_range)
 
-    # Get the ROI table
-    roi_an = read_table(zarr_url, roi_table)
+    return compute_roi(lbl_roi, cancel_event), scale_lbls
 
-    # Load the pixel sizes from the OME-Zarr file
-    scales = get_available_scales(zarr_url / "labels" / label_name)
+
+def read_label_roi(
+    zarr_url,
+    roi_of_interest,
+    label_name,
+    level="0",
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    out=None,
+    pool=None,
+    cancel_event=None,
+):
+    # Reads the label image of a given ROI at a given level with read_roi,
+    # i.e. the chunks are decoded straight into `out` (optional, of shape
+    # (z, y, x), or taken from the optional BufferPool `pool`) without
+    # building a dask graph
+    # returns the label image (out) + a list of the label scale
+    selection, scale_lbls = get_label_roi_selection(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        label_name=label_name,
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    lbl_roi = read_roi(
+        join_url(zarr_url, "labels", label_name, level),
+        selection,
+        out=out,
+        pool=pool,
+        cancel_event=cancel_event,
+    )
+    return lbl_roi, scale_lbls
+
+
+def load_label_roi_pyramid(
+    zarr_url,
+    roi_of_interest,
+    label_name,
+    target_scale=None,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+):
+    # Lazily loads the label image of a given ROI for all pyramid levels,
+    # starting at the level closest to the target_scale
+    # returns a list of dask arrays (one per level, from high to low
+    # resolution) + a list of the scale of the highest resolution level
+    level = get_label_level(zarr_url, label_name, target_scale)
+    scales = get_available_scales(join_url(zarr_url, "labels", label_name))
+    levels = list(scales.keys())
+    start_level = levels.index(level)
+    levels = levels[start_level:]
+
+    pyramid = []
+    scale_lbls = None
+    for pyramid_level in levels:
+        lbl_roi, scale_level = get_lazy_label_roi(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_of_interest,
+            label_name=label_name,
+            level=pyramid_level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+        )
+        pyramid.append(lbl_roi)
+        if scale_lbls is None:
+            scale_lbls = scale_level
+
+    return pyramid, scale_lbls
+
+
+def get_label_level(zarr_url, label_name, target_scale=None):
+    # Returns the level (path) of the label image closest to the target_scale
+    scales = get_available_scales(join_url(zarr_url, "labels", label_name))
 
     # FIXME: Handling 2D images vs. 3D label images. More general solution?
-    if len(target_scale) == 2 and len(scales["0"]) == 3:
+    if target_scale and len(target_scale) == 2 and len(scales["0"]) == 3:
         target_scale = [1] + target_scale
 
     if target_scale:
-        level = get_closest_scale(target_scale, scales)
-        scale_lbls = scales[level]
+        return get_closest_scale(target_scale, scales)
     else:
-        level = "0"
-        scale_lbls = scales[level]
+        return "0"
+
+
+def get_roi_label_counts(
+    zarr_url,
+    roi_of_interest,
+    label_name,
+    level="0",
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    cancel_event=None,
+):
+    # Returns the label IDs present in a ROI of a label image & their voxel
+    # counts (see count_labels). Only the chunks of the ROI are read and
+    # the result is cached per label image, level & ROI.
+    key = (
+        "label_counts",
+        normalize_url(zarr_url),
+        label_name,
+        level,
+        roi_table,
+        roi_of_interest,
+        reset_origin,
+        margin,
+    )
+    label_url = join_url(normalize_url(zarr_url), "labels", label_name, level)
+
+    def load_counts():
+        lbl_roi, _ = get_lazy_label_roi(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_of_interest,
+            label_name=label_name,
+            level=level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+        )
+        return count_labels(lbl_roi, cancel_event=cancel_event)
+
+    with stage("count_labels", label_name):
+        return store_cache.get(
+            key=key,
+            zarr_url=label_url,
+            files=(".zarray",),
+            loader=load_counts,
+        )
+
+
+def get_label_roi_selection(
+    zarr_url,
+    roi_of_interest,
+    label_name,
+    level="0",
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+):
+    # Resolves a given ROI of the label image at a given level into a
+    # selection of the zarr array, without reading any data
+    # returns the selection as a tuple of slices + a list of the label scale
+    # The ROI is grown by `margin` micrometers on each side (see add_margin)
+    # Load the pixel sizes from the OME-Zarr file
+    with stage("metadata"):
+        scales = get_available_scales(join_url(zarr_url, "labels", label_name))
+    scale_lbls = scales[level]
 
     # FIXME: This is a hack to deal with the fact that the scale can contain
     # the channel as well and out processing functions don't handle that well.
@@ -247,29 +1282,59 @@ def load_label_roi(
     # (all Yokogawa images are saved as 3D images) and
     # by accident for 2D MD images (if they are multichannel)
     # See issue 420 on fractal-tasks-core
-    indices_dict = convert_ROI_table_to_indices(
-        roi_an,
-        pxl_sizes_zyx=scale_lbls,
+    indices_dict = get_roi_indices(
+        zarr_url,
+        roi_table,
+        pxl_sizes_zyx=tuple(scale_lbls),
         reset_origin=reset_origin,
     )
 
     # Get the indices for a given roi
-    indices = indices_dict[roi_of_interest]
+    indices = add_margin(indices_dict[roi_of_interest], margin, scale_lbls)
     s_z, e_z, s_y, e_y, s_x, e_x = indices[:]
 
-    # Load data
-    lbl_data_zyx = da.from_zarr(zarr_url / "labels" / label_name / level)
-    lbl_roi = lbl_data_zyx[s_z:e_z, s_y:e_y, s_x:e_x]
+    selection = (slice(s_z, e_z), slice(s_y, e_y), slice(s_x, e_x))
 
-    return np.array(lbl_roi), scale_lbls
+    return selection, scale_lbls
+
+
+def get_lazy_label_roi(
+    zarr_url,
+    roi_of_interest,
+    label_name,
+    level="0",
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+):
+    # Slices a given ROI out of the label image at a given level without
+    # reading any data
+    # returns the ROI as a dask array + a list of the label scale
+    # The ROI is grown by `margin` micrometers on each side (see add_margin)
+    selection, scale_lbls = get_label_roi_selection(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        label_name=label_name,
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    with stage("open_array"):
+        lbl_data_zyx = lazy_array(
+            join_url(zarr_url, "labels", label_name, level)
+        )
+    lbl_roi = lbl_data_zyx[selection]
+
+    return lbl_roi, scale_lbls
 
 
 def get_available_scales(zarr_url):
-    metadata = get_metadata(zarr_url)
+    metadata = get_attrs(zarr_url)
     dataset = 0  # FIXME, hard coded in case multiple multiscale
     # datasets would be present & multiscales is a list
     available_scales = {}
-    levels = metadata.attrs["multiscales"][dataset]["datasets"]
+    levels = metadata["multiscales"][dataset]["datasets"]
     for level in levels:
         for transformation in level["coordinateTransformations"]:
             if transformation["type"] == "scale":
@@ -300,3 +1365,108 @@ def get_closest_scale(target_scale, scales):
             closest_scale = key
 
     return closest_scale
+
+
+def get_nb_levels(zarr_url):
+    # Returns the number of pyramid levels of an image (0 if there is no
+    # multiscales metadata)
+    try:
+        return len(get_attrs(zarr_url)["multiscales"][0]["datasets"])
+    except (KeyError, IndexError):
+        return 0
+
+
+def estimate_roi_nbytes(
+    zarr_url,
+    roi_of_interest,
+    channel_indices,
+    labels=(),
+    level=0,
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    projection=None,
+    z_range=None,
+    display_dtype=None,
+):
+    # Estimates how many bytes loading a ROI at a given level takes: the
+    # voxels of the ROI (clipped to the image) times the dtype size, for all
+    # channels & the label images. Like in the widget, label images are
+    # loaded at the level closest to the image level, or at full resolution
+    # if no channels are loaded. Only the metadata & the ROI table are read.
+    # With a projection, the size of the projected ROI is estimated (labels
+    # are max projected) & display dtypes reduce the size of the channels.
+    img_roi, scale_img = get_lazy_intensity_roi(
+        zarr_url=zarr_url,
+        roi_of_interest=roi_of_interest,
+        level=level,
+        roi_table=roi_table,
+        reset_origin=reset_origin,
+        margin=margin,
+    )
+    img_roi = img_roi[list(channel_indices)]
+    if len(scale_img) == 3:
+        img_roi = project_roi(img_roi, projection, z_range)
+    nbytes = img_roi.nbytes
+    if display_dtype is not None:
+        nbytes = img_roi.size * np.dtype(display_dtype).itemsize
+    target_scale = scale_img if len(channel_indices) > 0 else None
+    for label in labels:
+        lbl_roi, _ = get_lazy_label_roi(
+            zarr_url=zarr_url,
+            roi_of_interest=roi_of_interest,
+            label_name=label,
+            level=get_label_level(zarr_url, label, target_scale),
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+        )
+        lbl_roi = project_roi(lbl_roi, label_projection(projection), z_range)
+        nbytes += lbl_roi.nbytes
+    return int(nbytes)
+
+
+def get_auto_level(
+    zarr_url,
+    roi_of_interest,
+    channel_indices,
+    max_bytes,
+    labels=(),
+    roi_table="FOV_ROI_table",
+    reset_origin=False,
+    margin=0.0,
+    projection=None,
+    z_range=None,
+    display_dtype=None,
+):
+    """
+    Picks the finest pyramid level at which a ROI fits a memory budget
+
+    params: channel_indices: Indices of the channels that are loaded
+            max_bytes: Memory budget of the load in bytes
+            labels: Names of the label images that are loaded
+            projection: Z projection of the load (see project_roi)
+            display_dtype: Display dtype of the channels (see
+                           to_display_dtype)
+    returns the level & the estimated size of the load at that level in
+    bytes. If the ROI does not fit the budget at any level, the coarsest
+    level is returned.
+    """
+    level, nbytes = 0, 0
+    for level in range(get_nb_levels(zarr_url)):
+        nbytes = estimate_roi_nbytes(
+            zarr_url,
+            roi_of_interest,
+            channel_indices,
+            labels=labels,
+            level=level,
+            roi_table=roi_table,
+            reset_origin=reset_origin,
+            margin=margin,
+            projection=projection,
+            z_range=z_range,
+            display_dtype=display_dtype,
+        )
+        if nbytes <= max_bytes:
+            break
+    return level, nbytes
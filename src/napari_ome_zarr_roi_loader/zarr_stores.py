@@ -0,0 +1,73 @@
+"""
+zarr stores used by stores.py
+
+Kept separate from stores.py because subclassing the zarr stores imports
+zarr, which stores.py only imports on first use (see imports.py).
+"""
+import time
+
+from zarr.storage import DirectoryStore, FSStore
+
+from napari_ome_zarr_roi_loader.instrumentation import record_chunk_reads
+from napari_ome_zarr_roi_loader.stores import get_max_concurrent_requests
+
+
+class ConcurrentFSStore(FSStore):
+    """
+    Read-only fsspec store that fetches multiple chunks concurrently
+
+    The number of requests in flight is limited by
+    get_max_concurrent_requests() at the time of the read.
+    """
+
+    def __init__(self, url, **storage_options):
+        super().__init__(url, mode="r", **storage_options)
+
+    def getitems(self, keys, *, contexts=None):
+        paths = [
+            self.map._key_to_str(self._normalize_key(key)) for key in keys
+        ]
+        if not paths:
+            return {}
+        kwargs = {}
+        if getattr(self.fs, "async_impl", False):
+            kwargs["batch_size"] = get_max_concurrent_requests()
+        start = time.perf_counter()
+        results = self.fs.cat(paths, on_error="return", **kwargs)
+        if isinstance(results, bytes):
+            results = {paths[0]: results}
+        record_chunk_reads(
+            len(paths),
+            sum(len(v) for v in results.values() if isinstance(v, bytes)),
+            time.perf_counter() - start,
+        )
+
+        items = {}
+        for key, path in zip(keys, paths):
+            value = results.get(path, KeyError(path))
+            if isinstance(value, self.exceptions):
+                # Missing chunks are filled with the fill value by zarr
+                continue
+            if isinstance(value, Exception):
+                raise value
+            items[key] = value
+        return items
+
+
+class CountingDirectoryStore(DirectoryStore):
+    """
+    Local store that records its chunk reads (see instrumentation)
+
+    Used as the chunk store of local arrays, so metadata reads are not
+    counted.
+    """
+
+    def getitems(self, keys, *, contexts=None):
+        start = time.perf_counter()
+        items = {key: self[key] for key in keys if key in self}
+        record_chunk_reads(
+            len(keys),
+            sum(len(value) for value in items.values()),
+            time.perf_counter() - start,
+        )
+        return items